@@ -0,0 +1,247 @@
+import os
+import json
+import hashlib
+import logging
+import functools
+import ydb
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'idempotency-key'
+MAX_KEY_LENGTH = 255
+
+# How long a stored response is replayed for a retried key
+RESPONSE_TTL_HOURS = 24
+
+# A claim older than this belongs to an invocation that died mid-request and may be taken over
+IN_PROGRESS_TIMEOUT_SECONDS = 60
+
+IDEMPOTENCY_KEYS_TABLE = """
+CREATE TABLE idempotency_keys (
+    user_id Utf8 NOT NULL,
+    endpoint Utf8 NOT NULL,
+    idempotency_key Utf8 NOT NULL,
+    request_hash Utf8,
+    status Utf8,
+    response Utf8,
+    created_at Timestamp,
+    expires_at Timestamp,
+    PRIMARY KEY (user_id, endpoint, idempotency_key)
+)
+WITH (TTL = Interval("PT0S") ON expires_at);
+"""
+
+def create_idempotency_keys_table(pool: ydb.SessionPool):
+    """Create the idempotency_keys table (run once)"""
+    pool.retry_operation_sync(lambda session: session.execute_scheme(IDEMPOTENCY_KEYS_TABLE))
+
+# Session pool kept across warm invocations; the handlers open their own drivers per request
+_pool = None
+
+def get_pool() -> ydb.SessionPool:
+    global _pool
+    if _pool is None:
+        driver = ydb.Driver(ydb.DriverConfig(
+            endpoint=os.environ.get('YDB_ENDPOINT'),
+            database=os.environ.get('YDB_DATABASE'),
+            credentials=ydb.iam.MetadataUrlCredentials()
+        ))
+        driver.wait(fail_fast=True, timeout=5)
+        _pool = ydb.SessionPool(driver)
+    return _pool
+
+def to_datetime(value):
+    """Convert YDB timestamp (microseconds) to datetime"""
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value / 1000000)
+    return value
+
+def get_idempotency_key(event: dict) -> Optional[str]:
+    """Idempotency-Key header value (case-insensitive), or None if the client sent none"""
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == IDEMPOTENCY_HEADER and value:
+            return value.strip()
+    return None
+
+def request_hash(event: dict) -> str:
+    """Fingerprint of the request a key was first used for"""
+    fingerprint = json.dumps({
+        'path': event.get('pathParameters') or {},
+        'body': event.get('body') or ''
+    }, sort_keys=True)
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+class IdempotencyStore:
+    """First responses per (user, endpoint, key) in idempotency_keys"""
+
+    def __init__(self, pool: ydb.SessionPool):
+        self.pool = pool
+
+    def claim(self, user_id: str, endpoint: str, key: str, fingerprint: str) -> Dict[str, Any]:
+        """
+        Claim a key for this request, or report who already holds it
+
+        Returns {'state': 'claimed'} when the request should run, otherwise the
+        existing record with state 'completed' or 'in_progress'.
+        """
+        def execute_query(session):
+            select_query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $endpoint AS Utf8;
+                DECLARE $key AS Utf8;
+                SELECT request_hash, status, response, created_at, expires_at
+                FROM idempotency_keys
+                WHERE user_id = $user_id AND endpoint = $endpoint AND idempotency_key = $key;
+            """
+            upsert_query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $endpoint AS Utf8;
+                DECLARE $key AS Utf8;
+                DECLARE $request_hash AS Utf8;
+                DECLARE $now AS Timestamp;
+                DECLARE $expires_at AS Timestamp;
+                UPSERT INTO idempotency_keys (user_id, endpoint, idempotency_key, request_hash, status, response, created_at, expires_at)
+                VALUES ($user_id, $endpoint, $key, $request_hash, 'in_progress', NULL, $now, $expires_at);
+            """
+            params = {'$user_id': user_id, '$endpoint': endpoint, '$key': key}
+            now = datetime.utcnow()
+            tx = session.transaction(ydb.SerializableReadWrite())
+            rows = tx.execute(session.prepare(select_query), params)[0].rows
+            if rows:
+                row = rows[0]
+                # TTL deletion runs in the background, so expired rows may still be read
+                expired = to_datetime(row.expires_at) <= now
+                stale = row.status == 'in_progress' and now - to_datetime(row.created_at) > timedelta(seconds=IN_PROGRESS_TIMEOUT_SECONDS)
+                if not expired and not stale:
+                    tx.commit()
+                    return {
+                        'state': row.status,
+                        'request_hash': row.request_hash,
+                        'response': json.loads(row.response) if row.response else None
+                    }
+            tx.execute(
+                session.prepare(upsert_query),
+                dict(params, **{
+                    '$request_hash': fingerprint,
+                    '$now': now,
+                    '$expires_at': now + timedelta(hours=RESPONSE_TTL_HOURS)
+                })
+            )
+            tx.commit()
+            return {'state': 'claimed'}
+
+        return self.pool.retry_operation_sync(execute_query)
+
+    def complete(self, user_id: str, endpoint: str, key: str, response: Dict[str, Any]):
+        """Store the response replayed for later requests with the key"""
+        def execute_query(session):
+            query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $endpoint AS Utf8;
+                DECLARE $key AS Utf8;
+                DECLARE $response AS Utf8;
+                UPDATE idempotency_keys
+                SET status = 'completed', response = $response
+                WHERE user_id = $user_id AND endpoint = $endpoint AND idempotency_key = $key;
+            """
+            session.transaction(ydb.SerializableReadWrite()).execute(
+                session.prepare(query),
+                {'$user_id': user_id, '$endpoint': endpoint, '$key': key, '$response': json.dumps(response)},
+                commit_tx=True
+            )
+
+        self.pool.retry_operation_sync(execute_query)
+
+    def release(self, user_id: str, endpoint: str, key: str):
+        """Drop a claim so a retry runs the request again"""
+        def execute_query(session):
+            query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $endpoint AS Utf8;
+                DECLARE $key AS Utf8;
+                DELETE FROM idempotency_keys
+                WHERE user_id = $user_id AND endpoint = $endpoint AND idempotency_key = $key;
+            """
+            session.transaction(ydb.SerializableReadWrite()).execute(
+                session.prepare(query),
+                {'$user_id': user_id, '$endpoint': endpoint, '$key': key},
+                commit_tx=True
+            )
+
+        self.pool.retry_operation_sync(execute_query)
+
+def error_response(status_code: int, message: str, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': dict({'Content-Type': 'application/json'}, **(headers or {})),
+        'body': json.dumps({'error': message})
+    }
+
+def authenticated_user_id(event: dict) -> Optional[str]:
+    """user_id idempotent() already authenticated the event as, or None"""
+    return ((event.get('requestContext') or {}).get('authorizer') or {}).get('user_id')
+
+def idempotent(endpoint: str, authenticate: Callable[[dict], Optional[str]], headers: Optional[Dict[str, str]] = None):
+    """
+    Replay the first response for requests repeating an Idempotency-Key header
+
+    The first request with a key claims it and runs; its response (anything
+    below 500) is stored for RESPONSE_TTL_HOURS and returned to retries
+    without running the handler again. A 5xx releases the key so the retry
+    runs. Requests without the header, or that fail authentication, go
+    straight to the handler.
+
+    authenticate(event) returns the user_id that scopes keys, or None. The
+    user_id is put in requestContext.authorizer, as jwt_required does, so the
+    handler can read it with authenticated_user_id() instead of
+    authenticating again. headers are added to the responses the decorator
+    builds itself (e.g. CORS headers the handler sets on its own responses).
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            key = get_idempotency_key(event)
+            if key is None:
+                return handler(event, context)
+            if len(key) > MAX_KEY_LENGTH:
+                return error_response(400, f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters', headers)
+
+            user_id = authenticate(event)
+            if not user_id:
+                return handler(event, context)
+            event.setdefault('requestContext', {}).setdefault('authorizer', {})['user_id'] = user_id
+
+            fingerprint = request_hash(event)
+            try:
+                store = IdempotencyStore(get_pool())
+                claim = store.claim(user_id, endpoint, key, fingerprint)
+            except Exception as e:
+                logger.error(f"Idempotency key lookup failed: {e}")
+                return error_response(500, 'Database operation failed', headers)
+
+            if claim['state'] != 'claimed':
+                if claim['request_hash'] != fingerprint:
+                    return error_response(422, 'Idempotency-Key was already used for a different request', headers)
+                if claim['state'] == 'in_progress':
+                    return error_response(409, 'A request with this Idempotency-Key is still in progress', headers)
+                logger.info(f"Replaying stored {endpoint} response for idempotency key {key}")
+                response = claim['response']
+                response['headers'] = dict(response.get('headers') or {}, **{'Idempotent-Replayed': 'true'})
+                return response
+
+            response = handler(event, context)
+            try:
+                if response.get('statusCode', 500) < 500:
+                    store.complete(user_id, endpoint, key, response)
+                else:
+                    store.release(user_id, endpoint, key)
+            except Exception as e:
+                # The claim expires after IN_PROGRESS_TIMEOUT_SECONDS; retries get 409 until then
+                logger.error(f"Could not store idempotent {endpoint} response: {e}")
+            return response
+
+        return wrapper
+
+    return decorator
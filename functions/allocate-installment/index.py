@@ -5,6 +5,7 @@ from datetime import datetime
 import uuid
 import ydb
 from jwt_auth import jwt_required
+from idempotency import idempotent
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,6 +15,15 @@ logger = logging.getLogger(__name__)
 YDB_ENDPOINT = os.environ.get('YDB_ENDPOINT')
 YDB_DATABASE = os.environ.get('YDB_DATABASE')
 
+# Sum of active allocations per installment, kept by allocate and void in the allocation transaction
+INSTALLMENT_ALLOCATED_COLUMN = """
+ALTER TABLE installments ADD COLUMN allocated_minor_units Int64;
+"""
+
+def add_allocated_column(pool: ydb.SessionPool):
+    """Add allocated_minor_units to installments (run once)"""
+    pool.retry_operation_sync(lambda session: session.execute_scheme(INSTALLMENT_ALLOCATED_COLUMN))
+
 def get_ydb_driver():
     """Create YDB driver instance"""
     return ydb.Driver(
@@ -22,7 +32,33 @@ def get_ydb_driver():
         credentials=ydb.credentials_from_env_variables()
     )
 
+def backfill_allocated_totals():
+    """Set allocated_minor_units on installments allocated to before the column existed (run once after the ALTER)"""
+    driver = get_ydb_driver()
+    try:
+        with ydb.SessionPool(driver) as pool:
+            def callee(session):
+                query = """
+                $totals = (
+                    SELECT user_id, installment_id, SUM(amount_minor_units) AS allocated_minor_units
+                    FROM installment_allocations
+                    WHERE status = 'active'
+                    GROUP BY user_id, installment_id
+                );
+                UPDATE installments ON
+                SELECT i.id AS id, i.user_id AS user_id, t.allocated_minor_units AS allocated_minor_units
+                FROM installments AS i
+                INNER JOIN $totals AS t ON t.installment_id = i.id AND t.user_id = i.user_id
+                WHERE i.allocated_minor_units IS NULL;
+                """
+                session.transaction(ydb.SerializableReadWrite()).execute(query, commit_tx=True)
+
+            pool.retry_operation_sync(callee)
+    finally:
+        driver.stop()
+
 @jwt_required
+@idempotent('allocate-installment', lambda event: event['requestContext']['authorizer']['user_id'])
 def handler(event, context):
     """
     Allocate funds from a wallet to an installment
@@ -99,7 +135,7 @@ def create_installment_allocation(installment_id, wallet_id, amount_minor_units,
                 try:
                     # Check if installment exists and get details
                     installment_query = """
-                    SELECT id, client_id, total_amount_minor_units, status
+                    SELECT id, client_id, total_amount_minor_units, status, allocated_minor_units
                     FROM installments 
                     WHERE id = $installment_id AND user_id = $user_id
                     """
@@ -139,18 +175,21 @@ def create_installment_allocation(installment_id, wallet_id, amount_minor_units,
                         raise ValueError("Insufficient wallet balance")
                     
                     # Check existing allocations to prevent over-allocation
-                    existing_allocations_query = """
-                    SELECT COALESCE(SUM(amount_minor_units), 0) as total_allocated
-                    FROM installment_allocations
-                    WHERE installment_id = $installment_id AND user_id = $user_id AND status = 'active'
-                    """
-                    
-                    existing_result = tx.execute(
-                        existing_allocations_query,
-                        {'$installment_id': installment_id, '$user_id': user_id}
-                    )
-                    
-                    total_allocated = list(existing_result[0].rows)[0].total_allocated
+                    total_allocated = installment.allocated_minor_units
+                    if total_allocated is None:
+                        # Installment allocated to before the column existed; sum once, then it is kept up to date
+                        existing_allocations_query = """
+                        SELECT COALESCE(SUM(amount_minor_units), 0) as total_allocated
+                        FROM installment_allocations
+                        WHERE installment_id = $installment_id AND user_id = $user_id AND status = 'active'
+                        """
+                        
+                        existing_result = tx.execute(
+                            existing_allocations_query,
+                            {'$installment_id': installment_id, '$user_id': user_id}
+                        )
+                        
+                        total_allocated = list(existing_result[0].rows)[0].total_allocated
                     remaining_amount = installment.total_amount_minor_units - total_allocated
                     
                     if amount_minor_units > remaining_amount:
@@ -182,14 +221,18 @@ def create_installment_allocation(installment_id, wallet_id, amount_minor_units,
                         '$created_at': now_iso
                     })
                     
+                    new_balance = wallet.balance_minor_units - amount_minor_units
+                    
                     # Create debit transaction for wallet
                     transaction_query = """
                     INSERT INTO ledger_transactions (
                         id, wallet_id, user_id, direction, amount_minor_units, currency,
-                        reference_type, reference_id, description, created_by, created_at
+                        reference_type, reference_id, description, created_by, created_at,
+                        balance_after_minor_units
                     ) VALUES (
                         $id, $wallet_id, $user_id, 'debit', $amount_minor_units, 'RUB',
-                        'installment', $reference_id, $description, $created_by, $created_at
+                        'installment', $reference_id, $description, $created_by, $created_at,
+                        $balance_after
                     )
                     """
                     
@@ -202,11 +245,24 @@ def create_installment_allocation(installment_id, wallet_id, amount_minor_units,
                         '$reference_id': installment_id,
                         '$description': description,
                         '$created_by': user_id,
-                        '$created_at': now_iso
+                        '$created_at': now_iso,
+                        '$balance_after': new_balance
+                    })
+                    
+                    # Keep the installment's allocated total in step with the new allocation
+                    installment_update_query = """
+                    UPDATE installments
+                    SET allocated_minor_units = $allocated_minor_units
+                    WHERE id = $installment_id AND user_id = $user_id
+                    """
+                    
+                    tx.execute(installment_update_query, {
+                        '$allocated_minor_units': total_allocated + amount_minor_units,
+                        '$installment_id': installment_id,
+                        '$user_id': user_id
                     })
                     
                     # Update wallet balance
-                    new_balance = wallet.balance_minor_units - amount_minor_units
                     new_version = wallet.version + 1
                     
                     balance_update_query = """
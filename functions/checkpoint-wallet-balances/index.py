@@ -0,0 +1,288 @@
+import os
+import json
+import logging
+import ydb
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from balance_checkpoints import (
+    CHECKPOINT_INTERVAL, WALLET_BALANCE_CHECKPOINTS_TABLE,
+    checkpoint_boundary, balance_at
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Wallets checkpointed per transaction
+WALLET_BATCH_SIZE = 100
+
+# Stop starting new batches after this many seconds (function timeout is 30s)
+TIME_BUDGET_SECONDS = 20
+
+# A boundary is checkpointed only once it is this old, so ledger rows stamped just
+# before midnight whose transactions commit after it are already visible
+CHECKPOINT_SETTLE_WINDOW = timedelta(minutes=10)
+
+# Progress of each day's checkpoint run, so later trigger runs resume where one stopped
+WALLET_CHECKPOINT_RUNS_TABLE = """
+CREATE TABLE wallet_checkpoint_runs (
+    as_of Timestamp NOT NULL,
+    status Utf8,
+    last_user_id Utf8,
+    last_wallet_id Utf8,
+    wallets_checked Uint64,
+    started_at Timestamp,
+    completed_at Timestamp,
+    PRIMARY KEY (as_of)
+);
+"""
+
+CHECKPOINT_ROWS_TYPE = "List<Struct<user_id: Utf8, wallet_id: Utf8, as_of: Timestamp, balance_minor_units: Int64, entry_count: Uint64, created_at: Timestamp>>"
+
+def get_ydb_driver():
+    """Create and return YDB driver"""
+    endpoint = os.environ['YDB_ENDPOINT']
+    database = os.environ['YDB_DATABASE']
+
+    driver_config = ydb.DriverConfig(
+        endpoint=endpoint,
+        database=database,
+        credentials=ydb.iam.MetadataUrlCredentials(),
+    )
+
+    driver = ydb.Driver(driver_config)
+    driver.wait(fail_fast=True)
+    return driver
+
+def initialize_checkpoint_tables():
+    """Create the wallet_balance_checkpoints and wallet_checkpoint_runs tables (run once)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        for table in (WALLET_BALANCE_CHECKPOINTS_TABLE, WALLET_CHECKPOINT_RUNS_TABLE):
+            pool.retry_operation_sync(lambda session, table=table: session.execute_scheme(table))
+        logger.info("Wallet checkpoint tables created successfully")
+    finally:
+        driver.stop()
+
+def get_or_create_run(pool: ydb.SessionPool, as_of: datetime) -> Dict[str, Any]:
+    """The checkpoint run for as_of, started if this is the first trigger of the day"""
+    def execute_query(session):
+        select_query = """
+            DECLARE $as_of AS Timestamp;
+            SELECT status, last_user_id, last_wallet_id, wallets_checked
+            FROM wallet_checkpoint_runs
+            WHERE as_of = $as_of;
+        """
+        insert_query = """
+            DECLARE $as_of AS Timestamp;
+            DECLARE $now AS Timestamp;
+            INSERT INTO wallet_checkpoint_runs (as_of, status, wallets_checked, started_at)
+            VALUES ($as_of, 'running', 0ul, $now);
+        """
+        tx = session.transaction(ydb.SerializableReadWrite())
+        rows = tx.execute(session.prepare(select_query), {'$as_of': as_of})[0].rows
+        if rows:
+            tx.commit()
+            row = rows[0]
+            cursor = (row.last_user_id, row.last_wallet_id) if row.last_wallet_id else None
+            return {'status': row.status, 'cursor': cursor, 'wallets_checked': row.wallets_checked or 0}
+        tx.execute(session.prepare(insert_query), {'$as_of': as_of, '$now': datetime.utcnow()})
+        tx.commit()
+        return {'status': 'running', 'cursor': None, 'wallets_checked': 0}
+
+    return pool.retry_operation_sync(execute_query)
+
+def get_wallet_batch(pool: ydb.SessionPool, after: Optional[Tuple[str, str]], limit: int) -> List[Tuple[str, str]]:
+    """Next (user_id, wallet_id) keys in primary key order after the run cursor"""
+    def execute_query(session):
+        declares = "DECLARE $limit AS Uint64;"
+        params = {'$limit': limit}
+        after_clause = ""
+        if after is not None:
+            declares += " DECLARE $after_user_id AS Utf8; DECLARE $after_wallet_id AS Utf8;"
+            params.update({'$after_user_id': after[0], '$after_wallet_id': after[1]})
+            after_clause = "WHERE user_id > $after_user_id OR (user_id = $after_user_id AND id > $after_wallet_id)"
+        query = f"""
+            {declares}
+            SELECT user_id, id
+            FROM wallets
+            {after_clause}
+            ORDER BY user_id, id
+            LIMIT $limit;
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            params,
+            commit_tx=True
+        )
+
+    result_sets = pool.retry_operation_sync(execute_query)
+    return [(row.user_id, row.id) for row in result_sets[0].rows]
+
+def checkpoint_batch(pool: ydb.SessionPool, wallets: List[Tuple[str, str]], as_of: datetime) -> int:
+    """
+    Write the as_of checkpoint for a batch of wallets
+
+    Wallets with yesterday's checkpoint get it plus one day of ledger entries,
+    read for the whole batch in one query; the rest (new wallets, missed days)
+    fall back to balance_at() from their nearest checkpoint.
+
+    Returns:
+        Number of checkpoints written
+    """
+    previous = as_of - CHECKPOINT_INTERVAL
+
+    def execute_query(session):
+        keys = [{'user_id': user_id, 'wallet_id': wallet_id} for user_id, wallet_id in wallets]
+        tx = session.transaction(ydb.SerializableReadWrite())
+
+        query = """
+            DECLARE $keys AS List<Struct<user_id: Utf8, wallet_id: Utf8>>;
+            DECLARE $previous AS Timestamp;
+            DECLARE $as_of AS Timestamp;
+
+            SELECT c.user_id AS user_id, c.wallet_id AS wallet_id,
+                   c.balance_minor_units AS balance_minor_units, c.entry_count AS entry_count
+            FROM AS_TABLE($keys) AS k
+            INNER JOIN wallet_balance_checkpoints AS c
+            ON c.user_id = k.user_id AND c.wallet_id = k.wallet_id
+            WHERE c.as_of = $previous;
+
+            SELECT l.user_id AS user_id, l.wallet_id AS wallet_id,
+                   SUM(CASE WHEN l.direction = 'credit' THEN l.amount_minor_units ELSE -l.amount_minor_units END) AS delta,
+                   COUNT(*) AS entries
+            FROM AS_TABLE($keys) AS k
+            INNER JOIN ledger_transactions AS l
+            ON l.user_id = k.user_id AND l.wallet_id = k.wallet_id
+            WHERE l.created_at >= $previous AND l.created_at < $as_of
+            GROUP BY l.user_id, l.wallet_id;
+        """
+        result_sets = tx.execute(
+            session.prepare(query),
+            {'$keys': keys, '$previous': previous, '$as_of': as_of}
+        )
+        previous_checkpoints = {(row.user_id, row.wallet_id): row for row in result_sets[0].rows}
+        deltas = {(row.user_id, row.wallet_id): (row.delta or 0, row.entries or 0) for row in result_sets[1].rows}
+
+        now = datetime.utcnow()
+        checkpoints = []
+        for user_id, wallet_id in wallets:
+            checkpoint = previous_checkpoints.get((user_id, wallet_id))
+            if checkpoint is not None:
+                delta, entries = deltas.get((user_id, wallet_id), (0, 0))
+                balance = checkpoint.balance_minor_units + delta
+                entry_count = (checkpoint.entry_count or 0) + entries
+            else:
+                result = balance_at(session, tx, user_id, wallet_id, as_of)
+                balance, entry_count = result['balance_minor_units'], result['entry_count']
+            checkpoints.append({
+                'user_id': user_id,
+                'wallet_id': wallet_id,
+                'as_of': as_of,
+                'balance_minor_units': balance,
+                'entry_count': entry_count,
+                'created_at': now
+            })
+
+        upsert_query = f"""
+            DECLARE $rows AS {CHECKPOINT_ROWS_TYPE};
+            UPSERT INTO wallet_balance_checkpoints SELECT * FROM AS_TABLE($rows);
+        """
+        tx.execute(session.prepare(upsert_query), {'$rows': checkpoints})
+        tx.commit()
+        return len(checkpoints)
+
+    return pool.retry_operation_sync(execute_query)
+
+def update_run(pool: ydb.SessionPool, as_of: datetime, cursor: Optional[Tuple[str, str]], wallets_checked: int, done: bool):
+    """Save the run cursor, marking the run completed once every wallet has its checkpoint"""
+    def execute_query(session):
+        query = """
+            DECLARE $as_of AS Timestamp;
+            DECLARE $status AS Utf8;
+            DECLARE $last_user_id AS Utf8?;
+            DECLARE $last_wallet_id AS Utf8?;
+            DECLARE $wallets_checked AS Uint64;
+            DECLARE $completed_at AS Timestamp?;
+            UPDATE wallet_checkpoint_runs
+            SET status = $status,
+                last_user_id = $last_user_id,
+                last_wallet_id = $last_wallet_id,
+                wallets_checked = $wallets_checked,
+                completed_at = $completed_at
+            WHERE as_of = $as_of;
+        """
+        session.transaction(ydb.SerializableReadWrite()).execute(
+            session.prepare(query),
+            {
+                '$as_of': as_of,
+                '$status': 'completed' if done else 'running',
+                '$last_user_id': cursor[0] if cursor else None,
+                '$last_wallet_id': cursor[1] if cursor else None,
+                '$wallets_checked': wallets_checked,
+                '$completed_at': datetime.utcnow() if done else None
+            },
+            commit_tx=True
+        )
+
+    pool.retry_operation_sync(execute_query)
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler for wallet balance checkpoints
+    This function is triggered by a timer and writes each wallet's balance
+    as of the start of the current UTC day, once CHECKPOINT_SETTLE_WINDOW has
+    passed since midnight. A run that does not finish within the time budget
+    is resumed by the next trigger.
+    """
+    started = time.monotonic()
+    driver = None
+    try:
+        driver = get_ydb_driver()
+        pool = ydb.SessionPool(driver)
+
+        as_of = checkpoint_boundary(datetime.utcnow() - CHECKPOINT_SETTLE_WINDOW)
+        run = get_or_create_run(pool, as_of)
+        summary = {
+            'as_of': as_of.isoformat(),
+            'checkpoints_written': 0,
+            'wallets_checked': run['wallets_checked'],
+            'completed': run['status'] == 'completed'
+        }
+
+        cursor = run['cursor']
+        while not summary['completed'] and time.monotonic() - started <= TIME_BUDGET_SECONDS:
+            wallets = get_wallet_batch(pool, cursor, WALLET_BATCH_SIZE)
+            if wallets:
+                summary['checkpoints_written'] += checkpoint_batch(pool, wallets, as_of)
+                summary['wallets_checked'] += len(wallets)
+                cursor = wallets[-1]
+            summary['completed'] = len(wallets) < WALLET_BATCH_SIZE
+            update_run(pool, as_of, cursor, summary['wallets_checked'], summary['completed'])
+
+        logger.info(f"Wallet checkpoint run completed: {json.dumps(summary)}")
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'message': 'Wallet checkpoints completed' if summary['completed'] else 'Wallet checkpoints in progress',
+                'summary': summary
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Wallet checkpoint run failed: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'error': 'Internal server error',
+                'message': str(e)
+            })
+        }
+    finally:
+        if driver:
+            driver.stop()
@@ -9,6 +9,8 @@ import jwt
 import logging
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
+from search_index import SearchIndex
+from client_keys import ClientKeyIndex, client_keys, ensure_keys_built, lookup_clients
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -257,19 +259,12 @@ def handler(event, context):
             pool = ydb.SessionPool(driver)
             
             def check_and_create_client(session):
-                # Check if client with passport number already exists
-                query = """
-                DECLARE $passport_number AS Utf8;
-                SELECT id FROM clients WHERE passport_number = $passport_number;
-                """
-                prepared_query = session.prepare(query)
-                result_sets = session.transaction().execute(
-                    prepared_query,
-                    {'$passport_number': sanitized_data['passport_number']},
-                    commit_tx=True
-                )
+                # Check if client with passport number already exists (point read on the normalized key)
+                ensure_keys_built(session, user_id)
+                keys = client_keys(sanitized_data['contact_number'], sanitized_data['passport_number'])
+                duplicate_ids = lookup_clients(session, user_id, 'passport', keys['passport'], limit=1)
                 
-                if result_sets[0].rows:
+                if duplicate_ids:
                     logger.info(f"Duplicate passport number attempt: {sanitized_data['passport_number'][:4]}****")
                     return {
                         'statusCode': 409,
@@ -292,24 +287,26 @@ def handler(event, context):
                 DECLARE $guarantor_contact_number AS Utf8?;
                 DECLARE $guarantor_passport_number AS Utf8?;
                 DECLARE $guarantor_address AS Utf8?;
+                DECLARE $phone_normalized AS Utf8?;
+                DECLARE $passport_normalized AS Utf8?;
                 DECLARE $created_at AS Timestamp;
                 DECLARE $updated_at AS Timestamp;
                 
                 INSERT INTO clients (
                   id, user_id, full_name, contact_number, passport_number, address,
                   guarantor_full_name, guarantor_contact_number, guarantor_passport_number, guarantor_address,
-                  created_at, updated_at
+                  phone_normalized, passport_normalized, created_at, updated_at
                 ) 
                 VALUES (
                   $id, $user_id, $full_name, $contact_number, $passport_number, $address,
                   $guarantor_full_name, $guarantor_contact_number, $guarantor_passport_number, $guarantor_address,
-                  $created_at, $updated_at
+                  $phone_normalized, $passport_normalized, $created_at, $updated_at
                 );
                 """
                 
-                prepared_insert = session.prepare(insert_query)
-                session.transaction().execute(
-                    prepared_insert,
+                tx = session.transaction(ydb.SerializableReadWrite())
+                tx.execute(
+                    session.prepare(insert_query),
                     {
                         '$id': new_client_id,
                         '$user_id': user_id,
@@ -321,12 +318,18 @@ def handler(event, context):
                         '$guarantor_contact_number': sanitized_data.get('guarantor_contact_number'),
                         '$guarantor_passport_number': sanitized_data.get('guarantor_passport_number'),
                         '$guarantor_address': sanitized_data.get('guarantor_address'),
+                        '$phone_normalized': keys['phone'],
+                        '$passport_normalized': keys['passport'],
                         '$created_at': current_time,
                         '$updated_at': current_time
-                    },
-                    commit_tx=True
+                    }
                 )
                 
+                # Index searchable fields in the same transaction
+                SearchIndex(session, tx, user_id, 'client').add(new_client_id, sanitized_data)
+                ClientKeyIndex(session, tx, user_id).add(new_client_id, keys)
+                tx.commit()
+                
                 logger.info(f"Client created successfully: {new_client_id}")
                 return {
                     'statusCode': 201,
@@ -0,0 +1,316 @@
+import re
+import ydb
+import logging
+from typing import Dict, Any, List, Optional, Set, Iterable, Iterator
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+GRAM_SIZE = 3
+
+# Candidate IDs verified per read (bounds the IN list of the verification query)
+CANDIDATE_CHUNK_SIZE = 1000
+
+# Posting-list rows read per page (YDB truncates larger result sets)
+POSTING_PAGE_SIZE = 1000
+
+# Bumped when make_grams changes; indexes built with an older version are rebuilt on the next search
+INDEX_VERSION = 2
+
+# Rows written per statement while backfilling a user's index
+BACKFILL_CHUNK_SIZE = 500
+
+# Entities read and indexed per backfill transaction
+BACKFILL_PAGE_SIZE = 200
+
+# Indexed entities: table name and searchable fields
+INDEXED_ENTITIES = {
+    'client': ('clients', ('full_name', 'contact_number', 'passport_number')),
+    'investor': ('investors', ('full_name',))
+}
+
+SEARCH_TRIGRAMS_TABLE = """
+CREATE TABLE search_trigrams (
+    user_id Utf8 NOT NULL,
+    entity_type Utf8 NOT NULL,
+    field Utf8 NOT NULL,
+    gram Utf8 NOT NULL,
+    entity_id Utf8 NOT NULL,
+    PRIMARY KEY (user_id, entity_type, field, gram, entity_id)
+);
+"""
+
+SEARCH_INDEX_STATE_TABLE = """
+CREATE TABLE search_index_state (
+    user_id Utf8 NOT NULL,
+    entity_type Utf8 NOT NULL,
+    built_at Timestamp,
+    index_version Uint32,
+    PRIMARY KEY (user_id, entity_type)
+);
+"""
+
+GRAM_ROWS_TYPE = "List<Struct<user_id: Utf8, entity_type: Utf8, field: Utf8, gram: Utf8, entity_id: Utf8>>"
+
+def create_search_index_tables(pool: ydb.SessionPool):
+    """Create the search_trigrams and search_index_state tables (run once)"""
+    for table in (SEARCH_TRIGRAMS_TABLE, SEARCH_INDEX_STATE_TABLE):
+        pool.retry_operation_sync(lambda session, table=table: session.execute_scheme(table))
+
+def normalize_value(field: str, value: Optional[str]) -> str:
+    """Normalize a field value (or query) for indexing and matching"""
+    if not value:
+        return ''
+    if field == 'contact_number':
+        # Phone numbers match on digits only: "+7 (999) 123" == "7999123"
+        return re.sub(r'\D', '', value)
+    if field == 'passport_number':
+        return re.sub(r'\s', '', value).casefold()
+    return ' '.join(value.split()).casefold()
+
+def make_grams(text: str) -> Set[str]:
+    """
+    Split normalized text into trigrams plus its 1-2 character suffixes
+
+    With the suffixes every substring shorter than a trigram is a prefix of
+    some gram ("an" of "ivan" is the gram "an"), so short queries can use a
+    gram prefix range.
+    """
+    return {text[i:i + GRAM_SIZE] for i in range(len(text))} if text else set()
+
+def query_grams(query: str) -> Set[str]:
+    """Full trigrams of a normalized query; every one must be indexed for a match"""
+    return {query[i:i + GRAM_SIZE] for i in range(len(query) - GRAM_SIZE + 1)}
+
+def match_score(value: str, query: str) -> int:
+    """Rank a verified match: exact > prefix > word prefix > substring; 0 if no match"""
+    if not query or query not in value:
+        return 0
+    if value == query:
+        return 100
+    if value.startswith(query):
+        return 75
+    if (' ' + query) in value:
+        return 50
+    return 25
+
+class SearchIndex:
+    """Maintains search_trigrams rows inside the caller's transaction"""
+
+    def __init__(self, session, tx, user_id: str, entity_type: str):
+        self.session = session
+        self.tx = tx
+        self.user_id = user_id
+        self.entity_type = entity_type
+        self.fields = INDEXED_ENTITIES[entity_type][1]
+
+    def add(self, entity_id: str, values: Dict[str, Any]):
+        """Index all searchable fields of a new entity"""
+        self.upsert_rows(self.gram_rows(entity_id, values))
+
+    def remove(self, entity_id: str, values: Dict[str, Any]):
+        """Remove all index rows of a deleted entity"""
+        self.delete_rows(self.gram_rows(entity_id, values))
+
+    def replace(self, entity_id: str, old_values: Dict[str, Any], new_values: Dict[str, Any]):
+        """Re-index changed fields, touching only grams that were added or dropped"""
+        old_rows = {(row['field'], row['gram']): row for row in self.gram_rows(entity_id, old_values)}
+        new_rows = {(row['field'], row['gram']): row for row in self.gram_rows(entity_id, new_values)}
+        self.delete_rows([row for key, row in old_rows.items() if key not in new_rows])
+        self.upsert_rows([row for key, row in new_rows.items() if key not in old_rows])
+
+    def gram_rows(self, entity_id: str, values: Dict[str, Any]) -> List[Dict[str, str]]:
+        rows = []
+        for field in self.fields:
+            if field not in values:
+                continue
+            for gram in make_grams(normalize_value(field, values[field])):
+                rows.append({
+                    'user_id': self.user_id,
+                    'entity_type': self.entity_type,
+                    'field': field,
+                    'gram': gram,
+                    'entity_id': entity_id
+                })
+        return rows
+
+    def upsert_rows(self, rows: List[Dict[str, str]]):
+        if not rows:
+            return
+        query = f"""
+        DECLARE $rows AS {GRAM_ROWS_TYPE};
+        UPSERT INTO search_trigrams SELECT * FROM AS_TABLE($rows);
+        """
+        self.tx.execute(self.session.prepare(query), {'$rows': rows})
+
+    def delete_rows(self, rows: List[Dict[str, str]]):
+        if not rows:
+            return
+        query = f"""
+        DECLARE $rows AS {GRAM_ROWS_TYPE};
+        DELETE FROM search_trigrams ON SELECT * FROM AS_TABLE($rows);
+        """
+        self.tx.execute(self.session.prepare(query), {'$rows': rows})
+
+class SearchIndexReader:
+    """Looks up candidate entity IDs from posting lists"""
+
+    def __init__(self, session, user_id: str, entity_type: str):
+        self.session = session
+        self.user_id = user_id
+        self.entity_type = entity_type
+        self.table, self.fields = INDEXED_ENTITIES[entity_type]
+
+    def ensure_built(self):
+        """Backfill the index once for users whose entities predate it"""
+        state_query = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $entity_type AS Utf8;
+        SELECT built_at, index_version FROM search_index_state WHERE user_id = $user_id AND entity_type = $entity_type;
+        """
+        result_sets = self.session.transaction(ydb.OnlineReadOnly()).execute(
+            self.session.prepare(state_query),
+            {'$user_id': self.user_id, '$entity_type': self.entity_type},
+            commit_tx=True
+        )
+        if result_sets[0].rows and result_sets[0].rows[0].index_version == INDEX_VERSION:
+            return
+
+        # Each page of entities is indexed in its own transaction; the state row is
+        # written only after the last page, so an interrupted backfill runs again
+        rows_query = f"""
+        DECLARE $user_id AS Utf8;
+        DECLARE $after AS Utf8;
+        DECLARE $limit AS Uint64;
+        SELECT id, {', '.join(self.fields)} FROM {self.table}
+        WHERE user_id = $user_id AND id > $after
+        ORDER BY id
+        LIMIT $limit;
+        """
+        entities = 0
+        grams = 0
+        after = ''
+        while True:
+            tx = self.session.transaction(ydb.SerializableReadWrite())
+            entity_rows = tx.execute(
+                self.session.prepare(rows_query),
+                {'$user_id': self.user_id, '$after': after, '$limit': BACKFILL_PAGE_SIZE}
+            )[0].rows
+
+            index = SearchIndex(self.session, tx, self.user_id, self.entity_type)
+            gram_rows = []
+            for row in entity_rows:
+                gram_rows.extend(index.gram_rows(row.id, {field: getattr(row, field, None) for field in self.fields}))
+            for start in range(0, len(gram_rows), BACKFILL_CHUNK_SIZE):
+                index.upsert_rows(gram_rows[start:start + BACKFILL_CHUNK_SIZE])
+            tx.commit()
+
+            entities += len(entity_rows)
+            grams += len(gram_rows)
+            if len(entity_rows) < BACKFILL_PAGE_SIZE:
+                break
+            after = entity_rows[-1].id
+
+        mark_query = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $entity_type AS Utf8;
+        DECLARE $built_at AS Timestamp;
+        DECLARE $index_version AS Uint32;
+        UPSERT INTO search_index_state (user_id, entity_type, built_at, index_version)
+        VALUES ($user_id, $entity_type, $built_at, $index_version);
+        """
+        self.session.transaction(ydb.SerializableReadWrite()).execute(
+            self.session.prepare(mark_query),
+            {
+                '$user_id': self.user_id,
+                '$entity_type': self.entity_type,
+                '$built_at': datetime.utcnow(),
+                '$index_version': INDEX_VERSION
+            },
+            commit_tx=True
+        )
+        logger.info(f"Backfilled search index for {entities} {self.table} ({grams} grams)")
+
+    def candidates(self, field: str, query: str) -> Set[str]:
+        """
+        Entity IDs whose field may contain the normalized query
+
+        Trigram queries intersect the posting lists of every query gram;
+        queries shorter than a trigram read the posting lists of grams starting
+        with it. Posting lists are read in pages, so no candidate is dropped.
+        """
+        if not query:
+            return set()
+
+        declares = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $entity_type AS Utf8;
+        DECLARE $field AS Utf8;
+        DECLARE $limit AS Uint64;
+        """
+        params = {'$user_id': self.user_id, '$entity_type': self.entity_type, '$field': field, '$limit': POSTING_PAGE_SIZE}
+        if len(query) >= GRAM_SIZE:
+            grams = query_grams(query)
+            declares += "DECLARE $grams AS List<Utf8>;"
+            gram_clause = "gram IN $grams"
+            params['$grams'] = list(grams)
+        else:
+            grams = None
+            declares += "DECLARE $from AS Utf8; DECLARE $to AS Utf8;"
+            gram_clause = "gram >= $from AND gram < $to"
+            params['$from'] = query
+            params['$to'] = query + '\U0010ffff'
+
+        first_page = f"""
+        {declares}
+        SELECT gram, entity_id FROM search_trigrams
+        WHERE user_id = $user_id AND entity_type = $entity_type AND field = $field AND {gram_clause}
+        ORDER BY gram, entity_id
+        LIMIT $limit;
+        """
+        next_page = f"""
+        {declares}
+        DECLARE $after_gram AS Utf8;
+        DECLARE $after_entity_id AS Utf8;
+        SELECT gram, entity_id FROM search_trigrams
+        WHERE user_id = $user_id AND entity_type = $entity_type AND field = $field AND {gram_clause}
+        AND (gram > $after_gram OR (gram = $after_gram AND entity_id > $after_entity_id))
+        ORDER BY gram, entity_id
+        LIMIT $limit;
+        """
+
+        # Keyset pages over the primary key order of the posting lists
+        hits = {}
+        query_text = first_page
+        while True:
+            rows = self.session.transaction(ydb.OnlineReadOnly()).execute(
+                self.session.prepare(query_text),
+                params,
+                commit_tx=True
+            )[0].rows
+            for row in rows:
+                hits.setdefault(row.entity_id, set()).add(row.gram)
+            if len(rows) < POSTING_PAGE_SIZE:
+                break
+            query_text = next_page
+            params['$after_gram'] = rows[-1].gram
+            params['$after_entity_id'] = rows[-1].entity_id
+
+        if grams is None:
+            return set(hits)
+
+        # Intersect posting lists: keep entities that contain every gram of the query
+        return {entity_id for entity_id, found in hits.items() if len(found) == len(grams)}
+
+def chunked(ids: Iterable[str], size: int = CANDIDATE_CHUNK_SIZE) -> Iterator[List[str]]:
+    """Sorted candidate IDs in lists of at most size, for verification reads"""
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+def intersect_all(sets: Iterable[Set[str]]) -> Set[str]:
+    """Intersect candidate sets from several search criteria"""
+    result = None
+    for candidate_set in sets:
+        result = set(candidate_set) if result is None else result & candidate_set
+    return result or set()
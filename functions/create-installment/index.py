@@ -8,6 +8,7 @@ import calendar
 from datetime import datetime, date
 from decimal import Decimal
 from typing import Optional, Tuple
+from idempotency import idempotent, authenticated_user_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -84,6 +85,7 @@ class JWTAuth:
             logger.error(f"Unexpected authentication error: {e}")
             return None, "Authentication error"
 
+@idempotent('create-installment', lambda event: JWTAuth.authenticate_request(event)[0])
 def handler(event, context):
     """
     Yandex Cloud Function handler to create a new installment.
@@ -92,7 +94,10 @@ def handler(event, context):
         logger.info(f"Received create request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
         
         # Authentication
-        user_id, auth_error = JWTAuth.authenticate_request(event)
+        # idempotent() has already authenticated requests carrying an Idempotency-Key
+        user_id, auth_error = authenticated_user_id(event), None
+        if not user_id:
+            user_id, auth_error = JWTAuth.authenticate_request(event)
         if not user_id:
             logger.warning(f"Authentication failed: {auth_error}")
             return {'statusCode': 401, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'Unauthorized: {auth_error}'})}
@@ -9,6 +9,7 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 from decimal import Decimal
+from search_index import SearchIndex
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -200,9 +201,9 @@ def handler(event, context):
                 VALUES ($id, $user_id, $full_name, $investment_amount, $investor_percentage, $user_percentage, $created_at, $updated_at);
                 """
                 
-                prepared_query = session.prepare(query)
-                session.transaction().execute(
-                    prepared_query,
+                tx = session.transaction(ydb.SerializableReadWrite())
+                tx.execute(
+                    session.prepare(query),
                     {
                         '$id': new_investor_id,
                         '$user_id': user_id,
@@ -212,10 +213,13 @@ def handler(event, context):
                         '$user_percentage': user_percentage,
                         '$created_at': current_time,
                         '$updated_at': current_time
-                    },
-                    commit_tx=True
+                    }
                 )
                 
+                # Index the name for substring search in the same transaction
+                SearchIndex(session, tx, user_id, 'investor').add(new_investor_id, sanitized_data)
+                tx.commit()
+                
                 logger.info(f"Investor created successfully: {new_investor_id}")
                 return {
                     'statusCode': 201,
@@ -407,16 +407,17 @@ def handler(event, context):
                     DECLARE $description AS Utf8;
                     DECLARE $created_by AS Utf8;
                     DECLARE $created_at AS Timestamp;
+                    DECLARE $balance_after_minor_units AS Int64;
                     
                     INSERT INTO ledger_transactions (
                       id, wallet_id, user_id, direction, amount_minor_units, currency,
                       reference_type, reference_id, group_id, correlation_id,
-                      description, created_by, created_at
+                      description, created_by, created_at, balance_after_minor_units
                     ) 
                     VALUES (
                       $id, $wallet_id, $user_id, $direction, $amount_minor_units, $currency,
                       $reference_type, $reference_id, $group_id, $correlation_id,
-                      $description, $created_by, $created_at
+                      $description, $created_by, $created_at, $balance_after_minor_units
                     );
                     """
                     
@@ -434,6 +435,7 @@ def handler(event, context):
                         '$description': description,
                         '$created_by': user_id,
                         '$created_at': current_time,
+                        '$balance_after_minor_units': initial_balance,
                     }
                     
                     prepared_transaction = session.prepare(transaction_query)
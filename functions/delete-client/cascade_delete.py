@@ -0,0 +1,349 @@
+import time
+import uuid
+import ydb
+import logging
+from typing import Dict, Any, List, Optional, Callable
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Installments removed per transaction (each carries its payment schedule and allocations)
+INSTALLMENT_BATCH_SIZE = 20
+
+# Stop starting new batches after this many seconds (function timeout is 30s)
+TIME_BUDGET_SECONDS = 20
+
+# Installment column referencing the deleted entity
+ENTITY_COLUMNS = {
+    'client': 'client_id',
+    'investor': 'investor_id'
+}
+
+CASCADE_DELETE_JOBS_TABLE = """
+CREATE TABLE cascade_delete_jobs (
+    user_id Utf8 NOT NULL,
+    id Utf8 NOT NULL,
+    entity_type Utf8,
+    entity_id Utf8,
+    status Utf8,
+    total_installments Int64,
+    deleted_installments Int64,
+    deleted_payments Int64,
+    deleted_allocations Int64,
+    created_at Timestamp,
+    updated_at Timestamp,
+    PRIMARY KEY (user_id, id)
+);
+"""
+
+def create_cascade_delete_jobs_table(pool: ydb.SessionPool):
+    """Create the cascade_delete_jobs table (run once)"""
+    pool.retry_operation_sync(lambda session: session.execute_scheme(CASCADE_DELETE_JOBS_TABLE))
+
+class CascadeDeleter:
+    """Deletes a client or investor together with its installments in bounded batches"""
+
+    def __init__(self, pool: ydb.SessionPool, user_id: str, entity_type: str, entity_id: str):
+        if entity_type not in ENTITY_COLUMNS:
+            raise ValueError(f"Unsupported entity type: {entity_type}")
+        self.pool = pool
+        self.user_id = user_id
+        self.entity_type = entity_type
+        self.entity_id = entity_id
+        self.column = ENTITY_COLUMNS[entity_type]
+
+    def get_or_create_job(self) -> Dict[str, Any]:
+        """Resume the running job for this entity or start a new one"""
+        def execute(session):
+            find_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $entity_type AS Utf8;
+            DECLARE $entity_id AS Utf8;
+            SELECT id, status, total_installments, deleted_installments, deleted_payments, deleted_allocations
+            FROM cascade_delete_jobs
+            WHERE user_id = $user_id AND entity_type = $entity_type AND entity_id = $entity_id AND status = 'running';
+            """
+            tx = session.transaction(ydb.SerializableReadWrite())
+            result_sets = tx.execute(
+                session.prepare(find_query),
+                {'$user_id': self.user_id, '$entity_type': self.entity_type, '$entity_id': self.entity_id}
+            )
+            if result_sets[0].rows:
+                tx.commit()
+                return self._job_from_row(result_sets[0].rows[0])
+
+            count_query = f"""
+            DECLARE $user_id AS Utf8;
+            DECLARE $entity_id AS Utf8;
+            SELECT COUNT(*) AS total FROM installments WHERE user_id = $user_id AND {self.column} = $entity_id;
+            """
+            count_result = tx.execute(
+                session.prepare(count_query),
+                {'$user_id': self.user_id, '$entity_id': self.entity_id}
+            )
+            total = int(count_result[0].rows[0].total or 0)
+
+            insert_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $id AS Utf8;
+            DECLARE $entity_type AS Utf8;
+            DECLARE $entity_id AS Utf8;
+            DECLARE $total AS Int64;
+            DECLARE $now AS Timestamp;
+            INSERT INTO cascade_delete_jobs (
+                user_id, id, entity_type, entity_id, status, total_installments,
+                deleted_installments, deleted_payments, deleted_allocations, created_at, updated_at
+            ) VALUES (
+                $user_id, $id, $entity_type, $entity_id, 'running', $total,
+                0, 0, 0, $now, $now
+            );
+            """
+            job_id = str(uuid.uuid4())
+            tx.execute(
+                session.prepare(insert_query),
+                {
+                    '$user_id': self.user_id,
+                    '$id': job_id,
+                    '$entity_type': self.entity_type,
+                    '$entity_id': self.entity_id,
+                    '$total': total,
+                    '$now': datetime.utcnow()
+                }
+            )
+            tx.commit()
+            return {
+                'job_id': job_id,
+                'status': 'running',
+                'total_installments': total,
+                'deleted_installments': 0,
+                'deleted_payments': 0,
+                'deleted_allocations': 0
+            }
+
+        return self.pool.retry_operation_sync(execute)
+
+    def delete_batch(self, job_id: str) -> Dict[str, int]:
+        """Delete one batch of installments with their payments and allocations in a single transaction"""
+        def execute(session):
+            tx = session.transaction(ydb.SerializableReadWrite())
+
+            select_query = f"""
+            DECLARE $user_id AS Utf8;
+            DECLARE $entity_id AS Utf8;
+            DECLARE $limit AS Uint64;
+            SELECT id FROM installments
+            WHERE user_id = $user_id AND {self.column} = $entity_id
+            LIMIT $limit;
+            """
+            result_sets = tx.execute(
+                session.prepare(select_query),
+                {'$user_id': self.user_id, '$entity_id': self.entity_id, '$limit': INSTALLMENT_BATCH_SIZE}
+            )
+            installment_ids = [row.id for row in result_sets[0].rows]
+            if not installment_ids:
+                tx.commit()
+                return {'installments': 0, 'payments': 0, 'allocations': 0}
+
+            now = datetime.utcnow()
+            allocations = self._reverse_active_allocations(session, tx, installment_ids, now)
+
+            counts_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $installment_ids AS List<Utf8>;
+            SELECT COUNT(*) AS cnt FROM installment_payments WHERE installment_id IN $installment_ids;
+            SELECT COUNT(*) AS cnt FROM installment_allocations WHERE user_id = $user_id AND installment_id IN $installment_ids;
+            """
+            counts = tx.execute(
+                session.prepare(counts_query),
+                {'$user_id': self.user_id, '$installment_ids': installment_ids}
+            )
+            payments_count = int(counts[0].rows[0].cnt or 0)
+            allocations_count = int(counts[1].rows[0].cnt or 0)
+
+            delete_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $installment_ids AS List<Utf8>;
+            DELETE FROM installment_allocations WHERE user_id = $user_id AND installment_id IN $installment_ids;
+            DELETE FROM installment_payments WHERE installment_id IN $installment_ids;
+            DELETE FROM installments WHERE id IN $installment_ids AND user_id = $user_id;
+            """
+            tx.execute(
+                session.prepare(delete_query),
+                {'$user_id': self.user_id, '$installment_ids': installment_ids}
+            )
+
+            progress_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $id AS Utf8;
+            DECLARE $installments AS Int64;
+            DECLARE $payments AS Int64;
+            DECLARE $allocations AS Int64;
+            DECLARE $now AS Timestamp;
+            UPDATE cascade_delete_jobs SET
+                deleted_installments = deleted_installments + $installments,
+                deleted_payments = deleted_payments + $payments,
+                deleted_allocations = deleted_allocations + $allocations,
+                updated_at = $now
+            WHERE user_id = $user_id AND id = $id;
+            """
+            tx.execute(
+                session.prepare(progress_query),
+                {
+                    '$user_id': self.user_id,
+                    '$id': job_id,
+                    '$installments': len(installment_ids),
+                    '$payments': payments_count,
+                    '$allocations': allocations_count,
+                    '$now': now
+                }
+            )
+
+            tx.commit()
+            logger.info(f"Cascade delete batch for {self.entity_type} {self.entity_id}: {len(installment_ids)} installments, {payments_count} payments, {allocations_count} allocations ({allocations} reversed)")
+            return {'installments': len(installment_ids), 'payments': payments_count, 'allocations': allocations_count}
+
+        return self.pool.retry_operation_sync(execute)
+
+    def _reverse_active_allocations(self, session, tx, installment_ids: List[str], now: datetime) -> int:
+        """Credit active allocations back to their wallets before the allocation rows are removed"""
+        allocations_query = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $installment_ids AS List<Utf8>;
+        SELECT id, wallet_id, amount_minor_units
+        FROM installment_allocations
+        WHERE user_id = $user_id AND installment_id IN $installment_ids AND status = 'active';
+        """
+        result_sets = tx.execute(
+            session.prepare(allocations_query),
+            {'$user_id': self.user_id, '$installment_ids': installment_ids}
+        )
+        rows = result_sets[0].rows
+        if not rows:
+            return 0
+
+        reversals = []
+        wallet_totals = {}
+        for row in rows:
+            reversals.append({
+                'id': str(uuid.uuid4()),
+                'wallet_id': row.wallet_id,
+                'amount_minor_units': row.amount_minor_units,
+                'reference_id': row.id,
+                'description': f"Reversal for allocation {row.id} ({self.entity_type} deleted)"
+            })
+            wallet_totals[row.wallet_id] = wallet_totals.get(row.wallet_id, 0) + row.amount_minor_units
+
+        # Reversals share one created_at, so the ledger orders them by id; running balances follow that order
+        balances_query = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $wallet_ids AS List<Utf8>;
+        SELECT wallet_id, balance_minor_units
+        FROM wallet_balances
+        WHERE user_id = $user_id AND wallet_id IN $wallet_ids;
+        """
+        balance_sets = tx.execute(
+            session.prepare(balances_query),
+            {'$user_id': self.user_id, '$wallet_ids': list(wallet_totals)}
+        )
+        balances = {row.wallet_id: row.balance_minor_units for row in balance_sets[0].rows}
+        reversals.sort(key=lambda reversal: reversal['id'])
+        for reversal in reversals:
+            balances[reversal['wallet_id']] = balances.get(reversal['wallet_id'], 0) + reversal['amount_minor_units']
+            reversal['balance_after_minor_units'] = balances[reversal['wallet_id']]
+
+        ledger_query = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $now AS Timestamp;
+        DECLARE $reversals AS List<Struct<id: Utf8, wallet_id: Utf8, amount_minor_units: Int64, reference_id: Utf8, description: Utf8, balance_after_minor_units: Int64>>;
+        INSERT INTO ledger_transactions (
+            id, wallet_id, user_id, direction, amount_minor_units, currency,
+            reference_type, reference_id, description, created_by, created_at, balance_after_minor_units
+        )
+        SELECT
+            id, wallet_id, $user_id AS user_id, 'credit' AS direction, amount_minor_units, 'RUB' AS currency,
+            'reversal' AS reference_type, reference_id, description, $user_id AS created_by, $now AS created_at,
+            balance_after_minor_units
+        FROM AS_TABLE($reversals);
+        """
+        tx.execute(
+            session.prepare(ledger_query),
+            {'$user_id': self.user_id, '$now': now, '$reversals': reversals}
+        )
+
+        balance_query = """
+        DECLARE $user_id AS Utf8;
+        DECLARE $wallet_id AS Utf8;
+        DECLARE $amount AS Int64;
+        DECLARE $now AS Timestamp;
+        UPDATE wallet_balances
+        SET balance_minor_units = balance_minor_units + $amount,
+            version = version + 1,
+            updated_at = $now
+        WHERE wallet_id = $wallet_id AND user_id = $user_id;
+        """
+        for wallet_id, amount in wallet_totals.items():
+            tx.execute(
+                session.prepare(balance_query),
+                {'$user_id': self.user_id, '$wallet_id': wallet_id, '$amount': amount, '$now': now}
+            )
+
+        return len(reversals)
+
+    def complete_job(self, job_id: str, delete_entity_query: str, params: Dict[str, Any], on_complete: Optional[Callable] = None):
+        """Delete the entity row itself and mark the job completed in one transaction"""
+        def execute(session):
+            tx = session.transaction(ydb.SerializableReadWrite())
+            tx.execute(session.prepare(delete_entity_query), params)
+            if on_complete:
+                on_complete(session, tx)
+            complete_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $id AS Utf8;
+            DECLARE $now AS Timestamp;
+            UPDATE cascade_delete_jobs SET status = 'completed', updated_at = $now
+            WHERE user_id = $user_id AND id = $id;
+            """
+            tx.execute(
+                session.prepare(complete_query),
+                {'$user_id': self.user_id, '$id': job_id, '$now': datetime.utcnow()}
+            )
+            tx.commit()
+
+        self.pool.retry_operation_sync(execute)
+
+    def run(self, delete_entity_query: str, params: Dict[str, Any], on_complete: Optional[Callable] = None) -> Dict[str, Any]:
+        """
+        Run batches until the entity is fully deleted or the time budget is spent
+
+        on_complete(session, tx) runs inside the transaction that deletes the entity row.
+
+        Returns:
+            Job progress dictionary; status is 'completed' or 'running'
+        """
+        started = time.monotonic()
+        job = self.get_or_create_job()
+
+        while time.monotonic() - started < TIME_BUDGET_SECONDS:
+            deleted = self.delete_batch(job['job_id'])
+            job['deleted_installments'] += deleted['installments']
+            job['deleted_payments'] += deleted['payments']
+            job['deleted_allocations'] += deleted['allocations']
+
+            if deleted['installments'] < INSTALLMENT_BATCH_SIZE:
+                self.complete_job(job['job_id'], delete_entity_query, params, on_complete)
+                job['status'] = 'completed'
+                break
+
+        job['remaining_installments'] = max(job['total_installments'] - job['deleted_installments'], 0)
+        return job
+
+    @staticmethod
+    def _job_from_row(row) -> Dict[str, Any]:
+        return {
+            'job_id': row.id,
+            'status': row.status,
+            'total_installments': int(row.total_installments or 0),
+            'deleted_installments': int(row.deleted_installments or 0),
+            'deleted_payments': int(row.deleted_payments or 0),
+            'deleted_allocations': int(row.deleted_allocations or 0)
+        }
@@ -6,6 +6,9 @@ import hmac
 import jwt
 import logging
 from typing import Union, Optional, Tuple
+from cascade_delete import CascadeDeleter
+from search_index import SearchIndex, INDEXED_ENTITIES
+from client_keys import ClientKeyIndex, client_keys
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -127,12 +130,12 @@ def handler(event, context):
             driver.wait(fail_fast=True, timeout=5)
             pool = ydb.SessionPool(driver)
 
-            def delete_client_from_db(session):
+            def check_client_exists(session):
                 # First, check if the client exists and belongs to the authenticated user
                 check_query = """
                 DECLARE $client_id AS Utf8;
                 DECLARE $user_id AS Utf8;
-                SELECT id FROM clients WHERE id = $client_id AND user_id = $user_id;
+                SELECT id, full_name, contact_number, passport_number FROM clients WHERE id = $client_id AND user_id = $user_id;
                 """
                 prepared_check = session.prepare(check_query)
                 result_sets = session.transaction().execute(
@@ -143,25 +146,38 @@ def handler(event, context):
                 if not result_sets[0].rows:
                     return {'statusCode': 404, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Client not found'})}
 
-                # Delete the client (only if it belongs to the authenticated user)
-                delete_query = """
+                row = result_sets[0].rows[0]
+                return {field: getattr(row, field, None) for field in INDEXED_ENTITIES['client'][1]}
+
+            existing = pool.retry_operation_sync(check_client_exists)
+            if 'statusCode' in existing:
+                driver.stop()
+                return existing
+
+            def remove_from_search_index(session, tx):
+                SearchIndex(session, tx, user_id, 'client').remove(sanitized_id, existing)
+                ClientKeyIndex(session, tx, user_id).remove(
+                    sanitized_id,
+                    client_keys(existing.get('contact_number'), existing.get('passport_number'))
+                )
+
+            # Remove installments, payment schedules and allocations in bounded batches,
+            # then the client itself. A repeated DELETE resumes an unfinished job.
+            delete_query = """
                 DECLARE $client_id AS Utf8;
                 DECLARE $user_id AS Utf8;
                 DELETE FROM clients WHERE id = $client_id AND user_id = $user_id;
-                """
-                prepared_delete = session.prepare(delete_query)
-                session.transaction().execute(
-                    prepared_delete, 
-                    {'$client_id': sanitized_id, '$user_id': user_id}, 
-                    commit_tx=True
-                )
+            """
+            deleter = CascadeDeleter(pool, user_id, 'client', sanitized_id)
+            job = deleter.run(delete_query, {'$client_id': sanitized_id, '$user_id': user_id}, remove_from_search_index)
+            driver.stop()
 
-                logger.info(f"Client deleted successfully: {sanitized_id}")
-                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Client deleted successfully'})}
+            if job['status'] != 'completed':
+                logger.info(f"Client deletion in progress: {sanitized_id} ({job['deleted_installments']}/{job['total_installments']} installments)")
+                return {'statusCode': 202, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Client deletion in progress', 'job': job})}
 
-            result = pool.retry_operation_sync(delete_client_from_db)
-            driver.stop()
-            return result
+            logger.info(f"Client deleted successfully: {sanitized_id}")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Client deleted successfully', 'job': job})}
             
         except ydb.Error as e:
             logger.error(f"YDB error: {str(e)}")
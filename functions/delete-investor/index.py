@@ -6,6 +6,8 @@ import re
 import jwt
 import logging
 from typing import Union, Optional, Tuple
+from cascade_delete import CascadeDeleter
+from search_index import SearchIndex, INDEXED_ENTITIES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -129,11 +131,11 @@ def handler(event, context):
             driver.wait(fail_fast=True, timeout=5)
             pool = ydb.SessionPool(driver)
 
-            def delete_investor_from_db(session):
+            def check_investor_exists(session):
                 # First, check if the investor exists (using same pattern as get-investor)
                 check_query = """
                 DECLARE $investor_id AS Utf8;
-                SELECT id FROM investors WHERE id = $investor_id;
+                SELECT id, full_name FROM investors WHERE id = $investor_id;
                 """
                 prepared_check = session.prepare(check_query)
                 result_sets = session.transaction().execute(
@@ -144,22 +146,33 @@ def handler(event, context):
                 if not result_sets[0].rows:
                     return {'statusCode': 404, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Investor not found'})}
 
-                # Delete the investor
-                delete_query = """
+                row = result_sets[0].rows[0]
+                return {field: getattr(row, field, None) for field in INDEXED_ENTITIES['investor'][1]}
+
+            existing = pool.retry_operation_sync(check_investor_exists)
+            if 'statusCode' in existing:
+                driver.stop()
+                return existing
+
+            def remove_from_search_index(session, tx):
+                SearchIndex(session, tx, user_id, 'investor').remove(sanitized_id, existing)
+
+            # Remove installments, payment schedules and allocations in bounded batches,
+            # then the investor itself. A repeated DELETE resumes an unfinished job.
+            delete_query = """
                 DECLARE $investor_id AS Utf8;
                 DELETE FROM investors WHERE id = $investor_id;
-                """
-                prepared_delete = session.prepare(delete_query)
-                session.transaction().execute(
-                    prepared_delete, 
-                    {'$investor_id': sanitized_id}, 
-                    commit_tx=True
-                )
+            """
+            deleter = CascadeDeleter(pool, user_id, 'investor', sanitized_id)
+            job = deleter.run(delete_query, {'$investor_id': sanitized_id}, remove_from_search_index)
+            driver.stop()
 
-                logger.info(f"Investor deleted successfully: {sanitized_id}")
-                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Investor deleted successfully'})}
+            if job['status'] != 'completed':
+                logger.info(f"Investor deletion in progress: {sanitized_id} ({job['deleted_installments']}/{job['total_installments']} installments)")
+                return {'statusCode': 202, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Investor deletion in progress', 'job': job})}
 
-            return pool.retry_operation_sync(delete_investor_from_db)
+            logger.info(f"Investor deleted successfully: {sanitized_id}")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Investor deleted successfully', 'job': job})}
             
         except ydb.Error as e:
             logger.error(f"YDB error: {str(e)}")
@@ -0,0 +1,374 @@
+import os
+import json
+import logging
+import ydb
+import requests
+from requests.adapters import HTTPAdapter
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Seconds receiveNotification waits on an empty queue (Green API minimum is 5)
+RECEIVE_TIMEOUT_SECONDS = 5
+
+# Instances drained in parallel
+MAX_INSTANCE_WORKERS = 8
+
+# Stop taking new batches after this many seconds (function timeout is 30s)
+TIME_BUDGET_SECONDS = 20
+
+# Green API HTTP settings: (connect, read) timeouts in seconds and keep-alive pool size
+GREEN_API_TIMEOUT = (5, RECEIVE_TIMEOUT_SECONDS + 10)
+GREEN_API_POOL_SIZE = 10
+
+REMINDER_DELIVERY_TABLE = """
+CREATE TABLE reminder_delivery (
+    message_id Utf8 NOT NULL,
+    outbox_id Utf8,
+    status Utf8,
+    status_rank Int32,
+    green_api_status Utf8,
+    status_at Timestamp,
+    updated_at Timestamp,
+    PRIMARY KEY (message_id)
+)
+WITH (TTL = Interval("P180D") ON updated_at);
+"""
+
+# idx_message_id for reminder_outbox tables created before REMINDER_OUTBOX_TABLE declared it
+REMINDER_OUTBOX_MESSAGE_ID_INDEX = """
+ALTER TABLE reminder_outbox ADD INDEX idx_message_id GLOBAL ON (message_id);
+"""
+
+# Green API outgoingMessageStatus values -> (delivery status, rank); a lower rank never replaces a higher one
+DELIVERY_STATUSES = {
+    'sent': ('sent', 1),
+    'delivered': ('delivered', 2),
+    'read': ('read', 3),
+    'failed': ('failed', 3),
+    'noAccount': ('failed', 3),
+    'notInGroup': ('failed', 3),
+    'yellowCard': ('failed', 3)
+}
+
+DELIVERY_ROWS_TYPE = "List<Struct<message_id: Utf8, status: Utf8, status_rank: Int32, green_api_status: Utf8, status_at: Timestamp>>"
+
+class GreenAPIError(Exception):
+    """Notification queue request that failed"""
+
+# One keep-alive session per container, reused across warm invocations
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """Shared pooled session so instances reuse the TLS connection to api.green-api.com"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GREEN_API_POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+class GreenAPINotificationClient:
+    """receiveNotification / deleteNotification for one Green API instance"""
+
+    def __init__(self, instance_id: str, token: str):
+        self.instance_id = instance_id
+        self.token = token
+        self.base_url = f"https://api.green-api.com/waInstance{instance_id}"
+        self.session = get_http_session()
+
+    def receive(self) -> Optional[Dict[str, Any]]:
+        """Oldest notification in the queue ({receiptId, body}), or None if it is empty"""
+        url = f"{self.base_url}/receiveNotification/{self.token}"
+        try:
+            response = self.session.get(url, params={'receiveTimeout': RECEIVE_TIMEOUT_SECONDS}, timeout=GREEN_API_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise GreenAPIError(f"receiveNotification failed: {e}")
+        if response.status_code != 200:
+            raise GreenAPIError(f"receiveNotification HTTP error {response.status_code}")
+        return response.json() or None
+
+    def delete(self, receipt_id: int):
+        url = f"{self.base_url}/deleteNotification/{self.token}/{receipt_id}"
+        try:
+            response = self.session.delete(url, timeout=GREEN_API_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise GreenAPIError(f"deleteNotification failed: {e}")
+        if response.status_code != 200:
+            raise GreenAPIError(f"deleteNotification HTTP error {response.status_code}")
+
+class FakeGreenAPINotifications:
+    """
+    Offline stand-in for the notification endpoints of one instance
+
+    Behaves like Green API's queue: receive() keeps returning the oldest
+    notification until it is deleted.
+    """
+
+    def __init__(self, bodies: List[Dict[str, Any]]):
+        self.queue = [{'receiptId': index + 1, 'body': body} for index, body in enumerate(bodies)]
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def receive(self) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return dict(self.queue[0]) if self.queue else None
+
+    def delete(self, receipt_id: int):
+        with self.lock:
+            self.queue = [item for item in self.queue if item['receiptId'] != receipt_id]
+            self.deleted.append(receipt_id)
+
+def parse_status_event(body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Delivery row for an outgoingMessageStatus notification; None for any other notification"""
+    if not body or body.get('typeWebhook') != 'outgoingMessageStatus' or not body.get('idMessage'):
+        return None
+    mapped = DELIVERY_STATUSES.get(body.get('status'))
+    if not mapped:
+        return None
+    timestamp = body.get('timestamp')
+    return {
+        'message_id': body['idMessage'],
+        'status': mapped[0],
+        'status_rank': mapped[1],
+        'green_api_status': body['status'],
+        'status_at': datetime.utcfromtimestamp(timestamp) if timestamp else datetime.utcnow()
+    }
+
+def latest_per_message(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep the highest-ranked (then latest) event per message ID"""
+    latest = {}
+    for event in events:
+        current = latest.get(event['message_id'])
+        if current is None or (event['status_rank'], event['status_at']) >= (current['status_rank'], current['status_at']):
+            latest[event['message_id']] = event
+    return list(latest.values())
+
+class YdbDeliveryStore:
+    """
+    Delivery statuses in reminder_delivery, matched to reminder_outbox by message ID
+
+    Events are stored even when no outbox row carries their message ID yet
+    (Green API can report 'sent' before drain-reminder-outbox records the ID);
+    get-reminder-history joins on message_id, so such rows show up once the
+    outbox side is written. outbox_id is filled in by whichever event arrives
+    after the match is possible.
+    """
+
+    def __init__(self, pool: ydb.SessionPool):
+        self.pool = pool
+
+    def record(self, events: List[Dict[str, Any]]) -> int:
+        """Upsert events in one statement; returns how many matched a sent reminder"""
+        events = latest_per_message(events)
+        if not events:
+            return 0
+
+        def execute_query(session):
+            query = f"""
+                DECLARE $events AS {DELIVERY_ROWS_TYPE};
+                DECLARE $now AS Timestamp;
+                $rows = (
+                    SELECT e.message_id AS message_id, COALESCE(o.id, d.outbox_id) AS outbox_id, e.status AS status,
+                           e.status_rank AS status_rank, e.green_api_status AS green_api_status,
+                           e.status_at AS status_at, $now AS updated_at
+                    FROM AS_TABLE($events) AS e
+                    LEFT JOIN reminder_outbox VIEW idx_message_id AS o ON o.message_id = e.message_id
+                    LEFT JOIN reminder_delivery AS d ON d.message_id = e.message_id
+                    WHERE d.status_rank IS NULL OR e.status_rank >= d.status_rank
+                );
+                SELECT COUNT_IF(outbox_id IS NOT NULL) AS matched FROM $rows;
+                UPSERT INTO reminder_delivery SELECT * FROM $rows;
+            """
+            return session.transaction(ydb.SerializableReadWrite()).execute(
+                session.prepare(query),
+                {'$events': events, '$now': datetime.utcnow()},
+                commit_tx=True
+            )
+
+        result_sets = self.pool.retry_operation_sync(execute_query)
+        return result_sets[0].rows[0].matched if result_sets and result_sets[0].rows else 0
+
+class LocalDeliveryStore:
+    """In-memory stand-in for YdbDeliveryStore; sent_message_ids maps message ID -> outbox ID"""
+
+    def __init__(self, sent_message_ids: Dict[str, str]):
+        self.sent_message_ids = sent_message_ids
+        self.rows = {}
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def record(self, events: List[Dict[str, Any]]) -> int:
+        matched = 0
+        with self.lock:
+            self.writes += 1
+            for event in latest_per_message(events):
+                current = self.rows.get(event['message_id'])
+                if current is None or event['status_rank'] >= current['status_rank']:
+                    outbox_id = self.sent_message_ids.get(event['message_id']) or (current or {}).get('outbox_id')
+                    self.rows[event['message_id']] = dict(event, outbox_id=outbox_id)
+                    if outbox_id is not None:
+                        matched += 1
+        return matched
+
+class NotificationDrainer:
+    """
+    Drains Green API notification queues and records reminder delivery statuses
+
+    Green API's queue only advances on delete, so a status event is written
+    before its notification is deleted; if the write fails the notification
+    stays queued for the next run, and if the delete fails it is received and
+    written again (writes never lower a status). Instances are drained in
+    parallel, and one instance failing does not stop the others.
+    """
+
+    def __init__(self, store, client_factory):
+        self.store = store
+        self.client_factory = client_factory
+
+    def drain_instance(self, instance_id: str, token: str, deadline: float) -> Dict[str, int]:
+        client = self.client_factory(instance_id, token)
+        counts = {'received': 0, 'status_events': 0, 'matched': 0}
+        try:
+            while time.monotonic() < deadline:
+                notification = client.receive()
+                if notification is None:
+                    break
+                counts['received'] += 1
+                event = parse_status_event(notification.get('body'))
+                if event:
+                    counts['status_events'] += 1
+                    counts['matched'] += self.store.record([event])
+                client.delete(notification['receiptId'])
+        except GreenAPIError as e:
+            logger.warning(f"Notification drain for instance {instance_id[:4]}**** stopped: {e}")
+        except Exception as e:
+            # Left in the queue undeleted; the next run records it again
+            logger.error(f"Recording notifications for instance {instance_id[:4]}**** failed: {e}")
+        return counts
+
+    def run(self, instances: List[Tuple[str, str]], time_budget: float = TIME_BUDGET_SECONDS) -> Dict[str, Any]:
+        """Drain every (instance_id, token) until its queue is empty or the time budget is spent"""
+        started = time.monotonic()
+        deadline = started + time_budget
+        summary = {'instances': len(instances), 'received': 0, 'status_events': 0, 'matched': 0}
+        if instances:
+            with ThreadPoolExecutor(max_workers=min(MAX_INSTANCE_WORKERS, len(instances))) as executor:
+                for counts in executor.map(lambda item: self.drain_instance(item[0], item[1], deadline), instances):
+                    for key, value in counts.items():
+                        summary[key] += value
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 2)
+        return summary
+
+def run_local(queues: Dict[str, List[Dict[str, Any]]], sent_message_ids: Dict[str, str],
+              time_budget: float = TIME_BUDGET_SECONDS) -> Tuple[Dict[str, Any], LocalDeliveryStore]:
+    """
+    Drain fake notification queues ({instance_id: [notification bodies]}) without YDB or Green API
+    """
+    fakes = {instance_id: FakeGreenAPINotifications(bodies) for instance_id, bodies in queues.items()}
+    store = LocalDeliveryStore(sent_message_ids)
+    drainer = NotificationDrainer(store, lambda instance_id, token: fakes[instance_id])
+    return drainer.run([(instance_id, 'local') for instance_id in queues], time_budget), store
+
+def get_ydb_driver():
+    """Create and return YDB driver"""
+    endpoint = os.environ['YDB_ENDPOINT']
+    database = os.environ['YDB_DATABASE']
+
+    driver_config = ydb.DriverConfig(
+        endpoint=endpoint,
+        database=database,
+        credentials=ydb.iam.MetadataUrlCredentials(),
+    )
+
+    driver = ydb.Driver(driver_config)
+    driver.wait(fail_fast=True)
+    return driver
+
+def initialize_delivery_tables():
+    """Create the reminder_delivery table (run once)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        pool.retry_operation_sync(lambda session: session.execute_scheme(REMINDER_DELIVERY_TABLE))
+        logger.info("reminder_delivery table created successfully")
+    finally:
+        driver.stop()
+
+def migrate_outbox_message_id_index():
+    """
+    Add idx_message_id to an already-deployed reminder_outbox (run once)
+
+    Only for outbox tables created before REMINDER_OUTBOX_TABLE declared the
+    index; a fresh deploy already has it and this would fail.
+    """
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        pool.retry_operation_sync(lambda session: session.execute_scheme(REMINDER_OUTBOX_MESSAGE_ID_INDEX))
+        logger.info("reminder_outbox idx_message_id created successfully")
+    finally:
+        driver.stop()
+
+def get_instances(pool: ydb.SessionPool) -> List[Tuple[str, str]]:
+    """Distinct Green API credentials of users with reminders enabled"""
+    def execute_query(session):
+        query = """
+            SELECT DISTINCT green_api_instance_id, green_api_token
+            FROM whatsapp_settings
+            WHERE is_enabled = true
+            AND green_api_instance_id IS NOT NULL
+            AND green_api_token IS NOT NULL;
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(query, commit_tx=True)
+
+    result_sets = pool.retry_operation_sync(execute_query)
+    return [(row.green_api_instance_id, row.green_api_token) for row in result_sets[0].rows]
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler draining Green API notification queues
+
+    Triggered by a timer every minute. Records sent/delivered/read/failed
+    statuses of reminders sent by drain-reminder-outbox in reminder_delivery;
+    other notification types are acknowledged and dropped.
+    """
+    try:
+        driver = get_ydb_driver()
+        try:
+            pool = ydb.SessionPool(driver)
+            drainer = NotificationDrainer(YdbDeliveryStore(pool), GreenAPINotificationClient)
+            summary = drainer.run(get_instances(pool))
+        finally:
+            driver.stop()
+
+        logger.info(f"Green API notifications drained: {summary['received']} received, {summary['status_events']} statuses recorded, {summary['matched']} matched to reminders")
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'message': 'Green API notifications drained',
+                'summary': summary
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Green API notification drain failed: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'error': 'Internal server error',
+                'message': str(e)
+            })
+        }
@@ -0,0 +1,610 @@
+import os
+import json
+import logging
+import ydb
+import requests
+from requests.adapters import HTTPAdapter
+import time
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from reminder_outbox import YdbOutboxQueue, LocalOutboxQueue
+from instance_health import InstanceHealthCache, status_for_error
+from send_quota import GREEN_API_SEND_QUOTA_TABLE, YdbSendQuotaStore, LocalSendQuotaStore, LeasedRateLimiter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class WhatsAppError(Exception):
+    """Custom exception for WhatsApp-related errors"""
+    def __init__(self, message: str, error_code: Optional[str] = None, retryable: bool = False):
+        self.message = message
+        self.error_code = error_code
+        self.retryable = retryable
+        super().__init__(self.message)
+
+# Sustained send rate and burst allowed per Green API instance, across all concurrent drainers
+MESSAGES_PER_SECOND_PER_INSTANCE = 1.0
+INSTANCE_BURST = 1
+
+# Users (Green API instances) sent to in parallel
+MAX_DISPATCH_WORKERS = 8
+
+# Messages leased from the outbox per batch, and how long the lease lasts
+CLAIM_BATCH_SIZE = 50
+LEASE_SECONDS = 120
+
+# Retry schedule: attempt n waits BACKOFF_BASE_SECONDS * 2^(n-1), capped; dead after MAX_ATTEMPTS
+BACKOFF_BASE_SECONDS = 30
+MAX_BACKOFF_SECONDS = 1800
+MAX_ATTEMPTS = 5
+
+# Stop claiming batches and starting sends after this many seconds (function timeout is 30s);
+# messages not sent by then go back to the outbox
+TIME_BUDGET_SECONDS = 20
+
+# Consecutive retryable failures that open a breaker (per instance / across all instances),
+# and how long it stays open before a half-open probe is let through
+INSTANCE_FAILURE_THRESHOLD = 3
+GLOBAL_FAILURE_THRESHOLD = 10
+BREAKER_OPEN_SECONDS = 60
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker for Green API sends
+    
+    closed: sends allowed; threshold consecutive failures open the breaker.
+    open: sends rejected for open_seconds, then one half-open probe is let
+    through; its success closes the breaker and its failure reopens it. A
+    probe that never reports back is replaced after another open_seconds.
+    """
+    
+    def __init__(self, name: str, threshold: int, open_seconds: float):
+        self.name = name
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.changed_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            now = time.monotonic()
+            if now - self.changed_at >= self.open_seconds:
+                self.state = 'half_open'
+                self.changed_at = now
+                return True
+            return False
+    
+    def retry_after(self) -> float:
+        """Seconds until a probe may be sent (0 while closed)"""
+        with self.lock:
+            if self.state == 'closed':
+                return 0.0
+            return max(0.0, self.open_seconds - (time.monotonic() - self.changed_at))
+    
+    def record_success(self):
+        with self.lock:
+            if self.state != 'closed':
+                logger.info(f"Circuit breaker {self.name} closed")
+            self.state = 'closed'
+            self.failures = 0
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                logger.warning(f"Circuit breaker {self.name} opened after {self.failures} consecutive failures")
+                self.state = 'open'
+                self.changed_at = time.monotonic()
+
+class CircuitBreakers:
+    """Global Green API breaker plus one breaker per instance"""
+    
+    def __init__(self):
+        self.global_breaker = CircuitBreaker('green-api', GLOBAL_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS)
+        self.instances = {}
+        self.lock = threading.Lock()
+    
+    def for_instance(self, instance_id: str) -> CircuitBreaker:
+        with self.lock:
+            if instance_id not in self.instances:
+                self.instances[instance_id] = CircuitBreaker(
+                    f'instance {instance_id[:4]}****', INSTANCE_FAILURE_THRESHOLD, BREAKER_OPEN_SECONDS
+                )
+            return self.instances[instance_id]
+
+# Breaker state per container, so an outage seen by one run is remembered by the next warm one
+_circuit_breakers = CircuitBreakers()
+
+# Green API HTTP settings: (connect, read) timeouts in seconds and keep-alive pool size.
+# A send started at the end of the time budget still finishes before the function timeout.
+GREEN_API_TIMEOUT = (3, 5)
+GREEN_API_POOL_SIZE = 10
+
+# One keep-alive session per container, reused across warm invocations
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """Shared pooled session so messages reuse the TLS connection to api.green-api.com"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GREEN_API_POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
+class GreenAPIClient:
+    """Green API client for WhatsApp messaging"""
+    
+    def __init__(self, instance_id: str, token: str):
+        self.instance_id = instance_id
+        self.token = token
+        self.base_url = f"https://api.green-api.com/waInstance{instance_id}"
+        self.session = get_http_session()
+        
+    def send_message(self, phone_number: str, message: str) -> Dict[str, Any]:
+        """Send WhatsApp message via Green API"""
+        try:
+            # Format phone number
+            formatted_phone = self._format_phone_number(phone_number)
+            
+            # Prepare request
+            url = f"{self.base_url}/sendMessage/{self.token}"
+            payload = {
+                "chatId": f"{formatted_phone}@c.us",
+                "message": message
+            }
+            
+            logger.info(f"Sending WhatsApp message to {formatted_phone[:5]}****")
+            
+            response = self.session.post(url, json=payload, timeout=GREEN_API_TIMEOUT)
+            
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('idMessage'):
+                    logger.info(f"Message sent successfully: {result.get('idMessage')}")
+                    return result
+                else:
+                    raise WhatsAppError(
+                        f"Message sending failed: {result.get('error', 'Unknown error')}",
+                        error_code="SEND_FAILED",
+                        retryable=True
+                    )
+            elif response.status_code == 429:
+                raise WhatsAppError(
+                    "Rate limit exceeded",
+                    error_code="RATE_LIMIT",
+                    retryable=True
+                )
+            elif response.status_code == 401:
+                raise WhatsAppError(
+                    "Invalid Green API credentials",
+                    error_code="AUTH_FAILED",
+                    retryable=False
+                )
+            else:
+                raise WhatsAppError(
+                    f"HTTP error {response.status_code}: {response.text}",
+                    error_code="HTTP_ERROR",
+                    retryable=True
+                )
+                
+        except requests.exceptions.Timeout:
+            raise WhatsAppError(
+                "Request timeout",
+                error_code="TIMEOUT",
+                retryable=True
+            )
+        except requests.exceptions.ConnectionError:
+            raise WhatsAppError(
+                "Connection error",
+                error_code="CONNECTION_ERROR",
+                retryable=True
+            )
+        except Exception as e:
+            if isinstance(e, WhatsAppError):
+                raise
+            raise WhatsAppError(
+                f"Unexpected error: {str(e)}",
+                error_code="UNKNOWN_ERROR",
+                retryable=False
+            )
+    
+    def test_connection(self) -> Tuple[bool, Optional[str], Optional[str]]:
+        """Test Green API connection and credentials; returns (success, error_message, error_code)"""
+        try:
+            url = f"{self.base_url}/getSettings/{self.token}"
+            response = self.session.get(url, timeout=GREEN_API_TIMEOUT)
+            
+            if response.status_code == 200:
+                return True, None, None
+            elif response.status_code == 401:
+                return False, "Invalid credentials", "AUTH_FAILED"
+            else:
+                return False, f"Connection test failed: {response.status_code}", "HTTP_ERROR"
+                
+        except requests.exceptions.Timeout:
+            return False, "Connection error: request timeout", "TIMEOUT"
+        except Exception as e:
+            return False, f"Connection error: {str(e)}", "CONNECTION_ERROR"
+    
+    def _format_phone_number(self, phone_number: str) -> str:
+        """Format phone number for Green API"""
+        # clients.phone_normalized is stored in this form already; no regex needed
+        if phone_number.isdigit() and len(phone_number) >= 10 and not (len(phone_number) == 11 and phone_number.startswith('8')):
+            return phone_number
+        
+        # Remove all non-digit characters
+        digits_only = re.sub(r'\D', '', phone_number)
+        
+        # Remove leading + if present
+        if digits_only.startswith('7') and len(digits_only) == 11:
+            # Russian number format
+            return digits_only
+        elif digits_only.startswith('8') and len(digits_only) == 11:
+            # Convert Russian 8 to 7
+            return '7' + digits_only[1:]
+        elif len(digits_only) >= 10:
+            # International format
+            return digits_only
+        else:
+            raise WhatsAppError(
+                f"Invalid phone number format: {phone_number}",
+                error_code="INVALID_PHONE",
+                retryable=False
+            )
+
+def get_ydb_driver():
+    """Create and return YDB driver"""
+    endpoint = os.environ['YDB_ENDPOINT']
+    database = os.environ['YDB_DATABASE']
+    
+    driver_config = ydb.DriverConfig(
+        endpoint=endpoint,
+        database=database,
+        credentials=ydb.iam.MetadataUrlCredentials(),
+    )
+    
+    driver = ydb.Driver(driver_config)
+    driver.wait(fail_fast=True)
+    return driver
+
+def initialize_send_quota_table():
+    """Create the green_api_send_quota table (run once)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        pool.retry_operation_sync(lambda session: session.execute_scheme(GREEN_API_SEND_QUOTA_TABLE))
+        logger.info("green_api_send_quota table created successfully")
+    finally:
+        driver.stop()
+
+def get_credentials(pool: ydb.SessionPool, user_ids: List[str]) -> Dict[str, Dict[str, str]]:
+    """Green API credentials of enabled users, keyed by user_id"""
+    def execute_query(session):
+        query = """
+            DECLARE $user_ids AS List<Utf8>;
+            SELECT user_id, green_api_instance_id, green_api_token
+            FROM whatsapp_settings
+            WHERE user_id IN $user_ids
+            AND is_enabled = true
+            AND green_api_instance_id IS NOT NULL
+            AND green_api_token IS NOT NULL;
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {'$user_ids': user_ids},
+            commit_tx=True
+        )
+
+    result_sets = pool.retry_operation_sync(execute_query)
+    return {
+        row.user_id: {'instance_id': row.green_api_instance_id, 'token': row.green_api_token}
+        for row in result_sets[0].rows
+    }
+
+def backoff_seconds(attempts: int) -> int:
+    """Delay before the next attempt after attempts failed ones"""
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+
+class OutboxDrainer:
+    """
+    Sends leased outbox messages and records each outcome
+
+    Messages are grouped by user (Green API instance); instances are sent to
+    in parallel, each through a token bucket in the shared quota store, so
+    concurrent drainers together stay within the instance's rate. Sends that
+    could not start before the run's deadline are released: put back as
+    pending with their attempt returned, due at once. A failed send is never
+    retried inline: retryable errors go back to the outbox as pending with an
+    exponential backoff, anything else (or the last attempt) becomes dead.
+    
+    With a health cache, instances whose credentials were recently rejected
+    are not sent to, and every batch records the instance health its sends
+    revealed, so no separate getSettings probe is needed.
+    
+    Circuit breakers (per instance and global) stop sending during an
+    outage: messages reached while a breaker is open are deferred, i.e. put
+    back as pending with their attempt returned, until the next probe.
+    """
+    
+    def __init__(self, queue, get_credentials: Callable[[List[str]], Dict[str, Dict[str, str]]],
+                 send_func: Optional[Callable[[Dict[str, str], str, str], Dict[str, Any]]] = None,
+                 health: Optional[InstanceHealthCache] = None,
+                 breakers: Optional[CircuitBreakers] = None,
+                 quota_store=None):
+        self.queue = queue
+        self.get_credentials = get_credentials
+        self.send_func = send_func or self._send_via_green_api
+        self.health = health
+        self.breakers = breakers or CircuitBreakers()
+        self.quota_store = quota_store or LocalSendQuotaStore()
+        self.rate_limiters = {}
+        self.rate_limiters_lock = threading.Lock()
+    
+    def _rate_limiter(self, instance_id: str) -> LeasedRateLimiter:
+        with self.rate_limiters_lock:
+            if instance_id not in self.rate_limiters:
+                self.rate_limiters[instance_id] = LeasedRateLimiter(
+                    self.quota_store, instance_id, MESSAGES_PER_SECOND_PER_INSTANCE, INSTANCE_BURST
+                )
+            return self.rate_limiters[instance_id]
+    
+    def _send_via_green_api(self, credentials: Dict[str, str], phone: str, message: str) -> Dict[str, Any]:
+        instance_id = credentials['instance_id']
+        client = GreenAPIClient(instance_id, credentials['token'])
+        return client.send_message(phone, message)
+    
+    def _outcome(self, message: Dict[str, Any], error: Optional[WhatsAppError] = None, message_id: Optional[str] = None) -> Dict[str, Any]:
+        if error is None:
+            return {'message': message, 'status': 'sent', 'message_id': message_id}
+        if error.retryable and message['attempts'] < MAX_ATTEMPTS:
+            return {
+                'message': message,
+                'status': 'pending',
+                'error': error.message,
+                'error_code': error.error_code,
+                'next_attempt_at': datetime.utcnow() + timedelta(seconds=backoff_seconds(message['attempts']))
+            }
+        return {'message': message, 'status': 'dead', 'error': error.message, 'error_code': error.error_code}
+    
+    def _deferred(self, message: Dict[str, Any], breaker: CircuitBreaker) -> Dict[str, Any]:
+        """Back to pending without spending an attempt, due when the breaker allows a probe"""
+        return {
+            'message': message,
+            'status': 'pending',
+            'deferred': True,
+            'attempts': message['attempts'] - 1,
+            'error': f"Circuit breaker {breaker.name} open",
+            'next_attempt_at': datetime.utcnow() + timedelta(seconds=max(breaker.retry_after(), 1))
+        }
+    
+    def _released(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Back to pending without spending an attempt, due at once, when the run's deadline is reached"""
+        return {
+            'message': message,
+            'status': 'pending',
+            'released': True,
+            'attempts': message['attempts'] - 1,
+            'next_attempt_at': datetime.utcnow()
+        }
+    
+    def _send_user_messages(self, credentials: Optional[Dict[str, str]], messages: List[Dict[str, Any]],
+                            deadline: Optional[float] = None) -> List[Dict[str, Any]]:
+        if not credentials:
+            error = WhatsAppError("WhatsApp reminders are disabled or not configured", error_code="NOT_CONFIGURED")
+            return [self._outcome(message, error) for message in messages]
+        
+        instance_breaker = self.breakers.for_instance(credentials['instance_id'])
+        global_breaker = self.breakers.global_breaker
+        # One quota lease covers this user's messages in the batch
+        rate_limiter = self._rate_limiter(credentials['instance_id'])
+        rate_limiter.expect(len(messages))
+        outcomes = []
+        for index, message in enumerate(messages):
+            if not global_breaker.allow():
+                outcomes.append(self._deferred(message, global_breaker))
+                continue
+            if not instance_breaker.allow():
+                outcomes.append(self._deferred(message, instance_breaker))
+                continue
+            # Every attempt spends a token of this instance's quota; none is waited for past the deadline
+            if not rate_limiter.acquire(deadline):
+                outcomes.extend(self._released(unsent) for unsent in messages[index:])
+                break
+            error = None
+            try:
+                response = self.send_func(credentials, message['phone'], message['message'])
+                outcome = self._outcome(message, message_id=response.get('idMessage'))
+            except WhatsAppError as e:
+                logger.warning(f"Outbox message {message['id']} attempt {message['attempts']} failed: {e.message}")
+                error = e
+                outcome = self._outcome(message, error)
+            except Exception as e:
+                logger.error(f"Outbox message {message['id']} attempt {message['attempts']} failed: {e}")
+                error = WhatsAppError(str(e), error_code="UNKNOWN_ERROR", retryable=True)
+                outcome = self._outcome(message, error)
+            
+            # Only retryable errors (timeouts, 5xx, 429) count against Green API; anything else is an answer
+            if error is not None and error.retryable:
+                instance_breaker.record_failure()
+                global_breaker.record_failure()
+            else:
+                instance_breaker.record_success()
+                global_breaker.record_success()
+            outcomes.append(outcome)
+        return outcomes
+    
+    def _skip_rejected_instances(self, by_user: Dict[str, List[Dict[str, Any]]],
+                                 credentials: Dict[str, Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Fail (without sending) messages of users whose credentials were recently rejected"""
+        pairs = {(c['instance_id'], c['token']) for c in (credentials.get(user_id) for user_id in by_user) if c}
+        if not self.health or not pairs:
+            return []
+        try:
+            known = self.health.lookup(list(pairs))
+        except Exception as e:
+            logger.warning(f"Could not read Green API instance health: {e}")
+            return []
+        
+        outcomes = []
+        for user_id in list(by_user):
+            user_credentials = credentials.get(user_id)
+            record = known.get((user_credentials['instance_id'], user_credentials['token'])) if user_credentials else None
+            if record and record['status'] == 'auth_failed':
+                error = WhatsAppError("Invalid Green API credentials", error_code="AUTH_FAILED")
+                outcomes.extend(self._outcome(message, error) for message in by_user.pop(user_id))
+        return outcomes
+    
+    def _record_health(self, batches: List[Tuple[Optional[Dict[str, str]], List[Dict[str, Any]]]]):
+        """Store the instance health implied by each user's send outcomes"""
+        results = []
+        for user_credentials, outcomes in batches:
+            if not user_credentials or not outcomes:
+                continue
+            if any(outcome['status'] == 'sent' for outcome in outcomes):
+                status, error = 'ok', None
+            else:
+                failure = next((o for o in outcomes if status_for_error(o.get('error_code'))), None)
+                if failure is None:
+                    continue
+                status, error = status_for_error(failure['error_code']), failure['error']
+            results.append({
+                'instance_id': user_credentials['instance_id'],
+                'token': user_credentials['token'],
+                'status': status,
+                'error': error,
+                'source': 'send'
+            })
+        self.health.record(results)
+    
+    def drain_batch(self, deadline: Optional[float] = None) -> Dict[str, int]:
+        """Claim, send and complete one batch; returns counts per outcome status"""
+        messages = self.queue.claim_batch(CLAIM_BATCH_SIZE, LEASE_SECONDS)
+        if not messages:
+            return {}
+        
+        by_user = {}
+        for message in messages:
+            by_user.setdefault(message['user_id'], []).append(message)
+        credentials = self.get_credentials(list(by_user))
+        outcomes = self._skip_rejected_instances(by_user, credentials)
+        
+        if by_user:
+            with ThreadPoolExecutor(max_workers=min(MAX_DISPATCH_WORKERS, len(by_user))) as executor:
+                batches = list(executor.map(
+                    lambda item: (credentials.get(item[0]), self._send_user_messages(credentials.get(item[0]), item[1], deadline)),
+                    by_user.items()
+                ))
+            outcomes.extend(outcome for _, batch in batches for outcome in batch)
+            if self.health:
+                self._record_health(batches)
+        
+        self.queue.complete(outcomes)
+        
+        counts = {}
+        for outcome in outcomes:
+            if outcome.get('released'):
+                status = 'released'
+            elif outcome.get('deferred'):
+                status = 'deferred'
+            else:
+                status = outcome['status']
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+    
+    def run(self, time_budget: float = TIME_BUDGET_SECONDS) -> Dict[str, Any]:
+        """Drain batches until the outbox has nothing due or the time budget is spent"""
+        started = time.monotonic()
+        deadline = started + time_budget
+        summary = {'batches': 0, 'sent': 0, 'pending': 0, 'dead': 0, 'deferred': 0, 'released': 0}
+        while time.monotonic() - started < time_budget:
+            # While Green API as a whole is failing, leave the backlog for a later run
+            if self.breakers.global_breaker.retry_after() > 0:
+                summary['circuit_open'] = True
+                break
+            counts = self.drain_batch(deadline)
+            if not counts:
+                break
+            summary['batches'] += 1
+            for status, count in counts.items():
+                summary[status] += count
+            # Released messages mean the deadline was reached mid-batch
+            if counts.get('released'):
+                break
+        summary['elapsed_seconds'] = round(time.monotonic() - started, 2)
+        return summary
+
+def run_local(messages: List[Dict[str, Any]], send_func: Callable[[Dict[str, str], str, str], Dict[str, Any]],
+              time_budget: float = TIME_BUDGET_SECONDS) -> Tuple[Dict[str, Any], LocalOutboxQueue]:
+    """
+    Drain an in-memory outbox with a fake sender, without YDB or Green API
+
+    send_func(credentials, phone, message) returns {'idMessage': ...} or raises WhatsAppError.
+    """
+    queue = LocalOutboxQueue(messages)
+    drainer = OutboxDrainer(
+        queue,
+        lambda user_ids: {user_id: {'instance_id': 'local', 'token': 'local'} for user_id in user_ids},
+        send_func
+    )
+    return drainer.run(time_budget), queue
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler draining reminder_outbox
+    
+    Triggered by a timer every minute (and by send-manual-reminder when a job
+    is queued). Sends due messages queued by send-auto-reminders and
+    send-manual-reminder, schedules retries and reports the remaining
+    outbox backlog.
+    """
+    try:
+        driver = get_ydb_driver()
+        try:
+            pool = ydb.SessionPool(driver)
+            queue = YdbOutboxQueue(pool)
+            drainer = OutboxDrainer(
+                queue,
+                lambda user_ids: get_credentials(pool, user_ids),
+                health=InstanceHealthCache(pool),
+                breakers=_circuit_breakers,
+                quota_store=YdbSendQuotaStore(pool)
+            )
+            summary = drainer.run()
+            stats = queue.stats()
+        finally:
+            driver.stop()
+        
+        logger.info(f"Reminder outbox drained: {summary['sent']} sent, {summary['pending']} rescheduled, {summary['dead']} dead, {summary['deferred']} deferred, {summary['released']} released; {stats['pending_count']} pending")
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'message': 'Reminder outbox drained',
+                'summary': summary,
+                'outbox': stats
+            })
+        }
+        
+    except Exception as e:
+        logger.error(f"Reminder outbox drain failed: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'error': 'Internal server error',
+                'message': str(e)
+            })
+        }
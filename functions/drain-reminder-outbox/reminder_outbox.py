@@ -0,0 +1,382 @@
+import ydb
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Messages written per statement when enqueueing
+ENQUEUE_CHUNK_SIZE = 500
+
+# Candidates checked per reminder_log lookup; each matches at most one row, so results stay under YDB's row limit
+LOG_LOOKUP_CHUNK_SIZE = 1000
+
+REMINDER_OUTBOX_TABLE = """
+CREATE TABLE reminder_outbox (
+    id Utf8 NOT NULL,
+    user_id Utf8,
+    job_id Utf8,
+    installment_id Utf8,
+    payment_id Utf8,
+    template_type Utf8,
+    reminder_date Date,
+    phone Utf8,
+    message Utf8,
+    status Utf8,
+    attempts Int32,
+    next_attempt_at Timestamp,
+    last_error Utf8,
+    message_id Utf8,
+    created_at Timestamp,
+    updated_at Timestamp,
+    sent_at Timestamp,
+    PRIMARY KEY (id),
+    INDEX idx_status_next GLOBAL ON (status, next_attempt_at),
+    INDEX idx_user_created GLOBAL ON (user_id, created_at),
+    INDEX idx_job GLOBAL ON (job_id),
+    INDEX idx_message_id GLOBAL ON (message_id)
+)
+WITH (TTL = Interval("P30D") ON created_at);
+"""
+
+REMINDER_LOG_TABLE = """
+CREATE TABLE reminder_log (
+    payment_id Utf8 NOT NULL,
+    template_type Utf8 NOT NULL,
+    reminder_date Date NOT NULL,
+    user_id Utf8,
+    installment_id Utf8,
+    status Utf8,
+    message_id Utf8,
+    error Utf8,
+    attempts Int32,
+    created_at Timestamp,
+    updated_at Timestamp,
+    PRIMARY KEY (payment_id, template_type, reminder_date),
+    INDEX idx_user_installment GLOBAL ON (user_id, installment_id, created_at)
+)
+WITH (TTL = Interval("P180D") ON created_at);
+"""
+
+# Outbox statuses: pending (waiting or scheduled for retry) -> sending (leased by a drainer) -> sent | dead
+OUTBOX_STATUSES = ('pending', 'sending', 'sent', 'dead')
+
+# reminder_log status for each final outbox status
+LOG_STATUSES = {'sent': 'sent', 'dead': 'failed'}
+
+OUTBOX_ROWS_TYPE = """List<Struct<
+    id: Utf8, user_id: Utf8, job_id: Utf8?, installment_id: Utf8, payment_id: Utf8?, template_type: Utf8,
+    reminder_date: Date, phone: Utf8, message: Utf8
+>>"""
+
+RESULT_ROWS_TYPE = """List<Struct<
+    id: Utf8, status: Utf8, attempts: Int32, next_attempt_at: Timestamp?, last_error: Utf8?, message_id: Utf8?, sent_at: Timestamp?
+>>"""
+
+LOG_ROWS_TYPE = """List<Struct<
+    payment_id: Utf8, template_type: Utf8, reminder_date: Date, status: Utf8, message_id: Utf8?, error: Utf8?, attempts: Int32
+>>"""
+
+def make_outbox_id(payment_id: str, template_type: str, reminder_date) -> str:
+    """Deterministic outbox id: re-running a selection never queues the same reminder twice"""
+    return f"{payment_id}:{template_type}:{reminder_date.isoformat()}"
+
+def to_datetime(value):
+    """Convert YDB timestamp (microseconds) to datetime"""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value / 1000000)
+    return value
+
+def to_date(value):
+    """Convert YDB date (days since epoch) to Python date"""
+    if isinstance(value, int):
+        return (datetime(1970, 1, 1) + timedelta(days=value)).date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+def filter_unlogged(pool: ydb.SessionPool, reminder_date, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop candidates that already have a reminder_log entry for the date, in bulk lookups per chunk"""
+    if not candidates:
+        return []
+
+    def execute_query(session, chunk):
+        query = """
+            DECLARE $keys AS List<Struct<payment_id: Utf8, template_type: Utf8, reminder_date: Date>>;
+            SELECT l.payment_id AS payment_id, l.template_type AS template_type
+            FROM AS_TABLE($keys) AS k
+            INNER JOIN reminder_log AS l
+            ON l.payment_id = k.payment_id AND l.template_type = k.template_type AND l.reminder_date = k.reminder_date;
+        """
+        keys = [
+            {'payment_id': c['payment_id'], 'template_type': c['template_type'], 'reminder_date': reminder_date}
+            for c in chunk
+        ]
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {'$keys': keys},
+            commit_tx=True
+        )
+
+    logged = set()
+    for start in range(0, len(candidates), LOG_LOOKUP_CHUNK_SIZE):
+        result_sets = pool.retry_operation_sync(lambda session: execute_query(session, candidates[start:start + LOG_LOOKUP_CHUNK_SIZE]))
+        logged.update((row.payment_id, row.template_type) for row in result_sets[0].rows)
+    return [c for c in candidates if (c['payment_id'], c['template_type']) not in logged]
+
+def enqueue_messages(pool: ydb.SessionPool, messages: List[Dict[str, Any]]) -> int:
+    """
+    Write rendered messages to reminder_outbox in bulk
+
+    Each chunk is one transaction that skips ids already queued and records a
+    'queued' reminder_log entry for scheduled reminders (those with a
+    payment_id), so the send log and the outbox never disagree. Manual
+    reminders carry a job_id instead and are tracked per job.
+
+    Returns:
+        Number of newly queued messages
+    """
+    queued = 0
+    for start in range(0, len(messages), ENQUEUE_CHUNK_SIZE):
+        chunk = messages[start:start + ENQUEUE_CHUNK_SIZE]
+
+        def execute_query(session):
+            existing_query = """
+                DECLARE $ids AS List<Utf8>;
+                SELECT id FROM reminder_outbox WHERE id IN $ids;
+            """
+            insert_query = f"""
+                DECLARE $rows AS {OUTBOX_ROWS_TYPE};
+                DECLARE $now AS Timestamp;
+                UPSERT INTO reminder_outbox (
+                    id, user_id, job_id, installment_id, payment_id, template_type, reminder_date, phone, message,
+                    status, attempts, next_attempt_at, created_at, updated_at
+                )
+                SELECT
+                    id, user_id, job_id, installment_id, payment_id, template_type, reminder_date, phone, message,
+                    'pending' AS status, 0 AS attempts, $now AS next_attempt_at, $now AS created_at, $now AS updated_at
+                FROM AS_TABLE($rows);
+
+                UPSERT INTO reminder_log (
+                    payment_id, template_type, reminder_date, user_id, installment_id, status, attempts, created_at, updated_at
+                )
+                SELECT
+                    Unwrap(payment_id) AS payment_id, template_type, reminder_date, user_id, installment_id,
+                    'queued' AS status, 0 AS attempts, $now AS created_at, $now AS updated_at
+                FROM AS_TABLE($rows)
+                WHERE payment_id IS NOT NULL;
+            """
+            tx = session.transaction(ydb.SerializableReadWrite())
+            existing = {row.id for row in tx.execute(session.prepare(existing_query), {'$ids': [m['id'] for m in chunk]})[0].rows}
+            rows = [dict(m, job_id=m.get('job_id'), payment_id=m.get('payment_id')) for m in chunk if m['id'] not in existing]
+            if rows:
+                tx.execute(session.prepare(insert_query), {'$rows': rows, '$now': datetime.utcnow()})
+            tx.commit()
+            return len(rows)
+
+        queued += pool.retry_operation_sync(execute_query)
+    return queued
+
+class YdbOutboxQueue:
+    """reminder_outbox in YDB, leased to drainers in batches"""
+
+    def __init__(self, pool: ydb.SessionPool):
+        self.pool = pool
+
+    def claim_batch(self, limit: int, lease_seconds: int) -> List[Dict[str, Any]]:
+        """
+        Lease up to limit due messages: pending ones whose next attempt is due,
+        and sending ones whose lease expired (their drainer died mid-send)
+        """
+        def execute_query(session):
+            select_query = """
+                DECLARE $now AS Timestamp;
+                DECLARE $limit AS Uint64;
+                $due = (
+                    SELECT id FROM reminder_outbox VIEW idx_status_next
+                    WHERE status = 'pending' AND next_attempt_at <= $now
+                    UNION ALL
+                    SELECT id FROM reminder_outbox VIEW idx_status_next
+                    WHERE status = 'sending' AND next_attempt_at <= $now
+                );
+                SELECT o.id AS id, o.user_id AS user_id, o.installment_id AS installment_id, o.payment_id AS payment_id,
+                       o.template_type AS template_type, o.reminder_date AS reminder_date, o.phone AS phone,
+                       o.message AS message, o.attempts AS attempts
+                FROM (SELECT id FROM $due LIMIT $limit) AS d
+                INNER JOIN reminder_outbox AS o ON o.id = d.id;
+            """
+            lease_query = """
+                DECLARE $ids AS List<Utf8>;
+                DECLARE $lease_until AS Timestamp;
+                DECLARE $now AS Timestamp;
+                UPDATE reminder_outbox
+                SET status = 'sending', attempts = attempts + 1, next_attempt_at = $lease_until, updated_at = $now
+                WHERE id IN $ids;
+            """
+            now = datetime.utcnow()
+            tx = session.transaction(ydb.SerializableReadWrite())
+            rows = tx.execute(session.prepare(select_query), {'$now': now, '$limit': limit})[0].rows
+            if rows:
+                tx.execute(
+                    session.prepare(lease_query),
+                    {'$ids': [row.id for row in rows], '$lease_until': now + timedelta(seconds=lease_seconds), '$now': now}
+                )
+            tx.commit()
+            return [
+                {
+                    'id': row.id,
+                    'user_id': row.user_id,
+                    'installment_id': row.installment_id,
+                    'payment_id': row.payment_id,
+                    'template_type': row.template_type,
+                    'reminder_date': to_date(row.reminder_date),
+                    'phone': row.phone,
+                    'message': row.message,
+                    'attempts': (row.attempts or 0) + 1
+                }
+                for row in rows
+            ]
+
+        return self.pool.retry_operation_sync(execute_query)
+
+    def complete(self, results: List[Dict[str, Any]]):
+        """
+        Record a batch of outcomes in one transaction
+
+        Each result is {message, status: sent|pending|dead, next_attempt_at, error, message_id},
+        plus attempts when the claimed attempt was given back (never sent).
+        Final outcomes are copied to reminder_log.
+        """
+        if not results:
+            return
+
+        def execute_query(session):
+            now = datetime.utcnow()
+            result_rows = [
+                {
+                    'id': r['message']['id'],
+                    'status': r['status'],
+                    'attempts': r.get('attempts', r['message']['attempts']),
+                    'next_attempt_at': r.get('next_attempt_at'),
+                    'last_error': r.get('error'),
+                    'message_id': r.get('message_id'),
+                    'sent_at': now if r['status'] == 'sent' else None
+                }
+                for r in results
+            ]
+            log_rows = [
+                {
+                    'payment_id': r['message']['payment_id'],
+                    'template_type': r['message']['template_type'],
+                    'reminder_date': r['message']['reminder_date'],
+                    'status': LOG_STATUSES[r['status']],
+                    'message_id': r.get('message_id'),
+                    'error': r.get('error'),
+                    'attempts': r['message']['attempts']
+                }
+                for r in results if r['status'] in LOG_STATUSES and r['message'].get('payment_id')
+            ]
+            query = f"""
+                DECLARE $results AS {RESULT_ROWS_TYPE};
+                DECLARE $log_rows AS {LOG_ROWS_TYPE};
+                DECLARE $now AS Timestamp;
+                UPDATE reminder_outbox ON
+                SELECT id, status, attempts, next_attempt_at, last_error, message_id, sent_at, $now AS updated_at
+                FROM AS_TABLE($results);
+
+                UPDATE reminder_log ON
+                SELECT payment_id, template_type, reminder_date, status, message_id, error, attempts, $now AS updated_at
+                FROM AS_TABLE($log_rows);
+            """
+            session.transaction(ydb.SerializableReadWrite()).execute(
+                session.prepare(query),
+                {'$results': result_rows, '$log_rows': log_rows, '$now': now},
+                commit_tx=True
+            )
+
+        self.pool.retry_operation_sync(execute_query)
+
+    def stats(self) -> Dict[str, Any]:
+        """Outbox size per status and age of the oldest due pending message"""
+        def execute_query(session):
+            query = """
+                DECLARE $now AS Timestamp;
+                SELECT status, COUNT(*) AS cnt FROM reminder_outbox VIEW idx_status_next
+                WHERE status = 'pending' OR status = 'sending'
+                GROUP BY status;
+                SELECT MIN(next_attempt_at) AS oldest FROM reminder_outbox VIEW idx_status_next
+                WHERE status = 'pending' AND next_attempt_at <= $now;
+            """
+            return session.transaction(ydb.OnlineReadOnly()).execute(
+                session.prepare(query),
+                {'$now': datetime.utcnow()},
+                commit_tx=True
+            )
+
+        result_sets = self.pool.retry_operation_sync(execute_query)
+        counts = {row.status: int(row.cnt) for row in result_sets[0].rows}
+        oldest = to_datetime(result_sets[1].rows[0].oldest) if result_sets[1].rows else None
+        return {
+            'pending_count': counts.get('pending', 0),
+            'sending_count': counts.get('sending', 0),
+            'oldest_due_age_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0
+        }
+
+class LocalOutboxQueue:
+    """
+    In-memory stand-in for YdbOutboxQueue with the same interface
+
+    Lets the drainer run offline (no YDB, fake sender) with real lease,
+    retry and backoff behaviour.
+    """
+
+    def __init__(self, messages: Optional[List[Dict[str, Any]]] = None):
+        self.rows = {}
+        self.log = {}
+        self.lock = threading.Lock()
+        for message in messages or []:
+            self.put(message)
+
+    def put(self, message: Dict[str, Any]):
+        with self.lock:
+            if message['id'] in self.rows:
+                return
+            now = datetime.utcnow()
+            self.rows[message['id']] = dict(message, status='pending', attempts=0, next_attempt_at=now, created_at=now)
+            if message.get('payment_id'):
+                self.log[(message['payment_id'], message['template_type'], message['reminder_date'])] = {'status': 'queued'}
+
+    def claim_batch(self, limit: int, lease_seconds: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            now = datetime.utcnow()
+            due = sorted(
+                (row for row in self.rows.values() if row['status'] in ('pending', 'sending') and row['next_attempt_at'] <= now),
+                key=lambda row: row['next_attempt_at']
+            )[:limit]
+            for row in due:
+                row['status'] = 'sending'
+                row['attempts'] += 1
+                row['next_attempt_at'] = now + timedelta(seconds=lease_seconds)
+            return [dict(row) for row in due]
+
+    def complete(self, results: List[Dict[str, Any]]):
+        with self.lock:
+            for r in results:
+                row = self.rows[r['message']['id']]
+                row.update(status=r['status'], last_error=r.get('error'), message_id=r.get('message_id'))
+                row['attempts'] = r.get('attempts', r['message']['attempts'])
+                if r.get('next_attempt_at'):
+                    row['next_attempt_at'] = r['next_attempt_at']
+                if r['status'] in LOG_STATUSES and row.get('payment_id'):
+                    key = (row['payment_id'], row['template_type'], row['reminder_date'])
+                    self.log[key] = {'status': LOG_STATUSES[r['status']], 'message_id': r.get('message_id'), 'error': r.get('error')}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            counts = {}
+            for row in self.rows.values():
+                counts[row['status']] = counts.get(row['status'], 0) + 1
+            return {'pending_count': counts.get('pending', 0), 'sending_count': counts.get('sending', 0), 'counts': counts}
@@ -0,0 +1,149 @@
+import ydb
+import time
+import math
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+# A lease may borrow tokens that refill at most this far ahead; its sends wait for them
+MAX_LEASE_AHEAD_SECONDS = 10
+
+# Tokens taken from the shared bucket per round trip
+MAX_LEASE_TOKENS = 20
+
+GREEN_API_SEND_QUOTA_TABLE = """
+CREATE TABLE green_api_send_quota (
+    instance_id Utf8 NOT NULL,
+    tokens Double,
+    updated_at Timestamp,
+    PRIMARY KEY (instance_id)
+)
+WITH (TTL = Interval("P7D") ON updated_at);
+"""
+
+def take_tokens(tokens: float, updated_at: datetime, now: datetime, wanted: int,
+                rate: float, capacity: int) -> Tuple[List[datetime], float]:
+    """
+    Token bucket step shared by the YDB and local stores
+
+    Refills the bucket, then hands out up to wanted tokens. Tokens not yet
+    refilled may be borrowed up to MAX_LEASE_AHEAD_SECONDS ahead; each comes
+    with the time it becomes available, so senders wait exactly that long.
+
+    Returns:
+        Tuple of (slot times, tokens left in the bucket)
+    """
+    available = min(float(capacity), tokens + max(0.0, (now - updated_at).total_seconds()) * rate)
+    granted = max(0, min(wanted, math.floor(available + rate * MAX_LEASE_AHEAD_SECONDS)))
+    slots = [now + timedelta(seconds=max(0.0, (index + 1 - available) / rate)) for index in range(granted)]
+    return slots, available - granted
+
+class YdbSendQuotaStore:
+    """Per-instance token buckets in green_api_send_quota, shared by every function instance"""
+
+    def __init__(self, pool: ydb.SessionPool):
+        self.pool = pool
+
+    def lease(self, instance_id: str, wanted: int, rate: float, capacity: int) -> List[datetime]:
+        def execute_query(session):
+            select_query = """
+                DECLARE $instance_id AS Utf8;
+                SELECT tokens, updated_at FROM green_api_send_quota WHERE instance_id = $instance_id;
+            """
+            upsert_query = """
+                DECLARE $instance_id AS Utf8;
+                DECLARE $tokens AS Double;
+                DECLARE $now AS Timestamp;
+                UPSERT INTO green_api_send_quota (instance_id, tokens, updated_at)
+                VALUES ($instance_id, $tokens, $now);
+            """
+            now = datetime.utcnow()
+            tx = session.transaction(ydb.SerializableReadWrite())
+            rows = tx.execute(session.prepare(select_query), {'$instance_id': instance_id})[0].rows
+            if rows:
+                updated_at = rows[0].updated_at
+                if isinstance(updated_at, int):
+                    updated_at = datetime.utcfromtimestamp(updated_at / 1000000)
+                tokens = rows[0].tokens
+            else:
+                tokens, updated_at = float(capacity), now
+            slots, left = take_tokens(tokens, updated_at, now, wanted, rate, capacity)
+            tx.execute(
+                session.prepare(upsert_query),
+                {'$instance_id': instance_id, '$tokens': left, '$now': now}
+            )
+            tx.commit()
+            return slots
+
+        return self.pool.retry_operation_sync(execute_query)
+
+class LocalSendQuotaStore:
+    """In-memory stand-in for YdbSendQuotaStore with the same interface"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def lease(self, instance_id: str, wanted: int, rate: float, capacity: int) -> List[datetime]:
+        with self.lock:
+            now = datetime.utcnow()
+            tokens, updated_at = self.buckets.get(instance_id, (float(capacity), now))
+            slots, left = take_tokens(tokens, updated_at, now, wanted, rate, capacity)
+            self.buckets[instance_id] = (left, now)
+            return slots
+
+class LeasedRateLimiter:
+    """
+    Rate limiter for one Green API instance backed by a shared quota store
+
+    Tokens are leased in batches (sized by expect()) so the store sees one
+    round trip per batch of sends; acquire() waits until the next leased
+    token is due. Tokens left over when a new batch starts are dropped,
+    which only leaves the instance under its quota.
+    """
+
+    def __init__(self, store, instance_id: str, rate: float, capacity: int):
+        self.store = store
+        self.instance_id = instance_id
+        self.rate = rate
+        self.capacity = capacity
+        self.slots = deque()
+        self.expected = 0
+        self.lock = threading.Lock()
+
+    def expect(self, count: int):
+        """Size the next lease for count upcoming sends"""
+        with self.lock:
+            self.slots.clear()
+            self.expected = count
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        Wait until the next leased token is due
+
+        deadline is a time.monotonic() value; if the token would not be due
+        by then, nothing is spent and False is returned so the caller can give
+        the send back instead of running past its time budget.
+        """
+        while True:
+            with self.lock:
+                if not self.slots:
+                    wanted = max(1, min(self.expected, MAX_LEASE_TOKENS))
+                    self.slots.extend(self.store.lease(self.instance_id, wanted, self.rate, self.capacity))
+                slot = self.slots.popleft() if self.slots else None
+                if slot is not None:
+                    wait_time = max(0.0, (slot - datetime.utcnow()).total_seconds())
+                    if deadline is not None and time.monotonic() + wait_time > deadline:
+                        self.slots.appendleft(slot)
+                        return False
+                    self.expected = max(0, self.expected - 1)
+            if slot is not None:
+                break
+            # Every token is already lent out beyond the lease horizon
+            if deadline is not None and time.monotonic() + MAX_LEASE_AHEAD_SECONDS / 2 > deadline:
+                return False
+            time.sleep(MAX_LEASE_AHEAD_SECONDS / 2)
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return True
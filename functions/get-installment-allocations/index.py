@@ -33,6 +33,12 @@ def handler(event, context):
         
         # Get allocations
         allocations = get_allocations(installment_id, user_id)
+        if allocations is None:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Installment not found'})
+            }
         
         return {
             'statusCode': 200,
@@ -49,7 +55,7 @@ def handler(event, context):
         }
 
 def get_allocations(installment_id, user_id):
-    """Get all allocations for a given installment"""
+    """Get all allocations for a given installment with its funding totals (None if it does not exist)"""
     driver = get_ydb_driver()
     
     with ydb.SessionPool(driver) as pool:
@@ -58,7 +64,11 @@ def get_allocations(installment_id, user_id):
             SELECT id, wallet_id, amount_minor_units, status, created_at
             FROM installment_allocations
             WHERE installment_id = $installment_id AND user_id = $user_id
-            ORDER BY created_at DESC
+            ORDER BY created_at DESC;
+            
+            SELECT total_amount_minor_units, allocated_minor_units
+            FROM installments
+            WHERE id = $installment_id AND user_id = $user_id;
             """
             
             result_sets = session.transaction(ydb.SerializableReadOnly()).execute(
@@ -79,6 +89,22 @@ def get_allocations(installment_id, user_id):
                     'created_at': row.created_at.isoformat()
                 })
             
-            return allocations
+            installment_rows = list(result_sets[1].rows)
+            if not installment_rows:
+                return None
+            
+            # Maintained by allocate and void, so no aggregation over the allocations is needed
+            total_amount = installment_rows[0].total_amount_minor_units
+            allocated = installment_rows[0].allocated_minor_units
+            if allocated is None:
+                # Installments allocated to before the column existed, until backfill_allocated_totals() has run
+                allocated = sum(a['amount_minor_units'] for a in allocations if a['status'] == 'active')
+            return {
+                'installment_id': installment_id,
+                'total_amount_minor_units': total_amount,
+                'allocated_minor_units': allocated,
+                'remaining_minor_units': total_amount - allocated if total_amount is not None else None,
+                'allocations': allocations
+            }
             
         return pool.retry_operation_sync(callee)
@@ -0,0 +1,181 @@
+import os
+import json
+import ydb
+import jwt
+import logging
+from datetime import datetime, date
+from typing import Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class JWTAuth:
+    """Handles JWT token authentication and validation"""
+    
+    @staticmethod
+    def verify_jwt_token(token: str, token_type: str = 'access') -> dict:
+        """Verify and decode JWT token"""
+        secret_key = os.environ.get('JWT_SECRET_KEY', 'your-super-secret-jwt-key-change-in-production')
+        
+        try:
+            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
+            
+            # Check token type
+            if payload.get('type') != token_type:
+                raise ValueError(f"Invalid token type. Expected {token_type}")
+            
+            return payload
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Token has expired")
+        except jwt.InvalidTokenError:
+            raise ValueError("Invalid token")
+    
+    @staticmethod
+    def extract_token_from_event(event: dict) -> Optional[str]:
+        """Extract JWT token from Authorization header"""
+        headers = event.get('headers', {})
+        
+        # Handle case-insensitive headers
+        auth_header = None
+        for key, value in headers.items():
+            if key.lower() == 'authorization':
+                auth_header = value
+                break
+        
+        if not auth_header:
+            return None
+        
+        # Extract token from Bearer header
+        if not auth_header.startswith('Bearer '):
+            return None
+        
+        return auth_header[7:]  # Remove 'Bearer ' prefix
+    
+    @staticmethod
+    def authenticate_request(event: dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Authenticate request and return user_id and error message
+        Returns: (user_id, error_message)
+        """
+        try:
+            # Extract JWT token
+            token = JWTAuth.extract_token_from_event(event)
+            
+            if not token:
+                return None, "Authorization header missing or invalid format"
+            
+            # Verify token
+            payload = JWTAuth.verify_jwt_token(token, 'access')
+            user_id = payload.get('user_id')
+            
+            if not user_id:
+                return None, "Invalid token: user_id not found"
+            
+            logger.info(f"Request authenticated for user: {payload.get('email', 'unknown')}")
+            return user_id, None
+            
+        except ValueError as e:
+            return None, f"Authentication failed: {str(e)}"
+        except Exception as e:
+            logger.error(f"Unexpected authentication error: {e}")
+            return None, "Authentication error"
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler returning the reminder history of an installment
+    (entries of reminder_log written by send-auto-reminders, newest first),
+    with the delivery status reported by Green API where one was received.
+    """
+    try:
+        # Authentication
+        user_id, auth_error = JWTAuth.authenticate_request(event)
+        if not user_id:
+            logger.warning(f"Authentication failed: {auth_error}")
+            return {'statusCode': 401, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'Unauthorized: {auth_error}'})}
+        
+        installment_id = (event.get('pathParameters') or {}).get('id')
+        if not installment_id:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Installment ID is required'})}
+        
+        query_params = event.get('queryStringParameters', {}) or {}
+        try:
+            limit = int(query_params.get('limit', 50))
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Invalid limit'})}
+        if not (0 < limit <= 500):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Limit must be between 1 and 500'})}
+
+        try:
+            driver_config = ydb.DriverConfig(
+                endpoint=os.environ.get('YDB_ENDPOINT'),
+                database=os.environ.get('YDB_DATABASE'),
+                credentials=ydb.iam.MetadataUrlCredentials()
+            )
+            driver = ydb.Driver(driver_config)
+            driver.wait(fail_fast=True, timeout=5)
+            pool = ydb.SessionPool(driver)
+
+            def get_history(session):
+                # The index is keyed by user_id first, so other users' installments are never read
+                query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $installment_id AS Utf8;
+                DECLARE $limit AS Uint64;
+                $log = (
+                    SELECT payment_id, template_type, reminder_date, status, message_id, error, attempts, created_at, updated_at
+                    FROM reminder_log VIEW idx_user_installment
+                    WHERE user_id = $user_id AND installment_id = $installment_id
+                    ORDER BY created_at DESC
+                    LIMIT $limit
+                );
+                SELECT l.*, d.status AS delivery_status, d.status_at AS delivery_status_at
+                FROM $log AS l
+                LEFT JOIN reminder_delivery AS d ON d.message_id = l.message_id
+                ORDER BY created_at DESC;
+                """
+                return session.transaction(ydb.OnlineReadOnly()).execute(
+                    session.prepare(query),
+                    {'$user_id': user_id, '$installment_id': installment_id, '$limit': limit},
+                    commit_tx=True
+                )
+
+            result_sets = pool.retry_operation_sync(get_history)
+            driver.stop()
+
+            def convert_timestamp(ts):
+                if ts is None: return None
+                return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
+
+            def convert_date(d):
+                if d is None: return None
+                if isinstance(d, date): return d.strftime('%Y-%m-%d')
+                if isinstance(d, int): return date.fromordinal(d + date(1970, 1, 1).toordinal()).strftime('%Y-%m-%d')
+                return str(d)
+
+            history = []
+            for row in result_sets[0].rows:
+                history.append({
+                    'payment_id': row.payment_id,
+                    'template_type': row.template_type,
+                    'reminder_date': convert_date(row.reminder_date),
+                    'status': row.status,
+                    'message_id': row.message_id,
+                    'error': row.error,
+                    'attempts': row.attempts,
+                    'delivery_status': row.delivery_status,
+                    'delivery_status_at': convert_timestamp(row.delivery_status_at),
+                    'created_at': convert_timestamp(row.created_at),
+                    'updated_at': convert_timestamp(row.updated_at)
+                })
+
+            logger.info(f"Returned {len(history)} reminder log entries for installment {installment_id}")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(history)}
+            
+        except ydb.Error as e:
+            logger.error(f"YDB error: {str(e)}")
+            return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Database operation failed'})}
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Internal server error'})}
@@ -0,0 +1,193 @@
+import os
+import json
+import ydb
+import jwt
+import logging
+from datetime import datetime
+from typing import Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class JWTAuth:
+    """Handles JWT token authentication and validation"""
+    
+    @staticmethod
+    def verify_jwt_token(token: str, token_type: str = 'access') -> dict:
+        """Verify and decode JWT token"""
+        secret_key = os.environ.get('JWT_SECRET_KEY', 'your-super-secret-jwt-key-change-in-production')
+        
+        try:
+            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
+            
+            # Check token type
+            if payload.get('type') != token_type:
+                raise ValueError(f"Invalid token type. Expected {token_type}")
+            
+            return payload
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Token has expired")
+        except jwt.InvalidTokenError:
+            raise ValueError("Invalid token")
+    
+    @staticmethod
+    def extract_token_from_event(event: dict) -> Optional[str]:
+        """Extract JWT token from Authorization header"""
+        headers = event.get('headers', {})
+        
+        # Handle case-insensitive headers
+        auth_header = None
+        for key, value in headers.items():
+            if key.lower() == 'authorization':
+                auth_header = value
+                break
+        
+        if not auth_header:
+            return None
+        
+        # Extract token from Bearer header
+        if not auth_header.startswith('Bearer '):
+            return None
+        
+        return auth_header[7:]  # Remove 'Bearer ' prefix
+    
+    @staticmethod
+    def authenticate_request(event: dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Authenticate request and return user_id and error message
+        Returns: (user_id, error_message)
+        """
+        try:
+            # Extract JWT token
+            token = JWTAuth.extract_token_from_event(event)
+            
+            if not token:
+                return None, "Authorization header missing or invalid format"
+            
+            # Verify token
+            payload = JWTAuth.verify_jwt_token(token, 'access')
+            user_id = payload.get('user_id')
+            
+            if not user_id:
+                return None, "Invalid token: user_id not found"
+            
+            logger.info(f"Request authenticated for user: {payload.get('email', 'unknown')}")
+            return user_id, None
+            
+        except ValueError as e:
+            return None, f"Authentication failed: {str(e)}"
+        except Exception as e:
+            logger.error(f"Unexpected authentication error: {e}")
+            return None, "Authentication error"
+
+# Outbox status -> per-installment status reported to the app
+RESULT_STATUSES = {
+    'pending': 'pending',
+    'sending': 'pending',
+    'sent': 'success',
+    'dead': 'failed'
+}
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler returning the progress of a manual reminder job
+    (queued by send-manual-reminder; messages are tracked in reminder_outbox).
+    """
+    try:
+        # Authentication
+        user_id, auth_error = JWTAuth.authenticate_request(event)
+        if not user_id:
+            logger.warning(f"Authentication failed: {auth_error}")
+            return {'statusCode': 401, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'Unauthorized: {auth_error}'})}
+        
+        job_id = (event.get('pathParameters') or {}).get('id')
+        if not job_id:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Job ID is required'})}
+
+        try:
+            driver_config = ydb.DriverConfig(
+                endpoint=os.environ.get('YDB_ENDPOINT'),
+                database=os.environ.get('YDB_DATABASE'),
+                credentials=ydb.iam.MetadataUrlCredentials()
+            )
+            driver = ydb.Driver(driver_config)
+            driver.wait(fail_fast=True, timeout=5)
+            pool = ydb.SessionPool(driver)
+
+            def get_job(session):
+                # The job row is keyed by user_id, so other users' jobs are never returned
+                query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $job_id AS Utf8;
+                SELECT id, template_type, total_installments, failed_results, created_at
+                FROM reminder_jobs
+                WHERE user_id = $user_id AND id = $job_id;
+
+                SELECT o.installment_id AS installment_id, o.status AS status, o.attempts AS attempts,
+                       o.last_error AS last_error, o.message_id AS message_id, o.sent_at AS sent_at
+                FROM reminder_outbox VIEW idx_job AS j
+                INNER JOIN reminder_outbox AS o ON o.id = j.id
+                WHERE j.job_id = $job_id AND o.user_id = $user_id;
+                """
+                return session.transaction(ydb.OnlineReadOnly()).execute(
+                    session.prepare(query),
+                    {'$user_id': user_id, '$job_id': job_id},
+                    commit_tx=True
+                )
+
+            result_sets = pool.retry_operation_sync(get_job)
+            driver.stop()
+
+            if not result_sets[0].rows:
+                return {'statusCode': 404, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Job not found'})}
+            job = result_sets[0].rows[0]
+
+            def convert_timestamp(ts):
+                if ts is None: return None
+                return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
+
+            failed_results = job.failed_results
+            if isinstance(failed_results, str):
+                failed_results = json.loads(failed_results)
+
+            results = []
+            for row in result_sets[1].rows:
+                results.append({
+                    'installment_id': row.installment_id,
+                    'template_type': job.template_type,
+                    'status': RESULT_STATUSES.get(row.status, 'pending'),
+                    'message_id': row.message_id,
+                    'error': row.last_error if row.status == 'dead' else None,
+                    'attempts': row.attempts or 0,
+                    'sent_at': convert_timestamp(row.sent_at)
+                })
+            results.extend(failed_results or [])
+
+            successful = sum(1 for r in results if r['status'] == 'success')
+            failed = sum(1 for r in results if r['status'] == 'failed')
+            pending = sum(1 for r in results if r['status'] == 'pending')
+
+            response = {
+                'job_id': job.id,
+                'status': 'running' if pending else 'completed',
+                'template_type': job.template_type,
+                'total': job.total_installments or 0,
+                'processed_count': successful + failed,
+                'successful_sends': successful,
+                'failed_sends': failed,
+                'pending_count': pending,
+                'created_at': convert_timestamp(job.created_at),
+                'results': results
+            }
+
+            logger.info(f"Reminder job {job_id}: {successful} sent, {failed} failed, {pending} pending")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(response)}
+            
+        except ydb.Error as e:
+            logger.error(f"YDB error: {str(e)}")
+            return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Database operation failed'})}
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Internal server error'})}
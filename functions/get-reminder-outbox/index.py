@@ -0,0 +1,190 @@
+import os
+import json
+import ydb
+import jwt
+import logging
+from datetime import datetime, date
+from typing import Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class JWTAuth:
+    """Handles JWT token authentication and validation"""
+    
+    @staticmethod
+    def verify_jwt_token(token: str, token_type: str = 'access') -> dict:
+        """Verify and decode JWT token"""
+        secret_key = os.environ.get('JWT_SECRET_KEY', 'your-super-secret-jwt-key-change-in-production')
+        
+        try:
+            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
+            
+            # Check token type
+            if payload.get('type') != token_type:
+                raise ValueError(f"Invalid token type. Expected {token_type}")
+            
+            return payload
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Token has expired")
+        except jwt.InvalidTokenError:
+            raise ValueError("Invalid token")
+    
+    @staticmethod
+    def extract_token_from_event(event: dict) -> Optional[str]:
+        """Extract JWT token from Authorization header"""
+        headers = event.get('headers', {})
+        
+        # Handle case-insensitive headers
+        auth_header = None
+        for key, value in headers.items():
+            if key.lower() == 'authorization':
+                auth_header = value
+                break
+        
+        if not auth_header:
+            return None
+        
+        # Extract token from Bearer header
+        if not auth_header.startswith('Bearer '):
+            return None
+        
+        return auth_header[7:]  # Remove 'Bearer ' prefix
+    
+    @staticmethod
+    def authenticate_request(event: dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Authenticate request and return user_id and error message
+        Returns: (user_id, error_message)
+        """
+        try:
+            # Extract JWT token
+            token = JWTAuth.extract_token_from_event(event)
+            
+            if not token:
+                return None, "Authorization header missing or invalid format"
+            
+            # Verify token
+            payload = JWTAuth.verify_jwt_token(token, 'access')
+            user_id = payload.get('user_id')
+            
+            if not user_id:
+                return None, "Invalid token: user_id not found"
+            
+            logger.info(f"Request authenticated for user: {payload.get('email', 'unknown')}")
+            return user_id, None
+            
+        except ValueError as e:
+            return None, f"Authentication failed: {str(e)}"
+        except Exception as e:
+            logger.error(f"Unexpected authentication error: {e}")
+            return None, "Authentication error"
+
+STATUSES = ('pending', 'sending', 'sent', 'dead')
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler returning the state of the user's reminder outbox
+    (message counts per status and the most recent messages, newest first).
+    """
+    try:
+        # Authentication
+        user_id, auth_error = JWTAuth.authenticate_request(event)
+        if not user_id:
+            logger.warning(f"Authentication failed: {auth_error}")
+            return {'statusCode': 401, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'Unauthorized: {auth_error}'})}
+        
+        query_params = event.get('queryStringParameters', {}) or {}
+        status = query_params.get('status')
+        if status is not None and status not in STATUSES:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f"Status must be one of: {', '.join(STATUSES)}"})}
+        try:
+            limit = int(query_params.get('limit', 50))
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Invalid limit'})}
+        if not (0 < limit <= 500):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Limit must be between 1 and 500'})}
+
+        try:
+            driver_config = ydb.DriverConfig(
+                endpoint=os.environ.get('YDB_ENDPOINT'),
+                database=os.environ.get('YDB_DATABASE'),
+                credentials=ydb.iam.MetadataUrlCredentials()
+            )
+            driver = ydb.Driver(driver_config)
+            driver.wait(fail_fast=True, timeout=5)
+            pool = ydb.SessionPool(driver)
+
+            def get_outbox(session):
+                # Both reads go through the user-first index, so other users' messages are never read
+                query = f"""
+                DECLARE $user_id AS Utf8;
+                DECLARE $limit AS Uint64;
+                {'DECLARE $status AS Utf8;' if status else ''}
+                SELECT status, COUNT(*) AS cnt
+                FROM reminder_outbox VIEW idx_user_created
+                WHERE user_id = $user_id
+                GROUP BY status;
+
+                SELECT id, job_id, installment_id, payment_id, template_type, reminder_date, status, attempts,
+                       next_attempt_at, last_error, message_id, created_at, sent_at
+                FROM reminder_outbox VIEW idx_user_created
+                WHERE user_id = $user_id {'AND status = $status' if status else ''}
+                ORDER BY created_at DESC
+                LIMIT $limit;
+                """
+                params = {'$user_id': user_id, '$limit': limit}
+                if status:
+                    params['$status'] = status
+                return session.transaction(ydb.OnlineReadOnly()).execute(
+                    session.prepare(query),
+                    params,
+                    commit_tx=True
+                )
+
+            result_sets = pool.retry_operation_sync(get_outbox)
+            driver.stop()
+
+            def convert_timestamp(ts):
+                if ts is None: return None
+                return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
+
+            def convert_date(d):
+                if d is None: return None
+                if isinstance(d, date): return d.strftime('%Y-%m-%d')
+                if isinstance(d, int): return date.fromordinal(d + date(1970, 1, 1).toordinal()).strftime('%Y-%m-%d')
+                return str(d)
+
+            counts = {s: 0 for s in STATUSES}
+            for row in result_sets[0].rows:
+                counts[row.status] = int(row.cnt)
+
+            messages = []
+            for row in result_sets[1].rows:
+                messages.append({
+                    'id': row.id,
+                    'job_id': row.job_id,
+                    'installment_id': row.installment_id,
+                    'payment_id': row.payment_id,
+                    'template_type': row.template_type,
+                    'reminder_date': convert_date(row.reminder_date),
+                    'status': row.status,
+                    'attempts': row.attempts,
+                    'next_attempt_at': convert_timestamp(row.next_attempt_at),
+                    'last_error': row.last_error,
+                    'message_id': row.message_id,
+                    'created_at': convert_timestamp(row.created_at),
+                    'sent_at': convert_timestamp(row.sent_at)
+                })
+
+            logger.info(f"Returned {len(messages)} reminder outbox messages")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'counts': counts, 'messages': messages})}
+            
+        except ydb.Error as e:
+            logger.error(f"YDB error: {str(e)}")
+            return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Database operation failed'})}
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Internal server error'})}
@@ -7,9 +7,11 @@ from typing import Dict, Any, Optional
 # Add shared modules to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
-from database_utils import WhatsAppSettingsRepository
+from database_utils import DatabaseManager, WhatsAppSettingsRepository
 from jwt_auth import JWTAuth
 from whatsapp_service import MessageTemplateProcessor
+from reminder_schedule import schedule_entries
+from instance_health import InstanceHealthCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -90,6 +92,10 @@ def create_default_settings(user_id: str) -> Dict[str, Any]:
         'reminder_template_7_days': MessageTemplateProcessor.DEFAULT_TEMPLATES['reminder_7_days'],
         'reminder_template_due_today': MessageTemplateProcessor.DEFAULT_TEMPLATES['reminder_due_today'],
         'reminder_template_manual': MessageTemplateProcessor.DEFAULT_TEMPLATES['reminder_manual'],
+        'reminder_schedule': [
+            {'days_before_due': 7, 'template': None},
+            {'days_before_due': 0, 'template': None}
+        ],
         'is_enabled': False,
         'created_at': None,
         'updated_at': None,
@@ -109,15 +115,20 @@ def add_computed_fields(settings: Dict[str, Any]) -> Dict[str, Any]:
     """
     processed = settings.copy()
     
+    # Users without a saved schedule get the legacy 7-days / due-today offsets
+    processed['reminder_schedule'] = schedule_entries(settings)
+    
     # Add computed fields
     processed['is_configured'] = bool(
         settings.get('green_api_instance_id') and 
         settings.get('green_api_token')
     )
     
-    # Add connection status (will be updated by connection test)
+    # Connection status from the shared health cache (probes and real sends), 'configured' if unknown
     if processed['is_configured']:
-        processed['connection_status'] = 'configured'
+        processed['connection_status'] = get_connection_status(
+            settings['green_api_instance_id'], settings['green_api_token']
+        )
     else:
         processed['connection_status'] = 'not_configured'
     
@@ -130,6 +141,19 @@ def add_computed_fields(settings: Dict[str, Any]) -> Dict[str, Any]:
     
     return processed
 
+def get_connection_status(instance_id: str, token: str) -> str:
+    """connected | auth_failed | unreachable from recent instance health, or configured if none"""
+    try:
+        health = DatabaseManager().with_pool(
+            lambda pool: InstanceHealthCache(pool).lookup([(instance_id, token)])
+        ).get((instance_id, token))
+    except Exception as e:
+        logger.warning(f"Could not read Green API instance health: {e}")
+        return 'configured'
+    if not health:
+        return 'configured'
+    return 'connected' if health['status'] == 'ok' else health['status']
+
 def format_timestamp(timestamp) -> str:
     """
     Format timestamp for API response
@@ -0,0 +1,268 @@
+import os
+import json
+import ydb
+import jwt
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+from search_index import SearchIndexReader, normalize_value, match_score, chunked
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Results returned per entity type by default, and the maximum a caller may ask for
+DEFAULT_PER_TYPE = 5
+MAX_PER_TYPE = 20
+
+# Installment rows scanned per query before ranking
+INSTALLMENT_SCAN_LIMIT = 200
+
+ENTITY_TYPES = ('client', 'investor', 'installment')
+
+class JWTAuth:
+    """Handles JWT token authentication and validation"""
+    
+    @staticmethod
+    def verify_jwt_token(token: str, token_type: str = 'access') -> dict:
+        """Verify and decode JWT token"""
+        secret_key = os.environ.get('JWT_SECRET_KEY', 'your-super-secret-jwt-key-change-in-production')
+        
+        try:
+            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
+            
+            # Check token type
+            if payload.get('type') != token_type:
+                raise ValueError(f"Invalid token type. Expected {token_type}")
+            
+            return payload
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Token has expired")
+        except jwt.InvalidTokenError:
+            raise ValueError("Invalid token")
+    
+    @staticmethod
+    def extract_token_from_event(event: dict) -> Optional[str]:
+        """Extract JWT token from Authorization header"""
+        headers = event.get('headers', {})
+        
+        # Handle case-insensitive headers
+        auth_header = None
+        for key, value in headers.items():
+            if key.lower() == 'authorization':
+                auth_header = value
+                break
+        
+        if not auth_header:
+            return None
+        
+        # Extract token from Bearer header
+        if not auth_header.startswith('Bearer '):
+            return None
+        
+        return auth_header[7:]  # Remove 'Bearer ' prefix
+    
+    @staticmethod
+    def authenticate_request(event: dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Authenticate request and return user_id and error message
+        Returns: (user_id, error_message)
+        """
+        try:
+            # Extract JWT token
+            token = JWTAuth.extract_token_from_event(event)
+            
+            if not token:
+                return None, "Authorization header missing or invalid format"
+            
+            # Verify token
+            payload = JWTAuth.verify_jwt_token(token, 'access')
+            user_id = payload.get('user_id')
+            
+            if not user_id:
+                return None, "Invalid token: user_id not found"
+            
+            logger.info(f"Request authenticated for user: {payload.get('email', 'unknown')}")
+            return user_id, None
+            
+        except ValueError as e:
+            return None, f"Authentication failed: {str(e)}"
+        except Exception as e:
+            logger.error(f"Unexpected authentication error: {e}")
+            return None, "Authentication error"
+
+def search_clients(session, user_id: str, query: str, per_type: int) -> List[Dict[str, Any]]:
+    """Trigram lookup across client name, phone and passport"""
+    reader = SearchIndexReader(session, user_id, 'client')
+    reader.ensure_built()
+
+    normalized = {field: normalize_value(field, query) for field in reader.fields}
+    candidate_ids = set()
+    for field, value in normalized.items():
+        candidate_ids |= reader.candidates(field, value)
+    if not candidate_ids:
+        return []
+
+    rows_query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $ids AS List<Utf8>;
+    SELECT id, full_name, contact_number, passport_number FROM clients
+    WHERE user_id = $user_id AND id IN $ids;
+    """
+    prepared_query = session.prepare(rows_query)
+    hits = []
+    for ids in chunked(candidate_ids):
+        result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
+            prepared_query,
+            {'$user_id': user_id, '$ids': ids},
+            commit_tx=True
+        )
+        for row in result_sets[0].rows:
+            score = max(match_score(normalize_value(field, getattr(row, field, None)), value) for field, value in normalized.items())
+            if score:
+                hits.append({'type': 'client', 'id': row.id, 'title': row.full_name, 'subtitle': row.contact_number, 'score': score})
+    return rank(hits)[:per_type]
+
+def search_investors(session, user_id: str, query: str, per_type: int) -> List[Dict[str, Any]]:
+    """Trigram lookup on investor name"""
+    reader = SearchIndexReader(session, user_id, 'investor')
+    reader.ensure_built()
+
+    value = normalize_value('full_name', query)
+    candidate_ids = reader.candidates('full_name', value)
+    if not candidate_ids:
+        return []
+
+    rows_query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $ids AS List<Utf8>;
+    SELECT id, full_name, investment_amount FROM investors
+    WHERE user_id = $user_id AND id IN $ids;
+    """
+    prepared_query = session.prepare(rows_query)
+    hits = []
+    for ids in chunked(candidate_ids):
+        result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
+            prepared_query,
+            {'$user_id': user_id, '$ids': ids},
+            commit_tx=True
+        )
+        for row in result_sets[0].rows:
+            score = match_score(normalize_value('full_name', row.full_name), value)
+            if score:
+                amount = float(row.investment_amount) if row.investment_amount is not None else None
+                hits.append({'type': 'investor', 'id': row.id, 'title': row.full_name, 'subtitle': amount, 'score': score})
+    return rank(hits)[:per_type]
+
+def search_installments(session, user_id: str, query: str, per_type: int) -> List[Dict[str, Any]]:
+    """Bounded scan over product, client and investor names of the user's installments"""
+    rows_query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $pattern AS Utf8;
+    DECLARE $limit AS Uint64;
+    SELECT id, product_name, client_name, investor_name, payment_status FROM installments
+    WHERE user_id = $user_id
+    AND (product_name LIKE $pattern OR client_name LIKE $pattern OR investor_name LIKE $pattern)
+    LIMIT $limit;
+    """
+    result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
+        session.prepare(rows_query),
+        {'$user_id': user_id, '$pattern': f"%{query}%", '$limit': INSTALLMENT_SCAN_LIMIT},
+        commit_tx=True
+    )
+
+    value = normalize_value('product_name', query)
+    hits = []
+    for row in result_sets[0].rows:
+        # Product matches rank above matches on the denormalized client/investor names
+        score = max(
+            match_score(normalize_value('product_name', row.product_name), value),
+            match_score(normalize_value('client_name', row.client_name), value) // 2,
+            match_score(normalize_value('investor_name', row.investor_name), value) // 2
+        )
+        hits.append({
+            'type': 'installment',
+            'id': row.id,
+            'title': row.product_name,
+            'subtitle': row.client_name,
+            'status': row.payment_status,
+            'score': score
+        })
+    return rank(hits)[:per_type]
+
+def rank(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Best score first, shorter titles first among equal scores"""
+    return sorted(hits, key=lambda hit: (-hit['score'], len(hit['title'] or ''), hit['title'] or ''))
+
+SEARCHERS = {
+    'client': search_clients,
+    'investor': search_investors,
+    'installment': search_installments
+}
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler for the app's global search box.
+    Runs the client, investor and installment lookups concurrently over one
+    driver and returns a single ranked list capped per entity type.
+    """
+    try:
+        logger.info(f"Received global search request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
+        
+        # Authentication
+        user_id, auth_error = JWTAuth.authenticate_request(event)
+        if not user_id:
+            logger.warning(f"Authentication failed: {auth_error}")
+            return {'statusCode': 401, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'Unauthorized: {auth_error}'})}
+        
+        query_params = event.get('queryStringParameters', {}) or {}
+        query = ' '.join((query_params.get('query') or '').split())
+        if not query:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'query is required'})}
+
+        try:
+            per_type = int(query_params.get('per_type', DEFAULT_PER_TYPE))
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'per_type must be an integer'})}
+        if not (0 < per_type <= MAX_PER_TYPE):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'per_type must be between 1 and {MAX_PER_TYPE}'})}
+
+        types = [t.strip() for t in query_params.get('types', ','.join(ENTITY_TYPES)).split(',') if t.strip()]
+        unknown = [t for t in types if t not in SEARCHERS]
+        if unknown or not types:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f"types must be a subset of: {', '.join(ENTITY_TYPES)}"})}
+
+        driver = None
+        try:
+            driver_config = ydb.DriverConfig(
+                endpoint=os.environ.get('YDB_ENDPOINT'),
+                database=os.environ.get('YDB_DATABASE'),
+                credentials=ydb.iam.MetadataUrlCredentials()
+            )
+            driver = ydb.Driver(driver_config)
+            driver.wait(fail_fast=True, timeout=5)
+            pool = ydb.SessionPool(driver, size=len(types))
+
+            def run_search(entity_type):
+                searcher = SEARCHERS[entity_type]
+                return pool.retry_operation_sync(lambda session: searcher(session, user_id, query, per_type))
+
+            # One session per entity type, all sharing the same driver connection
+            with ThreadPoolExecutor(max_workers=len(types)) as executor:
+                results_by_type = dict(zip(types, executor.map(run_search, types)))
+
+            results = rank([hit for hits in results_by_type.values() for hit in hits])
+            counts = {entity_type: len(hits) for entity_type, hits in results_by_type.items()}
+
+            logger.info(f"Global search returned {len(results)} results: {counts}")
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'results': results, 'counts': counts})}
+            
+        except ydb.Error as e:
+            logger.error(f"YDB error: {str(e)}")
+            return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Database operation failed'})}
+        finally:
+            if driver:
+                driver.stop()
+        
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Internal server error'})}
@@ -3,8 +3,8 @@ import json
 import ydb
 import jwt
 import logging
-from datetime import datetime, date
 from typing import Optional, Tuple
+from installment_listing import SORT_OPTIONS, DEFAULT_SORT, decode_cursor, build_keyset_query, page_response
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -83,7 +83,7 @@ class JWTAuth:
 
 def handler(event, context):
     """
-    Yandex Cloud Function handler to list installments with pagination.
+    Yandex Cloud Function handler to list installments with offset or cursor pagination.
     """
     try:
         logger.info(f"Received list request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
@@ -106,6 +106,18 @@ def handler(event, context):
         if offset < 0:
             return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Offset must be non-negative'})}
 
+        sort = query_params.get('sort', DEFAULT_SORT)
+        if sort not in SORT_OPTIONS:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f"Sort must be one of: {', '.join(SORT_OPTIONS)}"})}
+
+        # Keyset pagination: the cursor from X-Next-Cursor continues after the last returned row
+        cursor_values = None
+        if query_params.get('cursor'):
+            try:
+                cursor_values = decode_cursor(query_params['cursor'], sort)
+            except ValueError as e:
+                return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': str(e)})}
+
         try:
             driver_config = ydb.DriverConfig(
                 endpoint=os.environ.get('YDB_ENDPOINT'),
@@ -118,100 +130,27 @@ def handler(event, context):
 
             def list_installments_from_db(session):
                 # Optimized query that uses pre-calculated fields to avoid N+1 queries
-                query = """
-                DECLARE $user_id AS Utf8;
-                DECLARE $limit AS Uint64;
-                DECLARE $offset AS Uint64;
-                SELECT 
-                    id, user_id, client_id, investor_id, product_name,
-                    cash_price, installment_price, down_payment, term_months, monthly_payment,
-                    down_payment_date, installment_start_date, installment_end_date,
-                    installment_number,
-                    created_at, updated_at,
-                    -- Pre-calculated fields (eliminates N+1 queries!)
-                    COALESCE(client_name, 'Unknown Client') as client_name,
-                    COALESCE(investor_name, 'Unknown Investor') as investor_name,
-                    COALESCE(paid_amount, CAST(0 AS Decimal(22,9))) as paid_amount,
-                    COALESCE(remaining_amount, installment_price) as remaining_amount,
-                    next_payment_date,
-                    COALESCE(next_payment_amount, CAST(0 AS Decimal(22,9))) as next_payment_amount,
-                    COALESCE(payment_status, 'предстоящий') as payment_status,
-                    COALESCE(overdue_count, CAST(0 AS Int32)) as overdue_count,
-                    COALESCE(total_payments, CAST(0 AS Int32)) as total_payments,
-                    COALESCE(paid_payments, CAST(0 AS Int32)) as paid_payments,
-                    last_payment_date
-                FROM installments
-                WHERE user_id = $user_id
-                ORDER BY 
-                    CASE payment_status
-                        WHEN 'просрочено' THEN 1
-                        WHEN 'к оплате' THEN 2  
-                        WHEN 'предстоящий' THEN 3
-                        WHEN 'оплачено' THEN 4
-                        ELSE 5
-                    END,
-                    created_at DESC
-                LIMIT $limit OFFSET $offset;
-                """
+                query, params = build_keyset_query(
+                    ["user_id = $user_id"],
+                    ["DECLARE $user_id AS Utf8;"],
+                    {'$user_id': user_id},
+                    sort, cursor_values, limit, offset
+                )
                 prepared_query = session.prepare(query)
-                result_sets = session.transaction(ydb.SerializableReadWrite()).execute(
+                result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
                     prepared_query,
-                    {'$user_id': user_id, '$limit': limit, '$offset': offset},
+                    params,
                     commit_tx=True
                 )
                 
-                installments = []
-                for row in result_sets[0].rows:
-                    def convert_timestamp(ts):
-                        if ts is None: return None
-                        return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
-
-                    def convert_date(d):
-                        if d is None: return None
-                        if isinstance(d, date): return d.strftime('%Y-%m-%d')
-                        if isinstance(d, int): return date.fromordinal(d + date(1970, 1, 1).toordinal()).strftime('%Y-%m-%d')
-                        return str(d)
-
-                    installment = {
-                        'id': row.id,
-                        'user_id': row.user_id,
-                        'client_id': row.client_id,
-                        'investor_id': row.investor_id,
-                        'product_name': row.product_name,
-                        'cash_price': float(row.cash_price),
-                        'installment_price': float(row.installment_price),
-                        'down_payment': float(row.down_payment),
-                        'term_months': row.term_months,
-                        'down_payment_date': convert_date(row.down_payment_date),
-                        'installment_start_date': convert_date(row.installment_start_date),
-                        'installment_end_date': convert_date(row.installment_end_date),
-                        'installment_number': getattr(row, 'installment_number', None),
-                        'monthly_payment': float(row.monthly_payment),
-                        'created_at': convert_timestamp(row.created_at),
-                        'updated_at': convert_timestamp(row.updated_at),
-                        
-                        # Pre-calculated display fields (no additional queries needed!)
-                        'client_name': row.client_name,
-                        'investor_name': row.investor_name,
-                        'paid_amount': float(row.paid_amount),
-                        'remaining_amount': float(row.remaining_amount),
-                        'next_payment_date': convert_date(row.next_payment_date),
-                        'next_payment_amount': float(row.next_payment_amount),
-                        'payment_status': row.payment_status,
-                        'overdue_count': row.overdue_count,
-                        'total_payments': row.total_payments,
-                        'paid_payments': row.paid_payments,
-                        'last_payment_date': convert_date(row.last_payment_date),
-                        
-                        # For backward compatibility, include empty payments array
-                        # Frontend can request full payment details separately if needed
-                        'payments': []
-                    }
-                    
-                    installments.append(installment)
+                installments, next_cursor = page_response(result_sets[0].rows, sort, limit)
+                
+                headers = {'Content-Type': 'application/json', 'Access-Control-Expose-Headers': 'X-Next-Cursor'}
+                if next_cursor:
+                    headers['X-Next-Cursor'] = next_cursor
                 
                 logger.info(f"Listed {len(installments)} installments with pre-calculated fields in single query.")
-                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(installments)}
+                return {'statusCode': 200, 'headers': headers, 'body': json.dumps(installments)}
 
             result = pool.retry_operation_sync(list_installments_from_db)
             driver.stop()
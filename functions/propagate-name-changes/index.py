@@ -0,0 +1,294 @@
+import os
+import json
+import logging
+import ydb
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maximum outbox entries picked up per run
+OUTBOX_BATCH_SIZE = 100
+
+# Maximum installment rows rewritten per transaction
+INSTALLMENT_BATCH_SIZE = 200
+
+# Stop starting new batches after this many seconds (function timeout is 30s)
+TIME_BUDGET_SECONDS = 20
+
+# Denormalized installment columns per entity type
+ENTITY_COLUMNS = {
+    'client': ('client_id', 'client_name'),
+    'investor': ('investor_id', 'investor_name')
+}
+
+NAME_CHANGE_OUTBOX_TABLE = """
+CREATE TABLE name_change_outbox (
+    id Utf8 NOT NULL,
+    user_id Utf8,
+    entity_type Utf8,
+    entity_id Utf8,
+    new_name Utf8,
+    status Utf8,
+    created_at Timestamp,
+    processed_at Timestamp,
+    updated_rows Int64,
+    PRIMARY KEY (id),
+    INDEX idx_status_created GLOBAL ON (status, created_at)
+);
+"""
+
+def get_ydb_driver():
+    """Create and return YDB driver"""
+    endpoint = os.environ['YDB_ENDPOINT']
+    database = os.environ['YDB_DATABASE']
+
+    driver_config = ydb.DriverConfig(
+        endpoint=endpoint,
+        database=database,
+        credentials=ydb.iam.MetadataUrlCredentials(),
+    )
+
+    driver = ydb.Driver(driver_config)
+    driver.wait(fail_fast=True)
+    return driver
+
+def initialize_name_change_outbox():
+    """Create the name_change_outbox table (run once)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        pool.retry_operation_sync(lambda session: session.execute_scheme(NAME_CHANGE_OUTBOX_TABLE))
+        logger.info("name_change_outbox table created successfully")
+    finally:
+        driver.stop()
+
+def to_datetime(value):
+    """Convert YDB timestamp (microseconds) to datetime"""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value / 1000000)
+    return value
+
+def get_pending_changes(pool: ydb.SessionPool, limit: int) -> List[Dict[str, Any]]:
+    """Get the oldest pending name changes from the outbox"""
+    def execute_query(session):
+        query = """
+            DECLARE $limit AS Uint64;
+            SELECT id, user_id, entity_type, entity_id, new_name, created_at
+            FROM name_change_outbox VIEW idx_status_created
+            WHERE status = 'pending'
+            ORDER BY created_at
+            LIMIT $limit;
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {'$limit': limit},
+            commit_tx=True
+        )
+
+    result_sets = pool.retry_operation_sync(execute_query)
+
+    changes = []
+    for row in result_sets[0].rows:
+        changes.append({
+            'id': row.id,
+            'user_id': row.user_id,
+            'entity_type': row.entity_type,
+            'entity_id': row.entity_id,
+            'new_name': row.new_name,
+            'created_at': to_datetime(row.created_at)
+        })
+    return changes
+
+def coalesce_changes(changes: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Keep only the latest rename per entity.
+
+    Returns:
+        Tuple of (latest_changes, superseded_ids)
+    """
+    latest = {}
+    superseded_ids = []
+    for change in changes:
+        key = (change['entity_type'], change['entity_id'])
+        current = latest.get(key)
+        if current is None:
+            latest[key] = change
+        elif change['created_at'] >= current['created_at']:
+            superseded_ids.append(current['id'])
+            latest[key] = change
+        else:
+            superseded_ids.append(change['id'])
+    return list(latest.values()), superseded_ids
+
+def propagate_batch(pool: ydb.SessionPool, change: Dict[str, Any]) -> int:
+    """Rewrite the denormalized name on one bounded batch of installments"""
+    id_column, name_column = ENTITY_COLUMNS[change['entity_type']]
+
+    def execute_batch(session):
+        select_query = f"""
+            DECLARE $user_id AS Utf8;
+            DECLARE $entity_id AS Utf8;
+            DECLARE $new_name AS Utf8;
+            DECLARE $limit AS Uint64;
+            SELECT id FROM installments
+            WHERE user_id = $user_id AND {id_column} = $entity_id
+            AND ({name_column} IS NULL OR {name_column} != $new_name)
+            LIMIT $limit;
+        """
+        update_query = f"""
+            DECLARE $ids AS List<Utf8>;
+            DECLARE $new_name AS Utf8;
+            DECLARE $updated_at AS Timestamp;
+            UPDATE installments
+            SET {name_column} = $new_name, updated_at = $updated_at
+            WHERE id IN $ids;
+        """
+
+        tx = session.transaction(ydb.SerializableReadWrite())
+        result_sets = tx.execute(
+            session.prepare(select_query),
+            {
+                '$user_id': change['user_id'],
+                '$entity_id': change['entity_id'],
+                '$new_name': change['new_name'],
+                '$limit': INSTALLMENT_BATCH_SIZE
+            }
+        )
+        ids = [row.id for row in result_sets[0].rows]
+        if ids:
+            tx.execute(
+                session.prepare(update_query),
+                {
+                    '$ids': ids,
+                    '$new_name': change['new_name'],
+                    '$updated_at': datetime.utcnow()
+                }
+            )
+        tx.commit()
+        return len(ids)
+
+    return pool.retry_operation_sync(execute_batch)
+
+def mark_changes(pool: ydb.SessionPool, ids: List[str], status: str, updated_rows: int = 0):
+    """Mark outbox entries as processed"""
+    if not ids:
+        return
+
+    def execute_query(session):
+        query = """
+            DECLARE $ids AS List<Utf8>;
+            DECLARE $status AS Utf8;
+            DECLARE $processed_at AS Timestamp;
+            DECLARE $updated_rows AS Int64;
+            UPDATE name_change_outbox
+            SET status = $status, processed_at = $processed_at, updated_rows = $updated_rows
+            WHERE id IN $ids;
+        """
+        session.transaction(ydb.SerializableReadWrite()).execute(
+            session.prepare(query),
+            {
+                '$ids': ids,
+                '$status': status,
+                '$processed_at': datetime.utcnow(),
+                '$updated_rows': updated_rows
+            },
+            commit_tx=True
+        )
+
+    pool.retry_operation_sync(execute_query)
+
+def get_backlog_stats(pool: ydb.SessionPool) -> Dict[str, Any]:
+    """Get pending outbox size and age of the oldest pending rename"""
+    def execute_query(session):
+        query = """
+            SELECT COUNT(*) AS pending_count, MIN(created_at) AS oldest_created_at
+            FROM name_change_outbox VIEW idx_status_created
+            WHERE status = 'pending';
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(query, commit_tx=True)
+
+    result_sets = pool.retry_operation_sync(execute_query)
+    row = result_sets[0].rows[0]
+    oldest = to_datetime(row.oldest_created_at)
+    return {
+        'pending_count': int(row.pending_count or 0),
+        'oldest_pending_age_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0
+    }
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler for propagating client/investor renames
+    This function is triggered by a timer and drains name_change_outbox,
+    rewriting installments.client_name / investor_name in bounded batches.
+    """
+    started = time.monotonic()
+    driver = None
+    try:
+        driver = get_ydb_driver()
+        pool = ydb.SessionPool(driver)
+
+        changes, superseded_ids = coalesce_changes(get_pending_changes(pool, OUTBOX_BATCH_SIZE))
+        mark_changes(pool, superseded_ids, 'superseded')
+
+        summary = {
+            'completed_changes': 0,
+            'superseded_changes': len(superseded_ids),
+            'updated_installments': 0,
+            'max_propagation_lag_seconds': 0
+        }
+
+        for change in changes:
+            if time.monotonic() - started > TIME_BUDGET_SECONDS:
+                break
+
+            change_rows = 0
+            finished = False
+            while time.monotonic() - started <= TIME_BUDGET_SECONDS:
+                updated = propagate_batch(pool, change)
+                change_rows += updated
+                if updated < INSTALLMENT_BATCH_SIZE:
+                    finished = True
+                    break
+
+            summary['updated_installments'] += change_rows
+
+            # Unfinished changes stay pending; the name filter makes the next run resume where this one stopped
+            if finished:
+                mark_changes(pool, [change['id']], 'done', change_rows)
+                lag = (datetime.utcnow() - change['created_at']).total_seconds()
+                summary['completed_changes'] += 1
+                summary['max_propagation_lag_seconds'] = max(summary['max_propagation_lag_seconds'], round(lag, 1))
+                logger.info(f"Propagated {change['entity_type']} rename {change['entity_id']} to {change_rows} installments (lag {lag:.1f}s)")
+
+        summary.update(get_backlog_stats(pool))
+
+        logger.info(f"Name propagation run completed: {json.dumps(summary)}")
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'message': 'Name propagation completed',
+                'summary': summary
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Name propagation failed: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'error': 'Internal server error',
+                'message': str(e)
+            })
+        }
+    finally:
+        if driver:
+            driver.stop()
@@ -0,0 +1,427 @@
+import os
+import json
+import logging
+import ydb
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Users per scan query chunk
+CHUNK_USERS = 50
+
+# Chunks scanned at once; scan queries run outside the foreground pools, this bounds the extra load
+PARALLEL_CHUNKS = 4
+
+# Stop starting new chunks after this many seconds (function timeout is 30s)
+TIME_BUDGET_SECONDS = 20
+
+# 'report' records drift only; 'repair' also resets the balance row to the ledger total
+RECONCILIATION_MODE = os.environ.get('RECONCILIATION_MODE', 'report')
+
+# One run per night; the cursor lets later trigger runs resume where one stopped
+WALLET_RECONCILIATION_RUNS_TABLE = """
+CREATE TABLE wallet_reconciliation_runs (
+    run_date Date NOT NULL,
+    status Utf8,
+    mode Utf8,
+    last_user_id Utf8,
+    wallets_checked Uint64,
+    drift_found Uint64,
+    repaired Uint64,
+    started_at Timestamp,
+    completed_at Timestamp,
+    PRIMARY KEY (run_date)
+);
+"""
+
+WALLET_BALANCE_DRIFT_TABLE = """
+CREATE TABLE wallet_balance_drift (
+    run_date Date NOT NULL,
+    user_id Utf8 NOT NULL,
+    wallet_id Utf8 NOT NULL,
+    ledger_minor_units Int64,
+    balance_minor_units Int64,
+    difference_minor_units Int64,
+    repaired Bool,
+    detected_at Timestamp,
+    PRIMARY KEY (run_date, user_id, wallet_id)
+);
+"""
+
+def get_ydb_driver():
+    """Create and return YDB driver"""
+    endpoint = os.environ['YDB_ENDPOINT']
+    database = os.environ['YDB_DATABASE']
+
+    driver_config = ydb.DriverConfig(
+        endpoint=endpoint,
+        database=database,
+        credentials=ydb.iam.MetadataUrlCredentials(),
+    )
+
+    driver = ydb.Driver(driver_config)
+    driver.wait(fail_fast=True)
+    return driver
+
+def initialize_reconciliation_tables():
+    """Create the wallet_reconciliation_runs and wallet_balance_drift tables (run once)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        for table in (WALLET_RECONCILIATION_RUNS_TABLE, WALLET_BALANCE_DRIFT_TABLE):
+            pool.retry_operation_sync(lambda session, table=table: session.execute_scheme(table))
+        logger.info("Wallet reconciliation tables created successfully")
+    finally:
+        driver.stop()
+
+def to_date(value) -> date:
+    """Convert a YDB Date (days since epoch) to date"""
+    if isinstance(value, int):
+        return date(1970, 1, 1) + timedelta(days=value)
+    return value
+
+def get_or_create_run(pool: ydb.SessionPool, run_date: date, mode: str) -> Dict[str, Any]:
+    """
+    The run to work on: the oldest unfinished run, else run_date's run
+
+    Resuming an unfinished run first keeps a run that is still going past
+    UTC midnight on its own cursor instead of starting over from the first
+    user under the new date. run_date's run is started if it has none yet.
+    """
+    def execute_query(session):
+        select_query = """
+            DECLARE $run_date AS Date;
+            SELECT run_date, status, mode, last_user_id, wallets_checked, drift_found, repaired
+            FROM wallet_reconciliation_runs
+            WHERE run_date = $run_date OR status = 'running'
+            ORDER BY run_date;
+        """
+        insert_query = """
+            DECLARE $run_date AS Date;
+            DECLARE $mode AS Utf8;
+            DECLARE $now AS Timestamp;
+            INSERT INTO wallet_reconciliation_runs (run_date, status, mode, wallets_checked, drift_found, repaired, started_at)
+            VALUES ($run_date, 'running', $mode, 0ul, 0ul, 0ul, $now);
+        """
+        tx = session.transaction(ydb.SerializableReadWrite())
+        rows = tx.execute(session.prepare(select_query), {'$run_date': run_date})[0].rows
+        if rows:
+            tx.commit()
+            row = next((row for row in rows if row.status == 'running'), rows[0])
+            return {
+                'run_date': to_date(row.run_date),
+                'status': row.status,
+                'mode': row.mode,
+                'cursor': row.last_user_id,
+                'wallets_checked': row.wallets_checked or 0,
+                'drift_found': row.drift_found or 0,
+                'repaired': row.repaired or 0
+            }
+        tx.execute(session.prepare(insert_query), {'$run_date': run_date, '$mode': mode, '$now': datetime.utcnow()})
+        tx.commit()
+        return {'run_date': run_date, 'status': 'running', 'mode': mode, 'cursor': None, 'wallets_checked': 0, 'drift_found': 0, 'repaired': 0}
+
+    return pool.retry_operation_sync(execute_query)
+
+def get_next_users(pool: ydb.SessionPool, after: Optional[str], limit: int) -> List[str]:
+    """Next user_ids with wallet balances or ledger rows, in key order after the run cursor"""
+    def execute_query(session):
+        query = """
+            DECLARE $after AS Utf8;
+            DECLARE $limit AS Uint64;
+            $balance_users = (
+                SELECT DISTINCT user_id FROM wallet_balances
+                WHERE user_id > $after
+                ORDER BY user_id
+                LIMIT $limit
+            );
+            $ledger_users = (
+                SELECT DISTINCT user_id FROM ledger_transactions
+                WHERE user_id > $after
+                ORDER BY user_id
+                LIMIT $limit
+            );
+            SELECT DISTINCT user_id
+            FROM (SELECT * FROM $balance_users UNION ALL SELECT * FROM $ledger_users)
+            ORDER BY user_id
+            LIMIT $limit;
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {'$after': after or '', '$limit': limit},
+            commit_tx=True
+        )
+
+    result_sets = pool.retry_operation_sync(execute_query)
+    return [row.user_id for row in result_sets[0].rows]
+
+def scan_chunk(driver: ydb.Driver, first_user: str, last_user: str) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Compare ledger totals with balance rows for the users in [first_user, last_user]
+
+    A scan query streams the per-wallet totals from one snapshot, so the
+    chunk never holds a long transaction or a foreground session. The join
+    is a FULL JOIN, so a wallet with ledger rows but no balance row is a
+    candidate too.
+
+    Returns:
+        Tuple of (wallets_checked, drift candidates)
+    """
+    query = ydb.ScanQuery(
+        """
+        DECLARE $first_user AS Utf8;
+        DECLARE $last_user AS Utf8;
+
+        $ledger = (
+            SELECT user_id, wallet_id,
+                   SUM(CASE WHEN direction = 'credit' THEN amount_minor_units ELSE -amount_minor_units END) AS ledger_minor_units
+            FROM ledger_transactions
+            WHERE user_id >= $first_user AND user_id <= $last_user
+            GROUP BY user_id, wallet_id
+        );
+
+        $balances = (
+            SELECT user_id, wallet_id, balance_minor_units
+            FROM wallet_balances
+            WHERE user_id >= $first_user AND user_id <= $last_user
+        );
+
+        SELECT COALESCE(b.user_id, l.user_id) AS user_id, COALESCE(b.wallet_id, l.wallet_id) AS wallet_id,
+               b.wallet_id IS NOT NULL AS has_balance,
+               b.balance_minor_units AS balance_minor_units, l.ledger_minor_units AS ledger_minor_units
+        FROM $balances AS b
+        FULL JOIN $ledger AS l
+        ON l.user_id = b.user_id AND l.wallet_id = b.wallet_id;
+        """,
+        {'$first_user': ydb.PrimitiveType.Utf8, '$last_user': ydb.PrimitiveType.Utf8}
+    )
+
+    def execute_scan():
+        checked = 0
+        candidates = []
+        parts = driver.table_client.scan_query(query, {'$first_user': first_user, '$last_user': last_user})
+        for part in parts:
+            for row in part.result_set.rows:
+                checked += 1
+                ledger = row.ledger_minor_units or 0
+                balance = row.balance_minor_units or 0
+                if not row.has_balance or ledger != balance:
+                    candidates.append({'user_id': row.user_id, 'wallet_id': row.wallet_id})
+        return checked, candidates
+
+    return ydb.retry_operation_sync(execute_scan)
+
+def settle_drift(pool: ydb.SessionPool, run_date, candidate: Dict[str, Any], repair: bool) -> Optional[Dict[str, Any]]:
+    """
+    Re-check one drift candidate in a serializable transaction and record it
+
+    A foreground write that landed between the snapshot scan and this check
+    is not drift, so the ledger and balance row are read again together.
+    A wallet with ledger rows but no balance row is drift with balance None.
+    With repair set the balance row is reset to (or created with) the ledger
+    total in the same transaction. Returns the drift record, or None if the
+    wallet is in sync.
+    """
+    def execute_query(session):
+        read_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $wallet_id AS Utf8;
+
+            SELECT balance_minor_units, version
+            FROM wallet_balances
+            WHERE user_id = $user_id AND wallet_id = $wallet_id;
+
+            SELECT SUM(CASE WHEN direction = 'credit' THEN amount_minor_units ELSE -amount_minor_units END) AS ledger_minor_units
+            FROM ledger_transactions
+            WHERE user_id = $user_id AND wallet_id = $wallet_id;
+        """
+        repair_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $wallet_id AS Utf8;
+            DECLARE $balance AS Int64;
+            DECLARE $version AS Uint64;
+            DECLARE $now AS Timestamp;
+            UPDATE wallet_balances
+            SET balance_minor_units = $balance,
+                version = version + 1,
+                updated_at = $now
+            WHERE user_id = $user_id AND wallet_id = $wallet_id AND version = $version;
+        """
+        insert_query = """
+            DECLARE $user_id AS Utf8;
+            DECLARE $wallet_id AS Utf8;
+            DECLARE $balance AS Int64;
+            DECLARE $now AS Timestamp;
+            INSERT INTO wallet_balances (wallet_id, user_id, balance_minor_units, version, updated_at)
+            VALUES ($wallet_id, $user_id, $balance, 1ul, $now);
+        """
+        drift_query = """
+            DECLARE $run_date AS Date;
+            DECLARE $user_id AS Utf8;
+            DECLARE $wallet_id AS Utf8;
+            DECLARE $ledger AS Int64;
+            DECLARE $balance AS Int64?;
+            DECLARE $repaired AS Bool;
+            DECLARE $now AS Timestamp;
+            UPSERT INTO wallet_balance_drift (
+                run_date, user_id, wallet_id, ledger_minor_units, balance_minor_units,
+                difference_minor_units, repaired, detected_at
+            )
+            VALUES ($run_date, $user_id, $wallet_id, $ledger, $balance, COALESCE($balance, 0l) - $ledger, $repaired, $now);
+        """
+        keys = {'$user_id': candidate['user_id'], '$wallet_id': candidate['wallet_id']}
+        tx = session.transaction(ydb.SerializableReadWrite())
+        result_sets = tx.execute(session.prepare(read_query), keys)
+        balance_row = result_sets[0].rows[0] if result_sets[0].rows else None
+        ledger_total = result_sets[1].rows[0].ledger_minor_units if result_sets[1].rows else None
+        ledger = ledger_total or 0
+        if balance_row is None:
+            if ledger_total is None:
+                tx.rollback()
+                return None
+            balance = None
+        else:
+            balance = balance_row.balance_minor_units or 0
+            if balance == ledger:
+                tx.rollback()
+                return None
+
+        now = datetime.utcnow()
+        if repair and balance_row is None:
+            tx.execute(session.prepare(insert_query), dict(keys, **{'$balance': ledger, '$now': now}))
+        elif repair:
+            tx.execute(
+                session.prepare(repair_query),
+                dict(keys, **{'$balance': ledger, '$version': balance_row.version, '$now': now})
+            )
+        tx.execute(
+            session.prepare(drift_query),
+            dict(keys, **{'$run_date': run_date, '$ledger': ledger, '$balance': balance, '$repaired': repair, '$now': now})
+        )
+        tx.commit()
+        return dict(candidate, ledger_minor_units=ledger, balance_minor_units=balance, repaired=repair)
+
+    return pool.retry_operation_sync(execute_query)
+
+def reconcile_chunk(driver: ydb.Driver, pool: ydb.SessionPool, run_date, users: List[str], repair: bool) -> Dict[str, int]:
+    """Scan one chunk of users and settle every drift candidate found in it"""
+    checked, candidates = scan_chunk(driver, users[0], users[-1])
+    counts = {'wallets_checked': checked, 'drift_found': 0, 'repaired': 0}
+    for candidate in candidates:
+        drift = settle_drift(pool, run_date, candidate, repair)
+        if drift is None:
+            continue
+        counts['drift_found'] += 1
+        counts['repaired'] += 1 if drift['repaired'] else 0
+        balance = 'row missing' if drift['balance_minor_units'] is None else drift['balance_minor_units']
+        logger.warning(
+            f"Wallet {drift['wallet_id']} of user {drift['user_id']} drifted: balance {balance}, "
+            f"ledger {drift['ledger_minor_units']}{' (repaired)' if drift['repaired'] else ''}"
+        )
+    return counts
+
+def update_run(pool: ydb.SessionPool, run_date: date, run: Dict[str, Any], done: bool):
+    """Save the run cursor and totals, marking the run completed once every user was checked"""
+    def execute_query(session):
+        query = """
+            DECLARE $run_date AS Date;
+            DECLARE $status AS Utf8;
+            DECLARE $last_user_id AS Utf8?;
+            DECLARE $wallets_checked AS Uint64;
+            DECLARE $drift_found AS Uint64;
+            DECLARE $repaired AS Uint64;
+            DECLARE $completed_at AS Timestamp?;
+            UPDATE wallet_reconciliation_runs
+            SET status = $status,
+                last_user_id = $last_user_id,
+                wallets_checked = $wallets_checked,
+                drift_found = $drift_found,
+                repaired = $repaired,
+                completed_at = $completed_at
+            WHERE run_date = $run_date;
+        """
+        session.transaction(ydb.SerializableReadWrite()).execute(
+            session.prepare(query),
+            {
+                '$run_date': run_date,
+                '$status': 'completed' if done else 'running',
+                '$last_user_id': run['cursor'],
+                '$wallets_checked': run['wallets_checked'],
+                '$drift_found': run['drift_found'],
+                '$repaired': run['repaired'],
+                '$completed_at': datetime.utcnow() if done else None
+            },
+            commit_tx=True
+        )
+
+    pool.retry_operation_sync(execute_query)
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler reconciling wallet_balances with the ledger
+    This function is triggered by a timer at night. Each run scans chunks of
+    users in parallel, compares every wallet's ledger total with its balance
+    row and records (or, in repair mode, fixes) any drift. A run that does not
+    finish within the time budget is resumed by the next trigger.
+    """
+    started = time.monotonic()
+    driver = None
+    try:
+        driver = get_ydb_driver()
+        pool = ydb.SessionPool(driver)
+
+        run = get_or_create_run(pool, datetime.utcnow().date(), RECONCILIATION_MODE)
+        run_date = run['run_date']
+        repair = run['mode'] == 'repair'
+        done = run['status'] == 'completed'
+
+        with ThreadPoolExecutor(max_workers=PARALLEL_CHUNKS) as executor:
+            while not done and time.monotonic() - started <= TIME_BUDGET_SECONDS:
+                users = get_next_users(pool, run['cursor'], CHUNK_USERS * PARALLEL_CHUNKS)
+                chunks = [users[i:i + CHUNK_USERS] for i in range(0, len(users), CHUNK_USERS)]
+                for counts in executor.map(lambda chunk: reconcile_chunk(driver, pool, run_date, chunk, repair), chunks):
+                    for key, value in counts.items():
+                        run[key] += value
+                # The cursor only moves once every chunk of the batch finished
+                if users:
+                    run['cursor'] = users[-1]
+                done = len(users) < CHUNK_USERS * PARALLEL_CHUNKS
+                update_run(pool, run_date, run, done)
+
+        summary = {
+            'run_date': run_date.isoformat(),
+            'mode': run['mode'],
+            'completed': done,
+            'wallets_checked': run['wallets_checked'],
+            'drift_found': run['drift_found'],
+            'repaired': run['repaired']
+        }
+        logger.info(f"Wallet reconciliation run finished: {json.dumps(summary)}")
+
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'message': 'Wallet reconciliation completed' if done else 'Wallet reconciliation in progress',
+                'summary': summary
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Wallet reconciliation failed: {e}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({
+                'error': 'Internal server error',
+                'message': str(e)
+            })
+        }
+    finally:
+        if driver:
+            driver.stop()
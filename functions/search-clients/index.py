@@ -5,6 +5,8 @@ import jwt
 import logging
 from typing import Optional, Tuple
 from datetime import datetime
+from search_index import SearchIndexReader, INDEXED_ENTITIES, normalize_value, match_score, intersect_all, chunked
+from client_keys import ensure_keys_built, lookup_clients, normalize_phone, normalize_passport
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -96,6 +98,14 @@ def handler(event, context):
         full_name = query_params.get('full_name')
         contact_number = query_params.get('contact_number')
         passport_number = query_params.get('passport_number')
+        # Free-text query matched against any searchable field (search box)
+        free_text = query_params.get('query')
+        # Normalized key lookups (exact or prefix): point/range reads on client_lookup_keys
+        key_criteria = {}
+        if query_params.get('phone'):
+            key_criteria['phone'] = normalize_phone(query_params['phone'])
+        if query_params.get('passport'):
+            key_criteria['passport'] = normalize_passport(query_params['passport'])
         
         # Construct search criteria
         search_criteria = {}
@@ -106,9 +116,25 @@ def handler(event, context):
         if passport_number:
             search_criteria['passport_number'] = passport_number
 
-        if not search_criteria:
+        if not search_criteria and not free_text and not key_criteria:
             return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'At least one search parameter is required'})}
 
+        try:
+            limit = int(query_params.get('limit', 50))
+            offset = int(query_params.get('offset', 0))
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Invalid limit or offset. Must be integers.'})}
+
+        if not (0 < limit <= 100):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Limit must be between 1 and 100.'})}
+        if offset < 0:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Offset must be a non-negative number.'})}
+
+        # Normalize once; the same normalization is used for indexing
+        normalized_criteria = {field: normalize_value(field, value) for field, value in search_criteria.items()}
+        searchable_fields = INDEXED_ENTITIES['client'][1]
+        normalized_free_text = {field: normalize_value(field, free_text) for field in searchable_fields} if free_text else {}
+
         try:
             driver_config = ydb.DriverConfig(
                 endpoint=os.environ.get('YDB_ENDPOINT'),
@@ -120,37 +146,84 @@ def handler(event, context):
             pool = ydb.SessionPool(driver)
 
             def search_clients_in_db(session):
-                # Always filter by authenticated user_id for security
-                conditions = ["user_id = $user_id"]
-                params = {'$user_id': user_id}
+                candidate_sets = []
+                if key_criteria:
+                    ensure_keys_built(session, user_id)
+                    for key_type, key_value in key_criteria.items():
+                        candidate_sets.append(set(lookup_clients(session, user_id, key_type, key_value, prefix=True, limit=None)))
 
-                for field, value in search_criteria.items():
-                    param_name = f'${field}'
-                    conditions.append(f"{field} LIKE {param_name}")
-                    params[param_name] = f"%{value}%"
+                reader = SearchIndexReader(session, user_id, 'client')
+                if normalized_criteria or normalized_free_text:
+                    reader.ensure_built()
 
-                # Build query with proper DECLARE statements
-                declares = ' '.join([f"DECLARE {param} AS Utf8;" for param in params.keys()])
-                where_clause = ' AND '.join(conditions)
-                
-                query = f"""
-                {declares}
+                # Intersect posting lists of all field criteria; free text matches any field
+                candidate_sets.extend(reader.candidates(field, value) for field, value in normalized_criteria.items())
+                if normalized_free_text:
+                    free_text_candidates = set()
+                    for field, value in normalized_free_text.items():
+                        free_text_candidates |= reader.candidates(field, value)
+                    candidate_sets.append(free_text_candidates)
+
+                candidate_ids = intersect_all(candidate_sets)
+                if not candidate_ids:
+                    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps([])}
+
+                # Always filter by authenticated user_id for security
+                query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $ids AS List<Utf8>;
                 SELECT id, user_id, full_name, contact_number, passport_number, address,
-                       guarantor_full_name, guarantor_contact_number, guarantor_passport_number, guarantor_address,
+                       phone_normalized, passport_normalized, guarantor_full_name, guarantor_contact_number, guarantor_passport_number, guarantor_address,
                        created_at, updated_at
                 FROM clients
-                WHERE {where_clause};
+                WHERE user_id = $user_id AND id IN $ids;
                 """
                 
+                # Verify every candidate before ranking, reading rows in chunks of bounded IN lists
                 prepared_query = session.prepare(query)
-                result_sets = session.transaction().execute(
-                    prepared_query, 
-                    params, 
-                    commit_tx=True
-                )
-                
+                ranked = []
+                for ids in chunked(candidate_ids):
+                    result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
+                        prepared_query,
+                        {'$user_id': user_id, '$ids': ids},
+                        commit_tx=True
+                    )
+                    for row in result_sets[0].rows:
+                        score = 0
+                        verified = True
+                        # Legacy rows without stored keys are normalized on the fly
+                        row_keys = {
+                            'phone': row.phone_normalized or normalize_phone(row.contact_number),
+                            'passport': row.passport_normalized or normalize_passport(row.passport_number)
+                        }
+                        for key_type, key_value in key_criteria.items():
+                            key_score = match_score(row_keys[key_type] or '', key_value)
+                            if key_score < 75:
+                                verified = False
+                                break
+                            score += key_score
+                        for field, value in normalized_criteria.items():
+                            if not verified:
+                                break
+                            field_score = match_score(normalize_value(field, getattr(row, field, None)), value)
+                            if not field_score:
+                                verified = False
+                                break
+                            score += field_score
+                        if verified and normalized_free_text:
+                            free_text_score = max(
+                                match_score(normalize_value(field, getattr(row, field, None)), value)
+                                for field, value in normalized_free_text.items()
+                            )
+                            verified = free_text_score > 0
+                            score += free_text_score
+                        if verified:
+                            ranked.append((score, row))
+
+                ranked.sort(key=lambda item: (-item[0], len(item[1].full_name or ''), item[1].full_name or ''))
+
                 clients = []
-                for row in result_sets[0].rows:
+                for score, row in ranked[offset:offset + limit]:
                     def convert_timestamp(ts):
                         if ts is None: return None
                         return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else (ts.isoformat() if hasattr(ts, 'isoformat') else str(ts))
@@ -170,7 +243,7 @@ def handler(event, context):
                         'updated_at': convert_timestamp(row.updated_at)
                     })
                 
-                logger.info(f"Found {len(clients)} clients matching criteria.")
+                logger.info(f"Found {len(ranked)} clients matching criteria ({len(candidate_ids)} candidates), returning {len(clients)}.")
                 return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(clients)}
 
             result = pool.retry_operation_sync(search_clients_in_db)
@@ -183,4 +256,4 @@ def handler(event, context):
         
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Internal server error'})} 
\ No newline at end of file
+        return {'statusCode': 500, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Internal server error'})}
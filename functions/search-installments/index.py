@@ -4,8 +4,7 @@ import ydb
 import jwt
 import logging
 from typing import Union, Optional, Tuple
-from decimal import Decimal
-from datetime import datetime, date
+from installment_listing import SORT_OPTIONS, DEFAULT_SORT, decode_cursor, build_keyset_query, page_response
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -82,6 +81,18 @@ class JWTAuth:
             logger.error(f"Unexpected authentication error: {e}")
             return None, "Authentication error"
 
+CORS_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+    'Access-Control-Expose-Headers': 'X-Next-Cursor',
+}
+
+# Default and maximum page size for search results
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
 def handler(event, context):
     try:
         logger.info(f"Received search request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
@@ -98,6 +109,32 @@ def handler(event, context):
         investor_id = query_params.get('investor_id')
         product_name = query_params.get('product_name')
         installment_number = query_params.get('installment_number')
+        # Free-text query from the app's search box: product, client or investor name
+        free_text = query_params.get('query')
+        
+        try:
+            limit = int(query_params.get('limit', DEFAULT_LIMIT))
+            offset = int(query_params.get('offset', 0))
+            if installment_number:
+                installment_number = int(installment_number)
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Invalid limit, offset or installment_number'})}
+
+        if not (0 < limit <= MAX_LIMIT):
+            return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f'Limit must be between 1 and {MAX_LIMIT}'})}
+        if offset < 0:
+            return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': 'Offset must be non-negative'})}
+
+        sort = query_params.get('sort', DEFAULT_SORT)
+        if sort not in SORT_OPTIONS:
+            return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': f"Sort must be one of: {', '.join(SORT_OPTIONS)}"})}
+
+        cursor_values = None
+        if query_params.get('cursor'):
+            try:
+                cursor_values = decode_cursor(query_params['cursor'], sort)
+            except ValueError as e:
+                return {'statusCode': 400, 'headers': CORS_HEADERS, 'body': json.dumps({'error': str(e)})}
         
         # Database connection
         endpoint = os.environ['YDB_ENDPOINT']
@@ -117,116 +154,60 @@ def handler(event, context):
         def execute_query(session):
             # Build dynamic WHERE clause - always include user_id for security
             where_conditions = ["user_id = $user_id"]
+            declare_statements = ["DECLARE $user_id AS Utf8;"]
             params = {'$user_id': user_id}
             
             if client_id:
                 where_conditions.append("client_id = $client_id")
+                declare_statements.append("DECLARE $client_id AS Utf8;")
                 params['$client_id'] = client_id
                 
             if investor_id:
                 where_conditions.append("investor_id = $investor_id")
+                declare_statements.append("DECLARE $investor_id AS Utf8;")
                 params['$investor_id'] = investor_id
                 
             if product_name:
                 where_conditions.append("product_name LIKE $product_name")
+                declare_statements.append("DECLARE $product_name AS Utf8;")
                 params['$product_name'] = f"%{product_name}%"
+                
             if installment_number:
                 where_conditions.append("installment_number = $installment_number")
-                params['$installment_number'] = int(installment_number)
-            
-            where_clause = ""
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-            
-            # Declare parameters - always include user_id
-            declare_statements = ["DECLARE $user_id AS Utf8;"]
-            if client_id:
-                declare_statements.append("DECLARE $client_id AS Utf8;")
-            if investor_id:
-                declare_statements.append("DECLARE $investor_id AS Utf8;")
-            if product_name:
-                declare_statements.append("DECLARE $product_name AS Utf8;")
-            if installment_number:
                 declare_statements.append("DECLARE $installment_number AS Int32;")
+                params['$installment_number'] = installment_number
             
-            query = f"""
-            {' '.join(declare_statements)}
+            if free_text:
+                where_conditions.append("(product_name LIKE $free_text OR client_name LIKE $free_text OR investor_name LIKE $free_text)")
+                declare_statements.append("DECLARE $free_text AS Utf8;")
+                params['$free_text'] = f"%{free_text}%"
             
-            SELECT 
-                id,
-                user_id,
-                client_id,
-                investor_id,
-                product_name,
-                cash_price,
-                installment_price,
-                down_payment,
-                term_months,
-                down_payment_date,
-                installment_start_date,
-                installment_end_date,
-                monthly_payment,
-                installment_number,
-                created_at,
-                updated_at
-            FROM installments
-            {where_clause}
-            ORDER BY created_at DESC;
-            """
+            query, query_params = build_keyset_query(
+                where_conditions, declare_statements, params, sort, cursor_values, limit, offset
+            )
             
             prepared_query = session.prepare(query)
-            result_sets = session.transaction().execute(
+            result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
                 prepared_query,
-                params,
+                query_params,
                 commit_tx=True
             )
             
             return result_sets[0]
         
         result_set = pool.retry_operation_sync(execute_query)
+        driver.stop()
         
-        def convert_timestamp(ts):
-            if ts is None: return None
-            return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
-
-        def convert_date(d):
-            if d is None: return None
-            if isinstance(d, date): return d.strftime('%Y-%m-%d')
-            if isinstance(d, int): return date.fromordinal(d + date(1970, 1, 1).toordinal()).strftime('%Y-%m-%d')
-            return str(d)
-        
-        installments = []
-        for row in result_set.rows:
-            installment = {
-                'id': row.id,
-                'user_id': row.user_id,
-                'client_id': row.client_id,
-                'investor_id': row.investor_id,
-                'product_name': row.product_name,
-                'cash_price': float(row.cash_price),
-                'installment_price': float(row.installment_price),
-                'down_payment': float(row.down_payment),
-                'term_months': row.term_months,
-                'down_payment_date': convert_date(row.down_payment_date),
-                'installment_start_date': convert_date(row.installment_start_date),
-                'installment_end_date': convert_date(row.installment_end_date),
-                'monthly_payment': float(row.monthly_payment),
-                'created_at': convert_timestamp(row.created_at),
-                'updated_at': convert_timestamp(row.updated_at)
-            }
-            installments.append(installment)
+        installments, next_cursor = page_response(result_set.rows, sort, limit)
         
-        driver.stop()
+        headers = dict(CORS_HEADERS)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
         
-        logger.info(f"Found {len(installments)} installments matching search criteria")
+        logger.info(f"Found {len(installments)} installments matching search criteria (more: {bool(next_cursor)})")
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-            },
+            'headers': headers,
             'body': json.dumps(installments)
         }
         
@@ -234,11 +215,6 @@ def handler(event, context):
         logger.error(f"Unexpected error: {str(e)}")
         return {
             'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-            },
+            'headers': CORS_HEADERS,
             'body': json.dumps({'error': 'Internal server error'})
-        } 
\ No newline at end of file
+        } 
@@ -0,0 +1,199 @@
+import json
+import base64
+from decimal import Decimal
+from datetime import datetime, date
+from typing import Dict, Any, List, Optional, Tuple
+
+# Sort options: (column alias, direction, YQL type) in key order; id is always the final tie-breaker.
+# Every alias is non-NULL (see the *_sort columns), so cursors never hold null and
+# keyset comparisons never skip rows.
+SORT_OPTIONS = {
+    'status': [('status_rank', 'ASC', 'Int32'), ('created_sort', 'DESC', 'Timestamp'), ('id', 'ASC', 'Utf8')],
+    'created_at': [('created_sort', 'DESC', 'Timestamp'), ('id', 'ASC', 'Utf8')],
+    'next_payment_date': [('next_payment_sort', 'ASC', 'Date'), ('id', 'ASC', 'Utf8')],
+    'remaining_amount': [('remaining_sort', 'DESC', 'Decimal(22,9)'), ('id', 'ASC', 'Utf8')],
+    'product_name': [('product_name_sort', 'ASC', 'Utf8'), ('id', 'ASC', 'Utf8')]
+}
+
+DEFAULT_SORT = 'status'
+
+# Pre-calculated columns shared by listing and search (eliminates N+1 queries).
+# allocated_minor_units is NULL on installments allocated to before the column
+# existed; reading it as 0 is only correct once backfill_allocated_totals()
+# (allocate-installment) has run.
+SELECT_COLUMNS = """
+    id, user_id, client_id, investor_id, product_name,
+    cash_price, installment_price, down_payment, term_months, monthly_payment,
+    down_payment_date, installment_start_date, installment_end_date,
+    installment_number,
+    created_at, updated_at,
+    COALESCE(client_name, 'Unknown Client') as client_name,
+    COALESCE(investor_name, 'Unknown Investor') as investor_name,
+    COALESCE(paid_amount, CAST(0 AS Decimal(22,9))) as paid_amount,
+    COALESCE(remaining_amount, installment_price) as remaining_amount,
+    COALESCE(allocated_minor_units, CAST(0 AS Int64)) as allocated_minor_units,
+    next_payment_date,
+    COALESCE(next_payment_amount, CAST(0 AS Decimal(22,9))) as next_payment_amount,
+    COALESCE(payment_status, 'предстоящий') as payment_status,
+    COALESCE(overdue_count, CAST(0 AS Int32)) as overdue_count,
+    COALESCE(total_payments, CAST(0 AS Int32)) as total_payments,
+    COALESCE(paid_payments, CAST(0 AS Int32)) as paid_payments,
+    last_payment_date,
+    CASE payment_status
+        WHEN 'просрочено' THEN 1
+        WHEN 'к оплате' THEN 2
+        WHEN 'предстоящий' THEN 3
+        WHEN 'оплачено' THEN 4
+        ELSE 5
+    END as status_rank,
+    COALESCE(next_payment_date, CAST('2105-12-31' AS Date)) as next_payment_sort,
+    COALESCE(created_at, CAST(0 AS Timestamp)) as created_sort,
+    COALESCE(remaining_amount, installment_price, CAST(0 AS Decimal(22,9))) as remaining_sort,
+    COALESCE(product_name, '') as product_name_sort
+"""
+
+def encode_cursor(sort: str, row) -> str:
+    """Opaque cursor holding the sort key of the last returned row"""
+    values = []
+    for column, _, column_type in SORT_OPTIONS[sort]:
+        value = getattr(row, column)
+        if column_type == 'Timestamp' and isinstance(value, datetime):
+            value = int((value - datetime(1970, 1, 1)).total_seconds() * 1000000)
+        elif column_type == 'Date' and isinstance(value, date):
+            value = (value - date(1970, 1, 1)).days
+        elif isinstance(value, Decimal):
+            value = str(value)
+        values.append(value)
+    raw = json.dumps({'sort': sort, 'values': values})
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, sort: str) -> List[Any]:
+    """Sort key values from a cursor; raises ValueError if it is malformed or from another sort"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    keys = SORT_OPTIONS[sort]
+    if not isinstance(payload, dict):
+        raise ValueError('Invalid cursor')
+    if payload.get('sort') != sort or len(payload.get('values', [])) != len(keys):
+        raise ValueError('Cursor does not match sort order')
+
+    values = []
+    try:
+        for (_, _, column_type), value in zip(keys, payload['values']):
+            if value is None:
+                raise TypeError('Cursor value is null')
+            if column_type == 'Timestamp':
+                value = datetime.utcfromtimestamp(int(value) / 1000000)
+            elif column_type == 'Date':
+                value = date.fromordinal(date(1970, 1, 1).toordinal() + int(value))
+            elif column_type.startswith('Decimal'):
+                value = Decimal(value)
+            elif column_type == 'Int32':
+                value = int(value)
+            elif not isinstance(value, str):
+                raise TypeError('Utf8 cursor value must be a string')
+            values.append(value)
+    except (TypeError, ValueError, ArithmeticError):
+        raise ValueError('Invalid cursor')
+    return values
+
+def build_keyset_query(where_conditions: List[str], declares: List[str], params: Dict[str, Any],
+                       sort: str, cursor_values: Optional[List[Any]], limit: int, offset: int = 0) -> Tuple[str, Dict[str, Any]]:
+    """
+    Build a page query ordered by the sort option, starting after the cursor
+
+    Fetches limit + 1 rows so the caller can tell whether another page exists.
+    """
+    keys = SORT_OPTIONS[sort]
+    declares = list(declares) + ["DECLARE $limit AS Uint64;", "DECLARE $offset AS Uint64;"]
+    params = dict(params)
+    params['$limit'] = limit + 1
+    params['$offset'] = offset
+
+    after_clause = ""
+    if cursor_values is not None:
+        # (k1, k2, ..., id) strictly after the cursor, honouring each key's direction
+        for index, ((column, _, column_type), value) in enumerate(zip(keys, cursor_values)):
+            declares.append(f"DECLARE $after_{index} AS {column_type};")
+            params[f'$after_{index}'] = value
+        alternatives = []
+        for index, (column, direction, _) in enumerate(keys):
+            comparator = '>' if direction == 'ASC' else '<'
+            equalities = [f"{keys[prior][0]} = $after_{prior}" for prior in range(index)]
+            alternatives.append('(' + ' AND '.join(equalities + [f"{column} {comparator} $after_{index}"]) + ')')
+        after_clause = "WHERE " + " OR ".join(alternatives)
+
+    order_clause = ', '.join(f"{column} {direction}" for column, direction, _ in keys)
+    query = f"""
+    {' '.join(declares)}
+
+    $page = (
+        SELECT {SELECT_COLUMNS}
+        FROM installments
+        WHERE {' AND '.join(where_conditions)}
+    );
+
+    SELECT * FROM $page
+    {after_clause}
+    ORDER BY {order_clause}
+    LIMIT $limit OFFSET $offset;
+    """
+    return query, params
+
+def convert_timestamp(ts):
+    if ts is None: return None
+    return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
+
+def convert_date(d):
+    if d is None: return None
+    if isinstance(d, date): return d.strftime('%Y-%m-%d')
+    if isinstance(d, int): return date.fromordinal(d + date(1970, 1, 1).toordinal()).strftime('%Y-%m-%d')
+    return str(d)
+
+def serialize_installment(row) -> Dict[str, Any]:
+    """Installment with pre-calculated display fields, as returned by list-installments"""
+    return {
+        'id': row.id,
+        'user_id': row.user_id,
+        'client_id': row.client_id,
+        'investor_id': row.investor_id,
+        'product_name': row.product_name,
+        'cash_price': float(row.cash_price),
+        'installment_price': float(row.installment_price),
+        'down_payment': float(row.down_payment),
+        'term_months': row.term_months,
+        'down_payment_date': convert_date(row.down_payment_date),
+        'installment_start_date': convert_date(row.installment_start_date),
+        'installment_end_date': convert_date(row.installment_end_date),
+        'installment_number': getattr(row, 'installment_number', None),
+        'monthly_payment': float(row.monthly_payment),
+        'created_at': convert_timestamp(row.created_at),
+        'updated_at': convert_timestamp(row.updated_at),
+
+        # Pre-calculated display fields (no additional queries needed!)
+        'client_name': row.client_name,
+        'investor_name': row.investor_name,
+        'paid_amount': float(row.paid_amount),
+        'remaining_amount': float(row.remaining_amount),
+        'allocated_minor_units': row.allocated_minor_units,
+        'next_payment_date': convert_date(row.next_payment_date),
+        'next_payment_amount': float(row.next_payment_amount),
+        'payment_status': row.payment_status,
+        'overdue_count': row.overdue_count,
+        'total_payments': row.total_payments,
+        'paid_payments': row.paid_payments,
+        'last_payment_date': convert_date(row.last_payment_date),
+
+        # For backward compatibility, include empty payments array
+        # Frontend can request full payment details separately if needed
+        'payments': []
+    }
+
+def page_response(rows, sort: str, limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Serialize up to limit rows and return the cursor for the next page, if any"""
+    has_more = len(rows) > limit
+    page = rows[:limit]
+    next_cursor = encode_cursor(sort, page[-1]) if has_more and page else None
+    return [serialize_installment(row) for row in page], next_cursor
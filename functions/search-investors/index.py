@@ -6,6 +6,7 @@ import jwt
 import logging
 from typing import Optional, Tuple
 from datetime import datetime
+from search_index import SearchIndexReader, normalize_value, match_score, intersect_all, chunked
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -97,9 +98,25 @@ def handler(event, context):
         searchable_fields = ['full_name']
         
         search_criteria = {k: v for k, v in query_params.items() if k in searchable_fields and v}
+        # Free-text query from the search box maps onto the name
+        if not search_criteria and query_params.get('query'):
+            search_criteria['full_name'] = query_params['query']
         if not search_criteria:
             return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'At least one search parameter is required'})}
 
+        try:
+            limit = int(query_params.get('limit', 50))
+            offset = int(query_params.get('offset', 0))
+        except (ValueError, TypeError):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Invalid limit or offset. Must be integers.'})}
+
+        if not (0 < limit <= 100):
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Limit must be between 1 and 100.'})}
+        if offset < 0:
+            return {'statusCode': 400, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Offset must be a non-negative number.'})}
+
+        normalized_criteria = {field: normalize_value(field, value) for field, value in search_criteria.items()}
+
         try:
             driver_config = ydb.DriverConfig(
                 endpoint=os.environ.get('YDB_ENDPOINT'),
@@ -111,35 +128,40 @@ def handler(event, context):
             pool = ydb.SessionPool(driver)
 
             def search_investors_in_db(session):
-                # Build the query conditions
-                conditions = ['user_id = $user_id']  # Always filter by authenticated user
-                params = {'$user_id': user_id}
+                reader = SearchIndexReader(session, user_id, 'investor')
+                reader.ensure_built()
 
-                for field, value in search_criteria.items():
-                    param_name = f'${field}'
-                    conditions.append(f"{field} LIKE {param_name}")
-                    params[param_name] = f"%{value}%"
+                # Intersect posting lists of all criteria, then verify candidates
+                candidate_sets = [reader.candidates(field, value) for field, value in normalized_criteria.items()]
+                candidate_ids = intersect_all(candidate_sets)
+                if not candidate_ids:
+                    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps([])}
 
-                # Build query with proper DECLARE statements
-                declares = ' '.join([f"DECLARE {param} AS Utf8;" for param in params.keys()])
-                where_clause = ' AND '.join(conditions)
-                
-                query = f"""
-                {declares}
+                query = """
+                DECLARE $user_id AS Utf8;
+                DECLARE $ids AS List<Utf8>;
                 SELECT id, user_id, full_name, investment_amount, investor_percentage, user_percentage, created_at, updated_at
                 FROM investors
-                WHERE {where_clause};
+                WHERE user_id = $user_id AND id IN $ids;
                 """
                 
+                # Verify every candidate before ranking, reading rows in chunks of bounded IN lists
                 prepared_query = session.prepare(query)
-                result_sets = session.transaction().execute(
-                    prepared_query, 
-                    params, 
-                    commit_tx=True
-                )
+                ranked = []
+                for ids in chunked(candidate_ids):
+                    result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
+                        prepared_query,
+                        {'$user_id': user_id, '$ids': ids},
+                        commit_tx=True
+                    )
+                    for row in result_sets[0].rows:
+                        scores = [match_score(normalize_value(field, getattr(row, field, None)), value) for field, value in normalized_criteria.items()]
+                        if all(scores):
+                            ranked.append((sum(scores), row))
+                ranked.sort(key=lambda item: (-item[0], len(item[1].full_name or ''), item[1].full_name or ''))
                 
                 investors = []
-                for row in result_sets[0].rows:
+                for score, row in ranked[offset:offset + limit]:
                     def convert_timestamp(ts):
                         if ts is None: return None
                         return datetime.fromtimestamp(ts / 1000000).isoformat() if isinstance(ts, int) else ts.isoformat()
@@ -153,7 +175,7 @@ def handler(event, context):
                         'updated_at': convert_timestamp(row.updated_at)
                     })
                 
-                logger.info(f"Found {len(investors)} investors matching criteria.")
+                logger.info(f"Found {len(ranked)} investors matching criteria ({len(candidate_ids)} candidates), returning {len(investors)}.")
                 return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(investors)}
 
             return pool.retry_operation_sync(search_investors_in_db)
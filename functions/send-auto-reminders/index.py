@@ -4,220 +4,24 @@ import logging
 import ydb
 import requests
 import time
-import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
+from message_templates import TemplateError, get_compiled_template
+from reminder_schedule import user_schedule, template_type_for_offset, default_template_key
+from reminder_outbox import REMINDER_OUTBOX_TABLE, REMINDER_LOG_TABLE, make_outbox_id, to_date, filter_unlogged, enqueue_messages
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class WhatsAppError(Exception):
-    """Custom exception for WhatsApp-related errors"""
-    def __init__(self, message: str, error_code: Optional[str] = None, retryable: bool = False):
-        self.message = message
-        self.error_code = error_code
-        self.retryable = retryable
-        super().__init__(self.message)
-
-class GreenAPIClient:
-    """Green API client for WhatsApp messaging"""
-    
-    def __init__(self, instance_id: str, token: str):
-        self.instance_id = instance_id
-        self.token = token
-        self.base_url = f"https://api.green-api.com/waInstance{instance_id}"
-        self.session = requests.Session()
-        self.session.timeout = 30
-        
-    def send_message(self, phone_number: str, message: str) -> Dict[str, Any]:
-        """Send WhatsApp message via Green API"""
-        try:
-            # Format phone number
-            formatted_phone = self._format_phone_number(phone_number)
-            
-            # Prepare request
-            url = f"{self.base_url}/sendMessage/{self.token}"
-            payload = {
-                "chatId": f"{formatted_phone}@c.us",
-                "message": message
-            }
-            
-            logger.info(f"Sending WhatsApp message to {formatted_phone[:5]}****")
-            
-            response = self.session.post(url, json=payload)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('idMessage'):
-                    logger.info(f"Message sent successfully: {result.get('idMessage')}")
-                    return result
-                else:
-                    raise WhatsAppError(
-                        f"Message sending failed: {result.get('error', 'Unknown error')}",
-                        error_code="SEND_FAILED",
-                        retryable=True
-                    )
-            elif response.status_code == 429:
-                raise WhatsAppError(
-                    "Rate limit exceeded",
-                    error_code="RATE_LIMIT",
-                    retryable=True
-                )
-            elif response.status_code == 401:
-                raise WhatsAppError(
-                    "Invalid Green API credentials",
-                    error_code="AUTH_FAILED",
-                    retryable=False
-                )
-            else:
-                raise WhatsAppError(
-                    f"HTTP error {response.status_code}: {response.text}",
-                    error_code="HTTP_ERROR",
-                    retryable=True
-                )
-                
-        except requests.exceptions.Timeout:
-            raise WhatsAppError(
-                "Request timeout",
-                error_code="TIMEOUT",
-                retryable=True
-            )
-        except requests.exceptions.ConnectionError:
-            raise WhatsAppError(
-                "Connection error",
-                error_code="CONNECTION_ERROR",
-                retryable=True
-            )
-        except Exception as e:
-            if isinstance(e, WhatsAppError):
-                raise
-            raise WhatsAppError(
-                f"Unexpected error: {str(e)}",
-                error_code="UNKNOWN_ERROR",
-                retryable=False
-            )
-    
-    def test_connection(self) -> Tuple[bool, Optional[str]]:
-        """Test Green API connection and credentials"""
-        try:
-            url = f"{self.base_url}/getSettings/{self.token}"
-            response = self.session.get(url)
-            
-            if response.status_code == 200:
-                return True, None
-            elif response.status_code == 401:
-                return False, "Invalid credentials"
-            else:
-                return False, f"Connection test failed: {response.status_code}"
-                
-        except Exception as e:
-            return False, f"Connection error: {str(e)}"
-    
-    def _format_phone_number(self, phone_number: str) -> str:
-        """Format phone number for Green API"""
-        # Remove all non-digit characters
-        digits_only = re.sub(r'\D', '', phone_number)
-        
-        # Remove leading + if present
-        if digits_only.startswith('7') and len(digits_only) == 11:
-            # Russian number format
-            return digits_only
-        elif digits_only.startswith('8') and len(digits_only) == 11:
-            # Convert Russian 8 to 7
-            return '7' + digits_only[1:]
-        elif len(digits_only) >= 10:
-            # International format
-            return digits_only
-        else:
-            raise WhatsAppError(
-                f"Invalid phone number format: {phone_number}",
-                error_code="INVALID_PHONE",
-                retryable=False
-            )
-
-class WhatsAppService:
-    """Main WhatsApp service class"""
-    
-    def __init__(self, instance_id: str, token: str):
-        self.client = GreenAPIClient(instance_id, token)
-    
-    def send_reminder(self, phone_number: str, template: str, variables: Dict[str, Any], max_retries: int = 3) -> Dict[str, Any]:
-        """Send WhatsApp reminder with retry logic"""
-        result = {
-            'status': 'failed',
-            'message_id': None,
-            'error': None,
-            'attempts': 0
-        }
-        
-        try:
-            # Process template
-            message = self.process_template(template, variables)
-            
-            # Attempt to send with retries
-            for attempt in range(max_retries):
-                result['attempts'] = attempt + 1
-                
-                try:
-                    response = self.client.send_message(phone_number, message)
-                    result['status'] = 'success'
-                    result['message_id'] = response.get('idMessage')
-                    return result
-                    
-                except WhatsAppError as e:
-                    result['error'] = e.message
-                    
-                    if not e.retryable or attempt == max_retries - 1:
-                        break
-                    
-                    # Exponential backoff
-                    wait_time = 2 ** attempt
-                    logger.info(f"Retrying in {wait_time} seconds (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
-            
-            return result
-            
-        except Exception as e:
-            result['error'] = str(e)
-            return result
-    
-    def test_connection(self) -> Tuple[bool, Optional[str]]:
-        """Test Green API connection"""
-        return self.client.test_connection()
-    
-    def process_template(self, template: str, variables: Dict[str, Any]) -> str:
-        """Process template with variable substitution"""
-        try:
-            # Ensure all variables are strings
-            str_variables = {k: str(v) if v is not None else '' for k, v in variables.items()}
-            
-            # Replace variables in template
-            processed = template.format(**str_variables)
-            
-            logger.debug(f"Template processed successfully")
-            return processed
-            
-        except KeyError as e:
-            logger.error(f"Missing template variable: {e}")
-            raise WhatsAppError(
-                f"Template processing failed: missing variable {e}",
-                error_code="TEMPLATE_ERROR",
-                retryable=False
-            )
-        except Exception as e:
-            logger.error(f"Template processing error: {e}")
-            raise WhatsAppError(
-                f"Template processing failed: {str(e)}",
-                error_code="TEMPLATE_ERROR",
-                retryable=False
-            )
-
 # Default templates
 DEFAULT_TEMPLATES = {
     'reminder_7_days': "Здравствуйте, {client_name}! Напоминаем, что ваш платеж по рассрочке в размере {installment_amount} руб. за {product_name} должен быть внесен через {days_remaining} дней ({due_date}). Пожалуйста, подготовьте средства для оплаты.",
     'reminder_due_today': "Здравствуйте, {client_name}! Ваш платеж по рассрочке в размере {installment_amount} руб. за {product_name} должен быть внесен сегодня ({due_date}). Пожалуйста, произведите оплату.",
-    'reminder_manual': "Здравствуйте, {client_name}! Напоминаем о вашем платеже по рассрочке в размере {installment_amount} руб. за {product_name}. Дата платежа: {due_date}."
+    'reminder_manual': "Здравствуйте, {client_name}! Напоминаем о вашем платеже по рассрочке в размере {installment_amount} руб. за {product_name}. Дата платежа: {due_date}.",
+    'reminder_overdue': "Здравствуйте, {client_name}! Ваш платеж по рассрочке в размере {installment_amount} руб. за {product_name} просрочен на {days_overdue} дн. (срок оплаты {due_date}). Пожалуйста, произведите оплату как можно скорее."
 }
 
 def get_ydb_driver():
@@ -235,194 +39,206 @@ def get_ydb_driver():
     driver.wait(fail_fast=True)
     return driver
 
-def get_all_enabled_users() -> List[Dict[str, Any]]:
+# Users are split into shards by a hash of user_id; each shard runs in its own invocation
+SHARD_COUNT = 8
+
+# Stop starting new users after this many seconds (function timeout is 30s)
+TIME_BUDGET_SECONDS = 20
+
+# Rendered messages accumulated before a bulk outbox write and checkpoint
+ENQUEUE_FLUSH_SIZE = 500
+
+# Due payments read per page of the candidate query (YDB truncates larger result sets)
+CANDIDATE_PAGE_SIZE = 1000
+
+# How long the coordinator waits for a shard invocation before leaving it running
+SHARD_INVOKE_TIMEOUT_SECONDS = 28
+
+REMINDER_RUN_SHARDS_TABLE = """
+CREATE TABLE reminder_run_shards (
+    run_date Date NOT NULL,
+    shard Uint32 NOT NULL,
+    status Utf8,
+    last_user_id Utf8,
+    processed_users Int64,
+    queued_messages Int64,
+    failed_messages Int64,
+    updated_at Timestamp,
+    PRIMARY KEY (run_date, shard)
+);
+"""
+
+# Lets the candidate query read only payments due on the target dates
+INSTALLMENT_PAYMENTS_DUE_DATE_INDEX = """
+ALTER TABLE installment_payments ADD INDEX idx_due_date GLOBAL ON (due_date);
+"""
+
+def get_all_enabled_users(pool: ydb.SessionPool) -> List[Dict[str, Any]]:
     """Get all users with WhatsApp reminders enabled"""
-    driver = get_ydb_driver()
-    try:
-        pool = ydb.SessionPool(driver)
-        
-        def execute_query(session):
-            query = """
-                SELECT 
-                    user_id,
-                    green_api_instance_id,
-                    green_api_token,
-                    reminder_template_7_days,
-                    reminder_template_due_today,
-                    reminder_template_manual,
-                    is_enabled
-                FROM whatsapp_settings 
-                WHERE is_enabled = true
-                AND green_api_instance_id IS NOT NULL
-                AND green_api_token IS NOT NULL;
-            """
-            
-            tx = session.transaction(ydb.SerializableReadWrite())
-            result_sets = tx.execute(query)
-            tx.commit()
-            return result_sets
+    def execute_query(session):
+        query = """
+            SELECT 
+                user_id,
+                green_api_instance_id,
+                green_api_token,
+                reminder_template_7_days,
+                reminder_template_due_today,
+                reminder_template_manual,
+                reminder_schedule,
+                is_enabled
+            FROM whatsapp_settings 
+            WHERE is_enabled = true
+            AND green_api_instance_id IS NOT NULL
+            AND green_api_token IS NOT NULL;
+        """
+        
+        return session.transaction(ydb.OnlineReadOnly()).execute(query, commit_tx=True)
 
-        result_sets = pool.retry_operation_sync(execute_query)
-        
-        users = []
-        if result_sets and result_sets[0].rows:
-            for row in result_sets[0].rows:
-                users.append({
-                    'user_id': row.user_id,
-                    'green_api_instance_id': row.green_api_instance_id,
-                    'green_api_token': row.green_api_token,
-                    'reminder_template_7_days': row.reminder_template_7_days,
-                    'reminder_template_due_today': row.reminder_template_due_today,
-                    'reminder_template_manual': row.reminder_template_manual,
-                    'is_enabled': row.is_enabled
-                })
-        
-        return users
-        
-    finally:
-        driver.stop()
+    result_sets = pool.retry_operation_sync(execute_query)
+    
+    users = []
+    if result_sets and result_sets[0].rows:
+        for row in result_sets[0].rows:
+            settings = {
+                'user_id': row.user_id,
+                'green_api_instance_id': row.green_api_instance_id,
+                'green_api_token': row.green_api_token,
+                'reminder_template_7_days': row.reminder_template_7_days,
+                'reminder_template_due_today': row.reminder_template_due_today,
+                'reminder_template_manual': row.reminder_template_manual,
+                'reminder_schedule': row.reminder_schedule,
+                'is_enabled': row.is_enabled
+            }
+            try:
+                settings['schedule'] = user_schedule(settings)
+            except ValueError as e:
+                logger.error(f"Invalid reminder schedule for user {row.user_id}: {e}")
+                continue
+            users.append(settings)
+    
+    return users
+
+def get_due_reminders(pool: ydb.SessionPool, users: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Get unpaid payments due on every reminder offset date for all enabled users in one query
 
-def get_installments_due_in_days(user_id: str, days: int) -> List[Dict[str, Any]]:
-    """Get installments that are due in specified number of days"""
-    if days < 0:
-        return []
+    The dates of every offset in every user's schedule are read in the same
+    pass (idx_due_date), joined to the installment and client, and matched to
+    each user's own offsets in memory, so adding offsets adds no scans.
+    Payments are read in keyset pages over (due_date, id), so no candidate is
+    cut off by the result set limit. Reminders already in reminder_log
+    (queued or sent) are dropped with a bulk lookup.
+
+    Returns:
+        {user_id: {template_type: [installment_data, ...]}}
+    """
+    if not users:
+        return {}
     
-    driver = get_ydb_driver()
-    try:
-        pool = ydb.SessionPool(driver)
-        
-        def execute_query(session):
-            # Query 1: Get all installments for the user
-            installment_query = """
-                DECLARE $user_id AS Utf8;
-                SELECT id, user_id, client_id, investor_id, product_name, cash_price, 
-                       installment_price, down_payment, term_months, down_payment_date, 
-                       installment_start_date, installment_end_date, monthly_payment, 
-                       created_at, updated_at
-                FROM installments 
-                WHERE user_id = $user_id;
-            """
-            
-            # Query 2: Get clients info
-            client_query = """
-                DECLARE $user_id AS Utf8;
-                SELECT id, full_name, contact_number
-                FROM clients 
-                WHERE user_id = $user_id;
-            """
-            
-            # Query 3: Get next unpaid payment for each installment
-            payment_query = """
-                SELECT installment_id, MIN(due_date) as next_due_date
-                FROM installment_payments 
-                WHERE is_paid = false
-                GROUP BY installment_id;
-            """
-            
-            tx = session.transaction(ydb.SerializableReadWrite())
+    today = datetime.utcnow().date()
+    schedules = {user['user_id']: user['schedule'] for user in users}
+    user_ids = list(schedules)
+    due_dates = sorted({today + timedelta(days=days) for schedule in schedules.values() for days in schedule})
+    
+    def execute_query(session, after):
+        query = """
+            DECLARE $due_dates AS List<Date>;
+            DECLARE $after_due_date AS Date?;
+            DECLARE $after_id AS Utf8?;
+            DECLARE $limit AS Uint64;
             
-            # Execute all queries
-            installment_result_sets = tx.execute(
-                session.prepare(installment_query),
-                {'$user_id': user_id}
-            )
+            $due = (
+                SELECT id, installment_id, due_date, expected_amount
+                FROM installment_payments VIEW idx_due_date
+                WHERE due_date IN $due_dates AND is_paid = false
+                AND ($after_due_date IS NULL OR due_date > $after_due_date OR (due_date = $after_due_date AND id > $after_id))
+                ORDER BY due_date, id
+                LIMIT $limit
+            );
             
-            client_result_sets = tx.execute(
-                session.prepare(client_query),
-                {'$user_id': user_id}
-            )
+            SELECT
+                d.id AS payment_id,
+                d.installment_id AS installment_id,
+                d.due_date AS due_date,
+                d.expected_amount AS expected_amount,
+                i.user_id AS user_id,
+                i.product_name AS product_name,
+                i.monthly_payment AS monthly_payment,
+                i.installment_price AS installment_price,
+                i.term_months AS term_months,
+                i.client_id AS client_id,
+                c.full_name AS client_name,
+                c.contact_number AS contact_number,
+                c.phone_normalized AS phone_normalized
+            FROM $due AS d
+            LEFT JOIN installments AS i ON i.id = d.installment_id
+            LEFT JOIN clients AS c ON c.id = i.client_id
+            ORDER BY due_date, payment_id;
+        """
+        
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {
+                '$due_dates': due_dates,
+                '$after_due_date': after[0] if after else None,
+                '$after_id': after[1] if after else None,
+                '$limit': CANDIDATE_PAGE_SIZE
+            },
+            commit_tx=True
+        )
+
+    # One row per due payment, so a short page is the last one; other users' payments are skipped below
+    rows = []
+    after = None
+    while True:
+        page = pool.retry_operation_sync(lambda session: execute_query(session, after))[0].rows
+        rows.extend(page)
+        if len(page) < CANDIDATE_PAGE_SIZE:
+            break
+        after = (to_date(page[-1].due_date), page[-1].payment_id)
+    
+    candidates = []
+    for row in rows:
+        if row.user_id not in schedules:
+            continue
+        try:
+            due_date = to_date(row.due_date)
+            days = (due_date - today).days
+            if days not in schedules.get(row.user_id, {}):
+                continue
             
-            payment_result_sets = tx.execute(
-                session.prepare(payment_query)
-            )
+            amount = row.expected_amount if row.expected_amount is not None else row.monthly_payment
+            installment_data = {
+                'payment_id': row.payment_id,
+                'template_type': template_type_for_offset(days),
+                'days_before_due': days,
+                'installment_id': row.installment_id,
+                'product_name': row.product_name,
+                'monthly_payment': float(amount),
+                'total_price': float(row.installment_price),
+                'term_months': row.term_months,
+                'client_id': row.client_id,
+                'client_name': row.client_name or 'Unknown Client',
+                # Prefer the key normalized at write time; legacy rows fall back to the raw number
+                'client_phone': row.phone_normalized or row.contact_number or 'No Phone',
+                'due_date': due_date,
+                'days_remaining': (due_date - today).days
+            }
+            installment_data['user_id'] = row.user_id
+            candidates.append(installment_data)
             
-            tx.commit()
-            return installment_result_sets[0], client_result_sets[0], payment_result_sets[0]
-
-        installment_result, client_result, payment_result = pool.retry_operation_sync(execute_query)
-        
-        # Create client lookup map
-        clients = {}
-        if client_result.rows:
-            for row in client_result.rows:
-                clients[row.id] = {
-                    'name': row.full_name,
-                    'phone': row.contact_number
-                }
-        
-        # Create payment dates lookup map
-        payment_dates = {}
-        if payment_result.rows:
-            for row in payment_result.rows:
-                payment_dates[row.installment_id] = row.next_due_date
-        
-        # Calculate target date
-        target_date = datetime.utcnow().date() + timedelta(days=days)
-        
-        installments = []
-        if installment_result.rows:
-            for row in installment_result.rows:
-                try:
-                    # Access fields exactly like get-installment function
-                    installment_id = row.id
-                    product_name = row.product_name
-                    monthly_payment = float(row.monthly_payment)
-                    installment_price = float(row.installment_price)
-                    term_months = row.term_months
-                    client_id = row.client_id
-                    
-                    # Get client info
-                    client_info = clients.get(client_id, {})
-                    client_name = client_info.get('name', 'Unknown Client')
-                    client_phone = client_info.get('phone', 'No Phone')
-                    
-                    # Get next due date from payment_dates map
-                    next_due_date_raw = payment_dates.get(installment_id)
-                    
-                    if next_due_date_raw:
-                        # Convert YDB date to Python date
-                        if isinstance(next_due_date_raw, int):
-                            next_due_date = (datetime(1970, 1, 1) + timedelta(days=next_due_date_raw)).date()
-                        elif hasattr(next_due_date_raw, 'date'):
-                            next_due_date = next_due_date_raw.date()
-                        elif isinstance(next_due_date_raw, datetime):
-                            next_due_date = next_due_date_raw.date()
-                        else:
-                            continue  # Skip if we can't parse the date
-                    else:
-                        continue  # Skip if no unpaid payments
-                    
-                    # Only include installments where next_due_date matches target_date
-                    if next_due_date != target_date:
-                        continue
-                    
-                    current_date = datetime.utcnow().date()
-                    days_remaining = (next_due_date - current_date).days
-                    
-                    installment_data = {
-                        'installment_id': installment_id,
-                        'product_name': product_name,
-                        'monthly_payment': monthly_payment,
-                        'total_price': installment_price,
-                        'term_months': term_months,
-                        'client_id': client_id,
-                        'client_name': client_name,
-                        'client_phone': client_phone,
-                        'due_date': next_due_date,
-                        'days_remaining': days_remaining
-                    }
-                    
-                    installments.append(installment_data)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing installment row: {e}")
-                    continue
-        
-        logger.info(f"Found {len(installments)} installments due in {days} days for user {user_id}")
-        return installments
-        
-    finally:
-        driver.stop()
+        except Exception as e:
+            logger.error(f"Error processing reminder candidate row: {e}")
+            continue
+    
+    unsent = filter_unlogged(pool, today, candidates)
+    
+    due = {}
+    for installment_data in unsent:
+        due.setdefault(installment_data['user_id'], {}).setdefault(installment_data['template_type'], []).append(installment_data)
+    
+    logger.info(f"Found {len(candidates)} due payments ({len(candidates) - len(unsent)} already queued) for {len(due)} of {len(user_ids)} users")
+    return due
 
 def format_currency(amount: float) -> str:
     """Format currency amount for display"""
@@ -437,244 +253,332 @@ def format_date(date_obj) -> str:
     else:
         return str(date_obj)
 
-def get_template_by_type(user_settings: Dict[str, Any], template_type: str) -> str:
-    """Get message template by type"""
-    template_map = {
-        'manual': user_settings.get('reminder_template_manual') or DEFAULT_TEMPLATES['reminder_manual'],
-        '7_days': user_settings.get('reminder_template_7_days') or DEFAULT_TEMPLATES['reminder_7_days'],
-        'due_today': user_settings.get('reminder_template_due_today') or DEFAULT_TEMPLATES['reminder_due_today']
-    }
-    
-    return template_map.get(template_type, template_map['manual'])
+def get_template_for_offset(user_settings: Dict[str, Any], days_before_due: int) -> str:
+    """Template of a schedule offset, falling back to the default for that kind of offset"""
+    return user_settings['schedule'].get(days_before_due) or DEFAULT_TEMPLATES[default_template_key(days_before_due)]
+
+def build_messages(user_settings: Dict[str, Any], due_reminders: Dict[str, List[Dict[str, Any]]], reminder_date) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Render a user's due reminders into outbox messages
+
+    Returns:
+        Tuple of (messages, errors)
+    """
+    messages = []
+    errors = []
+    # Template types map one-to-one to schedule offsets
+    for template_type, installments in due_reminders.items():
+        days_before_due = installments[0]['days_before_due']
+        try:
+            # Parsed once per template text, not per message
+            template = get_compiled_template(get_template_for_offset(user_settings, days_before_due))
+        except TemplateError as e:
+            logger.error(f"Invalid {template_type} template for user {user_settings['user_id']}: {e}")
+            errors.extend(
+                {'installment_id': installment['installment_id'], 'template_type': template_type, 'error': f"Template processing failed: {e}"}
+                for installment in installments
+            )
+            continue
+        
+        for installment in installments:
+            variables = {
+                'client_name': installment['client_name'],
+                'installment_amount': format_currency(installment['monthly_payment']),
+                'due_date': format_date(installment['due_date']),
+                'days_remaining': str(installment['days_remaining']),
+                'days_overdue': str(max(-installment['days_remaining'], 0)),
+                'product_name': installment['product_name'] or 'товар',
+                'total_amount': format_currency(installment['total_price'])
+            }
+            messages.append({
+                'id': make_outbox_id(installment['payment_id'], template_type, reminder_date),
+                'user_id': user_settings['user_id'],
+                'installment_id': installment['installment_id'],
+                'payment_id': installment['payment_id'],
+                'template_type': template_type,
+                'reminder_date': reminder_date,
+                'phone': installment['client_phone'],
+                'message': template.render(variables)
+            })
+    return messages, errors
 
-def send_installment_reminder(installment: Dict[str, Any], template: str, whatsapp_service: WhatsAppService, template_type: str) -> Dict[str, Any]:
-    """Send WhatsApp reminder for a specific installment"""
+def initialize_reminder_tables():
+    """Create reminder_outbox and reminder_log (run once)"""
+    driver = get_ydb_driver()
     try:
-        # Prepare template variables
-        variables = {
-            'client_name': installment['client_name'],
-            'installment_amount': format_currency(installment['monthly_payment']),
-            'due_date': format_date(installment['due_date']),
-            'days_remaining': str(installment['days_remaining']),
-            'product_name': installment['product_name'] or 'товар',
-            'total_amount': format_currency(installment['total_price'])
-        }
-        
-        # Send reminder
-        send_result = whatsapp_service.send_reminder(
-            phone_number=installment['client_phone'],
-            template=template,
-            variables=variables
+        pool = ydb.SessionPool(driver)
+        for ddl in (REMINDER_OUTBOX_TABLE, REMINDER_LOG_TABLE):
+            pool.retry_operation_sync(lambda session: session.execute_scheme(ddl))
+        logger.info("reminder_outbox and reminder_log tables created successfully")
+    finally:
+        driver.stop()
+
+def shard_for_user(user_id: str) -> int:
+    """Stable shard number for a user (independent of Python's per-process hash seed)"""
+    return int(hashlib.md5(user_id.encode('utf-8')).hexdigest()[:8], 16) % SHARD_COUNT
+
+def initialize_reminder_run_shards():
+    """Create the reminder_run_shards table (run once)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        pool.retry_operation_sync(lambda session: session.execute_scheme(REMINDER_RUN_SHARDS_TABLE))
+        logger.info("reminder_run_shards table created successfully")
+    finally:
+        driver.stop()
+
+def initialize_due_date_index():
+    """Add idx_due_date to installment_payments (run once; candidate selection reads through it)"""
+    driver = get_ydb_driver()
+    try:
+        pool = ydb.SessionPool(driver)
+        pool.retry_operation_sync(lambda session: session.execute_scheme(INSTALLMENT_PAYMENTS_DUE_DATE_INDEX))
+        logger.info("installment_payments idx_due_date created successfully")
+    finally:
+        driver.stop()
+
+def get_shard_checkpoints(pool: ydb.SessionPool, run_date) -> Dict[int, Dict[str, Any]]:
+    """Get persisted progress of every shard of a run"""
+    def execute_query(session):
+        query = """
+            DECLARE $run_date AS Date;
+            SELECT shard, status, last_user_id, processed_users, queued_messages, failed_messages
+            FROM reminder_run_shards
+            WHERE run_date = $run_date;
+        """
+        return session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            {'$run_date': run_date},
+            commit_tx=True
         )
-        
-        result = {
-            'installment_id': installment['installment_id'],
-            'client_name': installment['client_name'],
-            'client_phone': installment['client_phone'][:5] + '****',  # Mask phone for logging
-            'template_type': template_type,
-            'status': send_result['status'],
-            'message_id': send_result.get('message_id'),
-            'error': send_result.get('error'),
-            'attempts': send_result.get('attempts', 0)
-        }
-        
-        if send_result['status'] == 'success':
-            logger.info(f"Auto reminder sent successfully to {installment['client_name']} for installment {installment['installment_id']}")
-        else:
-            logger.warning(f"Failed to send auto reminder to {installment['client_name']} for installment {installment['installment_id']}: {send_result.get('error')}")
-        
-        return result
-        
-    except Exception as e:
-        logger.error(f"Error sending auto reminder for installment {installment['installment_id']}: {e}")
-        return {
-            'installment_id': installment['installment_id'],
-            'client_name': installment.get('client_name', 'unknown'),
-            'template_type': template_type,
-            'status': 'failed',
-            'error': str(e)
+
+    result_sets = pool.retry_operation_sync(execute_query)
+    
+    checkpoints = {}
+    for row in result_sets[0].rows:
+        checkpoints[row.shard] = {
+            'status': row.status,
+            'last_user_id': row.last_user_id,
+            'processed_users': row.processed_users or 0,
+            'queued_messages': row.queued_messages or 0,
+            'failed_messages': row.failed_messages or 0
         }
+    return checkpoints
+
+def save_shard_checkpoint(pool: ydb.SessionPool, run_date, shard: int, checkpoint: Dict[str, Any]):
+    """Persist the shard cursor: every user up to last_user_id has been processed"""
+    def execute_query(session):
+        query = """
+            DECLARE $run_date AS Date;
+            DECLARE $shard AS Uint32;
+            DECLARE $status AS Utf8;
+            DECLARE $last_user_id AS Utf8?;
+            DECLARE $processed_users AS Int64;
+            DECLARE $queued_messages AS Int64;
+            DECLARE $failed_messages AS Int64;
+            DECLARE $updated_at AS Timestamp;
+            UPSERT INTO reminder_run_shards (
+                run_date, shard, status, last_user_id, processed_users, queued_messages, failed_messages, updated_at
+            ) VALUES (
+                $run_date, $shard, $status, $last_user_id, $processed_users, $queued_messages, $failed_messages, $updated_at
+            );
+        """
+        session.transaction(ydb.SerializableReadWrite()).execute(
+            session.prepare(query),
+            {
+                '$run_date': run_date,
+                '$shard': shard,
+                '$status': checkpoint['status'],
+                '$last_user_id': checkpoint['last_user_id'],
+                '$processed_users': checkpoint['processed_users'],
+                '$queued_messages': checkpoint['queued_messages'],
+                '$failed_messages': checkpoint['failed_messages'],
+                '$updated_at': datetime.utcnow()
+            },
+            commit_tx=True
+        )
+
+    pool.retry_operation_sync(execute_query)
+
+def run_shard(pool: ydb.SessionPool, shard: int, run_date, started: float) -> Dict[str, Any]:
+    """
+    Queue one shard of today's reminders, resuming after its persisted cursor
 
-def process_user_reminders(user_settings: Dict[str, Any]) -> Dict[str, Any]:
-    """Process automatic reminders for a specific user"""
-    user_id = user_settings['user_id']
-    result = {
-        'user_id': user_id,
-        'processed_count': 0,
-        'successful_sends': 0,
-        'failed_sends': 0,
-        'results': []
+    Users are handled in user_id order and their rendered messages are written
+    to reminder_outbox in bulk; the cursor advances after every flushed chunk,
+    so a timeout or retry continues with the first user not yet queued.
+    Sending is done separately by drain-reminder-outbox.
+    """
+    checkpoint = get_shard_checkpoints(pool, run_date).get(shard) or {
+        'status': 'running',
+        'last_user_id': None,
+        'processed_users': 0,
+        'queued_messages': 0,
+        'failed_messages': 0
     }
+    if checkpoint['status'] == 'completed':
+        logger.info(f"Shard {shard} already completed for {run_date}")
+        return dict(checkpoint, shard=shard, errors=[])
     
-    try:
-        # Initialize WhatsApp service
-        whatsapp_service = WhatsAppService(
-            instance_id=user_settings['green_api_instance_id'],
-            token=user_settings['green_api_token']
-        )
-        
-        # Test connection first
-        connection_ok, connection_error = whatsapp_service.test_connection()
-        if not connection_ok:
-            logger.error(f"WhatsApp connection failed for user {user_id}: {connection_error}")
-            result['error'] = f'WhatsApp connection failed: {connection_error}'
-            return result
-        
-        # Get installments due in 7 days
-        installments_7_days = get_installments_due_in_days(user_id, 7)
-        template_7_days = get_template_by_type(user_settings, '7_days')
-        
-        # Get installments due today
-        installments_today = get_installments_due_in_days(user_id, 0)
-        template_today = get_template_by_type(user_settings, 'due_today')
-        
-        # Process 7-day reminders
-        for installment in installments_7_days:
-            try:
-                reminder_result = send_installment_reminder(
-                    installment=installment,
-                    template=template_7_days,
-                    whatsapp_service=whatsapp_service,
-                    template_type='7_days'
-                )
-                
-                result['processed_count'] += 1
-                if reminder_result['status'] == 'success':
-                    result['successful_sends'] += 1
-                else:
-                    result['failed_sends'] += 1
-                
-                result['results'].append(reminder_result)
-                
-                # Add delay between messages
-                time.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error processing 7-day reminder for installment {installment['installment_id']}: {e}")
-                result['processed_count'] += 1
-                result['failed_sends'] += 1
-                result['results'].append({
-                    'installment_id': installment['installment_id'],
-                    'client_name': installment.get('client_name', 'unknown'),
-                    'template_type': '7_days',
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        # Process due today reminders
-        for installment in installments_today:
+    users = sorted(
+        (user for user in get_all_enabled_users(pool)
+         if shard_for_user(user['user_id']) == shard
+         and (checkpoint['last_user_id'] is None or user['user_id'] > checkpoint['last_user_id'])),
+        key=lambda user: user['user_id']
+    )
+    due_by_user = get_due_reminders(pool, users)
+    
+    logger.info(f"Shard {shard}: queueing reminders for {len(users)} users after cursor {checkpoint['last_user_id']}")
+    
+    errors = []
+    pending_messages = []
+    pending_users = []
+    
+    def flush():
+        checkpoint['queued_messages'] += enqueue_messages(pool, pending_messages)
+        checkpoint['processed_users'] += len(pending_users)
+        checkpoint['last_user_id'] = pending_users[-1]
+        save_shard_checkpoint(pool, run_date, shard, checkpoint)
+        pending_messages.clear()
+        pending_users.clear()
+    
+    finished = True
+    for user_settings in users:
+        if time.monotonic() - started > TIME_BUDGET_SECONDS:
+            finished = False
+            break
+        
+        messages, user_errors = build_messages(user_settings, due_by_user.get(user_settings['user_id'], {}), run_date)
+        pending_messages.extend(messages)
+        pending_users.append(user_settings['user_id'])
+        checkpoint['failed_messages'] += len(user_errors)
+        errors.extend(user_errors)
+        
+        if len(pending_messages) >= ENQUEUE_FLUSH_SIZE:
+            flush()
+    
+    if pending_users:
+        flush()
+    
+    checkpoint['status'] = 'completed' if finished else 'running'
+    save_shard_checkpoint(pool, run_date, shard, checkpoint)
+    
+    logger.info(f"Shard {shard} {checkpoint['status']}: {checkpoint['processed_users']} users, {checkpoint['queued_messages']} messages queued, {checkpoint['failed_messages']} failed to render")
+    return dict(checkpoint, shard=shard, errors=errors)
+
+def fan_out_shards(shards: List[int], token: str) -> Dict[int, Any]:
+    """Invoke this function once per shard in parallel; each invocation processes one shard"""
+    url = f"https://functions.yandexcloud.net/{os.environ['SELF_FUNCTION_ID']}?integration=raw"
+    
+    def invoke(shard):
+        try:
+            response = requests.post(
+                url,
+                json={'shard': shard},
+                headers={'Authorization': f"Bearer {token}"},
+                timeout=SHARD_INVOKE_TIMEOUT_SECONDS
+            )
+            return response.json() if response.status_code == 200 else {'error': f"HTTP {response.status_code}"}
+        except requests.Timeout:
+            # The shard keeps running and checkpoints on its own
+            return {'status': 'running'}
+        except Exception as e:
+            return {'error': str(e)}
+    
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        return dict(zip(shards, executor.map(invoke, shards)))
+
+def get_requested_shard(event) -> Optional[int]:
+    """Shard number from a direct invocation or a timer trigger payload"""
+    if isinstance(event, dict) and event.get('shard') is not None:
+        return int(event['shard'])
+    for message in (event or {}).get('messages', []) if isinstance(event, dict) else []:
+        payload = message.get('details', {}).get('payload')
+        if payload:
             try:
-                reminder_result = send_installment_reminder(
-                    installment=installment,
-                    template=template_today,
-                    whatsapp_service=whatsapp_service,
-                    template_type='due_today'
-                )
-                
-                result['processed_count'] += 1
-                if reminder_result['status'] == 'success':
-                    result['successful_sends'] += 1
-                else:
-                    result['failed_sends'] += 1
-                
-                result['results'].append(reminder_result)
-                
-                # Add delay between messages
-                time.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error processing due today reminder for installment {installment['installment_id']}: {e}")
-                result['processed_count'] += 1
-                result['failed_sends'] += 1
-                result['results'].append({
-                    'installment_id': installment['installment_id'],
-                    'client_name': installment.get('client_name', 'unknown'),
-                    'template_type': 'due_today',
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        logger.info(f"Auto reminders completed for user {user_id}: {result['successful_sends']} successful, {result['failed_sends']} failed")
-        return result
-        
-    except Exception as e:
-        logger.error(f"Failed to process auto reminders for user {user_id}: {e}")
-        result['error'] = str(e)
-        return result
+                shard = json.loads(payload).get('shard')
+            except (ValueError, AttributeError):
+                continue
+            if shard is not None:
+                return int(shard)
+    return None
 
 def handler(event, context):
     """
     Yandex Cloud Function handler for automatic WhatsApp reminders
-    This function is triggered by a timer (cron job) to send automatic reminders
+    
+    Selection stage of the reminder pipeline: due reminders are rendered and
+    written to reminder_outbox; drain-reminder-outbox sends them.
+    
+    Triggered by a timer, the function acts as coordinator: it fans out one
+    invocation per unfinished shard of today's run (users are sharded by a
+    hash of user_id). Invoked with {"shard": N}, it processes that shard and
+    checkpoints its cursor in reminder_run_shards, so repeated timer runs
+    resume unfinished shards and skip completed ones.
     """
+    started = time.monotonic()
     try:
-        logger.info("Starting automatic WhatsApp reminders processing")
-        
-        # Get all users with WhatsApp enabled
-        enabled_users = get_all_enabled_users()
+        run_date = datetime.utcnow().date()
+        shard = get_requested_shard(event)
         
-        if not enabled_users:
-            logger.info("No users with WhatsApp reminders enabled")
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({
-                    'message': 'No users with WhatsApp reminders enabled',
-                    'processed_users': 0,
-                    'total_reminders': 0
-                })
-            }
-        
-        logger.info(f"Processing automatic reminders for {len(enabled_users)} users")
-        
-        # Process reminders for each user
-        total_results = {
-            'processed_users': 0,
-            'total_processed': 0,
-            'total_successful': 0,
-            'total_failed': 0,
-            'user_results': []
-        }
-        
-        for user_settings in enabled_users:
-            try:
-                user_result = process_user_reminders(user_settings)
-                
-                total_results['processed_users'] += 1
-                total_results['total_processed'] += user_result['processed_count']
-                total_results['total_successful'] += user_result['successful_sends']
-                total_results['total_failed'] += user_result['failed_sends']
-                total_results['user_results'].append(user_result)
-                
-                # Add delay between users to avoid rate limiting
-                time.sleep(2)
-                
-            except Exception as e:
-                logger.error(f"Error processing user {user_settings['user_id']}: {e}")
-                total_results['processed_users'] += 1
-                total_results['user_results'].append({
-                    'user_id': user_settings['user_id'],
-                    'error': str(e),
-                    'processed_count': 0,
-                    'successful_sends': 0,
-                    'failed_sends': 0
-                })
+        driver = get_ydb_driver()
+        try:
+            pool = ydb.SessionPool(driver)
+            
+            if shard is not None:
+                if not (0 <= shard < SHARD_COUNT):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': f'Shard must be between 0 and {SHARD_COUNT - 1}'})
+                    }
+                logger.info(f"Starting automatic WhatsApp reminders for shard {shard}")
+                shard_result = run_shard(pool, shard, run_date, started)
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({
+                        'message': f"Shard {shard} {shard_result['status']}",
+                        'shard': shard_result
+                    })
+                }
+            
+            checkpoints = get_shard_checkpoints(pool, run_date)
+            pending_shards = [n for n in range(SHARD_COUNT) if checkpoints.get(n, {}).get('status') != 'completed']
+            
+            if not pending_shards:
+                logger.info(f"All reminder shards completed for {run_date}")
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'message': 'All shards already completed', 'run_date': run_date.isoformat()})
+                }
+            
+            logger.info(f"Starting automatic WhatsApp reminders for shards {pending_shards}")
+            token = (getattr(context, 'token', None) or {}).get('access_token')
+            if os.environ.get('SELF_FUNCTION_ID') and token:
+                shard_results = fan_out_shards(pending_shards, token)
+            else:
+                # No self-invocation configured: process shards in-process within the time budget
+                shard_results = {}
+                for pending_shard in pending_shards:
+                    if time.monotonic() - started > TIME_BUDGET_SECONDS:
+                        break
+                    shard_results[pending_shard] = run_shard(pool, pending_shard, run_date, started)
+        finally:
+            driver.stop()
         
-        logger.info(f"Automatic reminders completed: {total_results['total_successful']} successful, {total_results['total_failed']} failed across {total_results['processed_users']} users")
+        logger.info(f"Automatic reminders run dispatched: {len(shard_results)} of {len(pending_shards)} pending shards")
         
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({
-                'message': 'Automatic reminders processing completed',
-                'summary': {
-                    'processed_users': total_results['processed_users'],
-                    'total_reminders_processed': total_results['total_processed'],
-                    'total_successful_sends': total_results['total_successful'],
-                    'total_failed_sends': total_results['total_failed']
-                },
-                'details': total_results['user_results']
-            })
+                'message': 'Automatic reminders queued',
+                'run_date': run_date.isoformat(),
+                'pending_shards': pending_shards,
+                'shards': {str(n): result for n, result in shard_results.items()}
+            }, default=str)
         }
         
     except Exception as e:
@@ -0,0 +1,79 @@
+import string
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+# Variables a reminder template may reference
+TEMPLATE_VARIABLES = frozenset({
+    'client_name', 'installment_amount', 'due_date',
+    'days_remaining', 'days_overdue', 'product_name', 'total_amount'
+})
+
+# Distinct template texts kept compiled per container (a few per user)
+COMPILED_CACHE_SIZE = 1024
+
+class TemplateError(ValueError):
+    """Template text that cannot be compiled or rendered"""
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__('; '.join(errors))
+
+class CompiledTemplate:
+    """
+    Template parsed once into literal text and variable slots
+
+    render() only joins strings, so rendering many messages never re-parses
+    the format string.
+    """
+
+    __slots__ = ('parts', 'variables')
+
+    def __init__(self, parts: List[Tuple[str, Optional[str]]]):
+        self.parts = parts
+        self.variables = frozenset(field for _, field in parts if field)
+
+    def render(self, variables: Dict[str, Any]) -> str:
+        missing = [name for name in self.variables if name not in variables]
+        if missing:
+            raise TemplateError([f"missing variable '{name}'" for name in sorted(missing)])
+        pieces = []
+        for literal, field in self.parts:
+            pieces.append(literal)
+            if field:
+                value = variables[field]
+                pieces.append(str(value) if value is not None else '')
+        return ''.join(pieces)
+
+def compile_template(template: str) -> CompiledTemplate:
+    """
+    Parse a {variable} template, rejecting anything render() cannot fill
+
+    Raises:
+        TemplateError listing every problem found
+    """
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise TemplateError([f"invalid template syntax: {e}"])
+
+    errors = []
+    parts = []
+    for literal, field, format_spec, conversion in parsed:
+        if field is None:
+            parts.append((literal, None))
+            continue
+        if field == '' or field.isdigit():
+            errors.append('positional placeholders are not allowed, use {variable}')
+        elif field not in TEMPLATE_VARIABLES:
+            errors.append(f"unknown variable '{field}'")
+        elif format_spec or conversion:
+            errors.append(f"formatting is not supported for '{field}'")
+        parts.append((literal, field))
+
+    if errors:
+        raise TemplateError(errors)
+    return CompiledTemplate(parts)
+
+@lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def get_compiled_template(template: str) -> CompiledTemplate:
+    """compile_template() cached by template text across warm invocations"""
+    return compile_template(template)
@@ -1,8 +1,11 @@
 import os
+import json
 import ydb
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
 from datetime import datetime
+from reminder_schedule import parse_schedule
+from instance_health import GREEN_API_INSTANCE_HEALTH_TABLE
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +55,14 @@ class DatabaseManager:
         finally:
             driver.stop()
     
+    def with_pool(self, operation: Callable[[ydb.SessionPool], Any]):
+        """Run operation(pool) on a driver that is stopped afterwards"""
+        driver = self.get_driver()
+        try:
+            return operation(ydb.SessionPool(driver))
+        finally:
+            driver.stop()
+    
     def create_whatsapp_settings_table(self):
         """Create WhatsApp settings table if it doesn't exist"""
         create_table_query = """
@@ -62,6 +73,7 @@ class DatabaseManager:
             reminder_template_7_days Utf8,
             reminder_template_due_today Utf8,
             reminder_template_manual Utf8,
+            reminder_schedule Json,
             is_enabled Bool DEFAULT false,
             created_at Timestamp,
             updated_at Timestamp,
@@ -75,6 +87,24 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Failed to create WhatsApp settings table: {e}")
             raise
+    
+    def add_reminder_schedule_column(self):
+        """Add the reminder_schedule column to a whatsapp_settings table created before it existed"""
+        try:
+            self.execute_query("ALTER TABLE whatsapp_settings ADD COLUMN reminder_schedule Json;")
+            logger.info("reminder_schedule column added to whatsapp_settings")
+        except Exception as e:
+            logger.error(f"Failed to add reminder_schedule column: {e}")
+            raise
+    
+    def create_instance_health_table(self):
+        """Create the shared Green API instance health table"""
+        try:
+            self.execute_query(GREEN_API_INSTANCE_HEALTH_TABLE)
+            logger.info("Green API instance health table created successfully")
+        except Exception as e:
+            logger.error(f"Failed to create Green API instance health table: {e}")
+            raise
 
 class WhatsAppSettingsRepository:
     """Repository for WhatsApp settings operations"""
@@ -93,6 +123,7 @@ class WhatsAppSettingsRepository:
             reminder_template_7_days,
             reminder_template_due_today,
             reminder_template_manual,
+            reminder_schedule,
             is_enabled,
             created_at,
             updated_at
@@ -112,6 +143,7 @@ class WhatsAppSettingsRepository:
                     'reminder_template_7_days': row.reminder_template_7_days,
                     'reminder_template_due_today': row.reminder_template_due_today,
                     'reminder_template_manual': row.reminder_template_manual,
+                    'reminder_schedule': parse_schedule(row.reminder_schedule),
                     'is_enabled': row.is_enabled,
                     'created_at': row.created_at,
                     'updated_at': row.updated_at
@@ -139,6 +171,7 @@ class WhatsAppSettingsRepository:
             DECLARE $reminder_template_7_days AS Utf8?;
             DECLARE $reminder_template_due_today AS Utf8?;
             DECLARE $reminder_template_manual AS Utf8?;
+            DECLARE $reminder_schedule AS Json?;
             DECLARE $is_enabled AS Bool?;
             DECLARE $updated_at AS Timestamp;
             
@@ -148,6 +181,7 @@ class WhatsAppSettingsRepository:
                 reminder_template_7_days = $reminder_template_7_days,
                 reminder_template_due_today = $reminder_template_due_today,
                 reminder_template_manual = $reminder_template_manual,
+                reminder_schedule = COALESCE($reminder_schedule, reminder_schedule),
                 is_enabled = $is_enabled,
                 updated_at = $updated_at
             WHERE user_id = $user_id;
@@ -161,6 +195,7 @@ class WhatsAppSettingsRepository:
             DECLARE $reminder_template_7_days AS Utf8?;
             DECLARE $reminder_template_due_today AS Utf8?;
             DECLARE $reminder_template_manual AS Utf8?;
+            DECLARE $reminder_schedule AS Json?;
             DECLARE $is_enabled AS Bool?;
             DECLARE $created_at AS Timestamp;
             DECLARE $updated_at AS Timestamp;
@@ -168,11 +203,11 @@ class WhatsAppSettingsRepository:
             INSERT INTO whatsapp_settings (
                 user_id, green_api_instance_id, green_api_token,
                 reminder_template_7_days, reminder_template_due_today, reminder_template_manual,
-                is_enabled, created_at, updated_at
+                reminder_schedule, is_enabled, created_at, updated_at
             ) VALUES (
                 $user_id, $green_api_instance_id, $green_api_token,
                 $reminder_template_7_days, $reminder_template_due_today, $reminder_template_manual,
-                $is_enabled, $created_at, $updated_at
+                $reminder_schedule, $is_enabled, $created_at, $updated_at
             );
             """
         
@@ -183,6 +218,8 @@ class WhatsAppSettingsRepository:
             '$reminder_template_7_days': settings.get('reminder_template_7_days'),
             '$reminder_template_due_today': settings.get('reminder_template_due_today'),
             '$reminder_template_manual': settings.get('reminder_template_manual'),
+            # An omitted schedule keeps the saved one
+            '$reminder_schedule': json.dumps(settings['reminder_schedule']) if settings.get('reminder_schedule') else None,
             '$is_enabled': settings.get('is_enabled', False),
             '$updated_at': current_time
         }
@@ -209,6 +246,7 @@ class WhatsAppSettingsRepository:
             reminder_template_7_days,
             reminder_template_due_today,
             reminder_template_manual,
+            reminder_schedule,
             is_enabled
         FROM whatsapp_settings 
         WHERE is_enabled = true
@@ -229,6 +267,7 @@ class WhatsAppSettingsRepository:
                         'reminder_template_7_days': row.reminder_template_7_days,
                         'reminder_template_due_today': row.reminder_template_due_today,
                         'reminder_template_manual': row.reminder_template_manual,
+                        'reminder_schedule': parse_schedule(row.reminder_schedule),
                         'is_enabled': row.is_enabled
                     })
             
@@ -243,6 +282,7 @@ def initialize_whatsapp_database():
     try:
         db = DatabaseManager()
         db.create_whatsapp_settings_table()
+        db.create_instance_health_table()
         logger.info("WhatsApp database initialization completed")
     except Exception as e:
         logger.error(f"WhatsApp database initialization failed: {e}")
@@ -10,6 +10,8 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
 from whatsapp_service import WhatsAppService
 from jwt_auth import JWTAuth
+from database_utils import DatabaseManager
+from instance_health import InstanceHealthCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,10 +26,13 @@ def handler(event, context):
     Request body:
     {
         "green_api_instance_id": "string",
-        "green_api_token": "string"
+        "green_api_token": "string",
+        "force": boolean  // Optional: probe even if a recent result is cached
     }
     
-    Returns connection test results without saving credentials
+    Returns connection test results without saving credentials. A result
+    from the last few minutes (probe or real sends) is reused unless force
+    is set.
     """
     try:
         logger.info(f"WhatsApp connection test request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
@@ -98,7 +103,7 @@ def handler(event, context):
         logger.info(f"Testing WhatsApp connection for user {user_id} with instance {instance_id[:4]}****")
         
         # Perform connection test
-        test_result = perform_connection_test(instance_id, token, user_id)
+        test_result = perform_connection_test(instance_id, token, user_id, force=bool(body.get('force', False)))
         
         return {
             'statusCode': 200,
@@ -117,7 +122,7 @@ def handler(event, context):
             })
         }
 
-def perform_connection_test(instance_id: str, token: str, user_id: str) -> Dict[str, Any]:
+def perform_connection_test(instance_id: str, token: str, user_id: str, force: bool = False) -> Dict[str, Any]:
     """
     Perform comprehensive WhatsApp connection test
     
@@ -125,6 +130,7 @@ def perform_connection_test(instance_id: str, token: str, user_id: str) -> Dict[
         instance_id: Green API instance ID
         token: Green API token
         user_id: User ID for logging
+        force: Probe Green API even if a fresh cached result exists
         
     Returns:
         Detailed connection test results
@@ -135,8 +141,12 @@ def perform_connection_test(instance_id: str, token: str, user_id: str) -> Dict[
         # Initialize WhatsApp service
         whatsapp_service = WhatsAppService(instance_id, token)
         
-        # Perform basic connection test
-        success, error_message = whatsapp_service.test_connection()
+        # Reuse recent instance health, probing getSettings only when needed
+        health, cached = DatabaseManager().with_pool(
+            lambda pool: InstanceHealthCache(pool).check(instance_id, token, whatsapp_service.test_connection, force=force)
+        )
+        success = health['status'] == 'ok'
+        error_message = health['error'] or ''
         
         test_end_time = datetime.utcnow()
         response_time_ms = int((test_end_time - test_start_time).total_seconds() * 1000)
@@ -144,11 +154,14 @@ def perform_connection_test(instance_id: str, token: str, user_id: str) -> Dict[
         result = {
             'success': success,
             'message': error_message if not success else 'Connection successful',
+            'status': health['status'],
+            'cached': cached,
+            'checked_at': health['checked_at'].isoformat(),
             'instance_id': instance_id[:4] + '****' + instance_id[-2:] if len(instance_id) > 6 else '****',
             'tested_at': test_start_time.isoformat(),
             'response_time_ms': response_time_ms,
             'test_details': {
-                'endpoint_reachable': success,
+                'endpoint_reachable': health['status'] != 'unreachable',
                 'credentials_valid': success,
                 'api_responsive': response_time_ms < 10000  # Less than 10 seconds
             }
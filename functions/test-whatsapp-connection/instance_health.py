@@ -0,0 +1,166 @@
+import ydb
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+# How long a health result is trusted; failures expire sooner so a fix is picked up quickly
+HEALTHY_TTL_SECONDS = 300
+UNHEALTHY_TTL_SECONDS = 60
+
+GREEN_API_INSTANCE_HEALTH_TABLE = """
+CREATE TABLE green_api_instance_health (
+    instance_id Utf8 NOT NULL,
+    token_hash Utf8 NOT NULL,
+    status Utf8,
+    error Utf8,
+    source Utf8,
+    checked_at Timestamp,
+    PRIMARY KEY (instance_id, token_hash)
+)
+WITH (TTL = Interval("P1D") ON checked_at);
+"""
+
+# Health statuses: ok | auth_failed (credentials rejected) | unreachable (timeouts, 5xx, connection errors)
+ERROR_STATUSES = {
+    'AUTH_FAILED': 'auth_failed',
+    'TIMEOUT': 'unreachable',
+    'CONNECTION_ERROR': 'unreachable',
+    'HTTP_ERROR': 'unreachable'
+}
+
+HEALTH_ROWS_TYPE = "List<Struct<instance_id: Utf8, token_hash: Utf8, status: Utf8, error: Utf8?, source: Utf8, checked_at: Timestamp>>"
+
+def token_hash(token: str) -> str:
+    """Health is tracked per credential pair without storing the token"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]
+
+def status_for_error(error_code: Optional[str]) -> Optional[str]:
+    """Instance health implied by a send error; None for message-level errors (bad phone, etc.)"""
+    return ERROR_STATUSES.get(error_code)
+
+def is_fresh(record: Dict[str, Any]) -> bool:
+    ttl = HEALTHY_TTL_SECONDS if record['status'] == 'ok' else UNHEALTHY_TTL_SECONDS
+    return datetime.utcnow() - record['checked_at'] < timedelta(seconds=ttl)
+
+# Per-container copy of recent results, shared by warm invocations
+_local_health = {}
+_local_health_lock = threading.Lock()
+
+class InstanceHealthCache:
+    """
+    Green API instance health shared through green_api_instance_health
+
+    Results come from explicit getSettings probes and, passively, from the
+    outcome of real sends, so reminder batches need no probe of their own.
+    """
+
+    def __init__(self, pool: ydb.SessionPool):
+        self.pool = pool
+
+    def lookup(self, credentials: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """Fresh health records for (instance_id, token) pairs, keyed by the same pairs"""
+        keys = {(instance_id, token_hash(token)): (instance_id, token) for instance_id, token in credentials}
+        found = {}
+        with _local_health_lock:
+            for key, pair in keys.items():
+                record = _local_health.get(key)
+                if record and is_fresh(record):
+                    found[pair] = record
+
+        missing = [key for key, pair in keys.items() if pair not in found]
+        if missing:
+            def execute_query(session):
+                query = """
+                    DECLARE $keys AS List<Struct<instance_id: Utf8, token_hash: Utf8>>;
+                    SELECT h.instance_id AS instance_id, h.token_hash AS token_hash, h.status AS status,
+                           h.error AS error, h.source AS source, h.checked_at AS checked_at
+                    FROM AS_TABLE($keys) AS k
+                    INNER JOIN green_api_instance_health AS h
+                    ON h.instance_id = k.instance_id AND h.token_hash = k.token_hash;
+                """
+                return session.transaction(ydb.OnlineReadOnly()).execute(
+                    session.prepare(query),
+                    {'$keys': [{'instance_id': instance_id, 'token_hash': hashed} for instance_id, hashed in missing]},
+                    commit_tx=True
+                )
+
+            result_sets = self.pool.retry_operation_sync(execute_query)
+            for row in result_sets[0].rows:
+                checked_at = row.checked_at
+                if isinstance(checked_at, int):
+                    checked_at = datetime.utcfromtimestamp(checked_at / 1000000)
+                record = {'status': row.status, 'error': row.error, 'source': row.source, 'checked_at': checked_at}
+                key = (row.instance_id, row.token_hash)
+                with _local_health_lock:
+                    _local_health[key] = record
+                if is_fresh(record):
+                    found[keys[key]] = record
+        return found
+
+    def record(self, results: List[Dict[str, Any]]):
+        """Store {instance_id, token, status, error, source} results in one statement"""
+        if not results:
+            return
+        now = datetime.utcnow()
+        rows = [
+            {
+                'instance_id': r['instance_id'],
+                'token_hash': token_hash(r['token']),
+                'status': r['status'],
+                'error': r.get('error'),
+                'source': r['source'],
+                'checked_at': now
+            }
+            for r in results
+        ]
+        with _local_health_lock:
+            for row in rows:
+                _local_health[(row['instance_id'], row['token_hash'])] = {
+                    'status': row['status'], 'error': row['error'], 'source': row['source'], 'checked_at': now
+                }
+
+        def execute_query(session):
+            query = f"""
+                DECLARE $rows AS {HEALTH_ROWS_TYPE};
+                UPSERT INTO green_api_instance_health SELECT * FROM AS_TABLE($rows);
+            """
+            session.transaction(ydb.SerializableReadWrite()).execute(
+                session.prepare(query),
+                {'$rows': rows},
+                commit_tx=True
+            )
+
+        try:
+            self.pool.retry_operation_sync(execute_query)
+        except Exception as e:
+            # Health is advisory; a failed write only costs a later probe
+            logger.warning(f"Could not store Green API instance health: {e}")
+
+    def check(self, instance_id: str, token: str, probe: Callable[[], Tuple[bool, Optional[str], Optional[str]]],
+              force: bool = False) -> Tuple[Dict[str, Any], bool]:
+        """
+        Health of one instance, probing only if nothing fresh is cached (or force is set)
+
+        probe() returns (success, error_message, error_code), like
+        GreenAPIClient.test_connection(); error_code is classified through
+        ERROR_STATUSES, the same mapping used for send errors.
+
+        Returns:
+            Tuple of (record, cached)
+        """
+        if not force:
+            cached = self.lookup([(instance_id, token)]).get((instance_id, token))
+            if cached:
+                return cached, True
+
+        success, error_message, error_code = probe()
+        if success:
+            status = 'ok'
+        else:
+            status = status_for_error(error_code) or 'unreachable'
+        self.record([{'instance_id': instance_id, 'token': token, 'status': status, 'error': error_message, 'source': 'probe'}])
+        return {'status': status, 'error': error_message, 'source': 'probe', 'checked_at': datetime.utcnow()}, False
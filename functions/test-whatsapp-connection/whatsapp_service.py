@@ -1,11 +1,14 @@
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
+import threading
 import logging
 import time
 import re
 from typing import Dict, Any, Optional, List, Tuple
 from datetime import datetime, timedelta
+from message_templates import TemplateError, get_compiled_template
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +20,25 @@ class WhatsAppError(Exception):
         self.retryable = retryable
         super().__init__(self.message)
 
+# Green API HTTP settings: (connect, read) timeouts in seconds and keep-alive pool size
+GREEN_API_TIMEOUT = (5, 20)
+GREEN_API_POOL_SIZE = 10
+
+# One keep-alive session per container, reused across warm invocations
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """Shared pooled session so messages reuse the TLS connection to api.green-api.com"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GREEN_API_POOL_SIZE, max_retries=0)
+            session.mount('https://', adapter)
+            _http_session = session
+        return _http_session
+
 class GreenAPIClient:
     """Green API client for WhatsApp messaging"""
     
@@ -24,8 +46,7 @@ class GreenAPIClient:
         self.instance_id = instance_id
         self.token = token
         self.base_url = f"https://api.green-api.com/waInstance{instance_id}"
-        self.session = requests.Session()
-        self.session.timeout = 30
+        self.session = get_http_session()
         
     def send_message(self, phone_number: str, message: str) -> Dict[str, Any]:
         """
@@ -54,7 +75,7 @@ class GreenAPIClient:
             
             logger.info(f"Sending WhatsApp message to {formatted_phone[:5]}****")
             
-            response = self.session.post(url, json=payload)
+            response = self.session.post(url, json=payload, timeout=GREEN_API_TIMEOUT)
             
             if response.status_code == 200:
                 result = response.json()
@@ -107,26 +128,30 @@ class GreenAPIClient:
                 retryable=False
             )
     
-    def test_connection(self) -> Tuple[bool, Optional[str]]:
+    def test_connection(self) -> Tuple[bool, Optional[str], Optional[str]]:
         """
         Test Green API connection and credentials
         
         Returns:
-            Tuple of (success, error_message)
+            Tuple of (success, error_message, error_code); error_code is a
+            WhatsAppError code (AUTH_FAILED, HTTP_ERROR, TIMEOUT,
+            CONNECTION_ERROR) or None on success
         """
         try:
             url = f"{self.base_url}/getSettings/{self.token}"
-            response = self.session.get(url)
+            response = self.session.get(url, timeout=GREEN_API_TIMEOUT)
             
             if response.status_code == 200:
-                return True, None
+                return True, None, None
             elif response.status_code == 401:
-                return False, "Invalid credentials"
+                return False, "Invalid credentials", "AUTH_FAILED"
             else:
-                return False, f"Connection test failed: {response.status_code}"
+                return False, f"Connection test failed: {response.status_code}", "HTTP_ERROR"
                 
+        except requests.exceptions.Timeout:
+            return False, "Connection error: request timeout", "TIMEOUT"
         except Exception as e:
-            return False, f"Connection error: {str(e)}"
+            return False, f"Connection error: {str(e)}", "CONNECTION_ERROR"
     
     def _format_phone_number(self, phone_number: str) -> str:
         """
@@ -165,7 +190,8 @@ class MessageTemplateProcessor:
     DEFAULT_TEMPLATES = {
         'reminder_7_days': "Здравствуйте, {client_name}! Напоминаем, что ваш платеж по рассрочке в размере {installment_amount} руб. за {product_name} должен быть внесен через {days_remaining} дней ({due_date}). Пожалуйста, подготовьте средства для оплаты.",
         'reminder_due_today': "Здравствуйте, {client_name}! Ваш платеж по рассрочке в размере {installment_amount} руб. за {product_name} должен быть внесен сегодня ({due_date}). Пожалуйста, произведите оплату.",
-        'reminder_manual': "Здравствуйте, {client_name}! Напоминаем о вашем платеже по рассрочке в размере {installment_amount} руб. за {product_name}. Дата платежа: {due_date}."
+        'reminder_manual': "Здравствуйте, {client_name}! Напоминаем о вашем платеже по рассрочке в размере {installment_amount} руб. за {product_name}. Дата платежа: {due_date}.",
+        'reminder_overdue': "Здравствуйте, {client_name}! Ваш платеж по рассрочке в размере {installment_amount} руб. за {product_name} просрочен на {days_overdue} дн. (срок оплаты {due_date}). Пожалуйста, произведите оплату как можно скорее."
     }
     
     @staticmethod
@@ -181,23 +207,10 @@ class MessageTemplateProcessor:
             Processed message string
         """
         try:
-            # Ensure all variables are strings
-            str_variables = {k: str(v) if v is not None else '' for k, v in variables.items()}
-            
-            # Replace variables in template
-            processed = template.format(**str_variables)
+            # Compiled once per template text; rendering does not re-parse it
+            return get_compiled_template(template).render(variables)
             
-            logger.debug(f"Template processed successfully")
-            return processed
-            
-        except KeyError as e:
-            logger.error(f"Missing template variable: {e}")
-            raise WhatsAppError(
-                f"Template processing failed: missing variable {e}",
-                error_code="TEMPLATE_ERROR",
-                retryable=False
-            )
-        except Exception as e:
+        except TemplateError as e:
             logger.error(f"Template processing error: {e}")
             raise WhatsAppError(
                 f"Template processing failed: {str(e)}",
@@ -214,31 +227,15 @@ class MessageTemplateProcessor:
             template: Template string to validate
             
         Returns:
-            Tuple of (is_valid, list_of_variables)
+            Tuple of (is_valid, list_of_variables or list_of_errors)
         """
         try:
-            # Extract variables from template
-            import string
-            formatter = string.Formatter()
-            variables = [field_name for _, field_name, _, _ in formatter.parse(template) if field_name]
-            
-            # Check for valid variable names
-            valid_variables = {
-                'client_name', 'installment_amount', 'due_date', 
-                'days_remaining', 'product_name', 'total_amount'
-            }
-            
-            invalid_vars = [var for var in variables if var not in valid_variables]
-            
-            if invalid_vars:
-                logger.warning(f"Invalid template variables: {invalid_vars}")
-                return False, invalid_vars
-            
-            return True, variables
-            
-        except Exception as e:
-            logger.error(f"Template validation error: {e}")
-            return False, [str(e)]
+            compiled = get_compiled_template(template)
+        except TemplateError as e:
+            logger.warning(f"Invalid template: {e}")
+            return False, e.errors
+        
+        return True, sorted(compiled.variables)
 
 class WhatsAppService:
     """Main WhatsApp service class"""
@@ -298,7 +295,7 @@ class WhatsAppService:
             result['error'] = str(e)
             return result
     
-    def test_connection(self) -> Tuple[bool, Optional[str]]:
+    def test_connection(self) -> Tuple[bool, Optional[str], Optional[str]]:
         """Test Green API connection"""
         return self.client.test_connection()
 
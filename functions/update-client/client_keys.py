@@ -0,0 +1,245 @@
+import re
+import ydb
+import logging
+from typing import Dict, List, Optional
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Marker in search_index_state for users whose keys were backfilled
+KEYS_STATE_ENTITY = 'client_keys'
+
+# Rows written per statement while backfilling a user's keys
+BACKFILL_CHUNK_SIZE = 500
+
+# Clients read and backfilled per transaction
+BACKFILL_PAGE_SIZE = 200
+
+# Key rows read per page by unlimited lookups (YDB truncates larger result sets)
+LOOKUP_PAGE_SIZE = 1000
+
+CLIENT_LOOKUP_KEYS_TABLE = """
+CREATE TABLE client_lookup_keys (
+    user_id Utf8 NOT NULL,
+    key_type Utf8 NOT NULL,
+    key_value Utf8 NOT NULL,
+    client_id Utf8 NOT NULL,
+    PRIMARY KEY (user_id, key_type, key_value, client_id)
+);
+"""
+
+CLIENTS_NORMALIZED_COLUMNS = """
+ALTER TABLE clients
+    ADD COLUMN phone_normalized Utf8,
+    ADD COLUMN passport_normalized Utf8;
+"""
+
+KEY_ROWS_TYPE = "List<Struct<user_id: Utf8, key_type: Utf8, key_value: Utf8, client_id: Utf8>>"
+
+def create_client_keys_schema(pool: ydb.SessionPool):
+    """
+    Create client_lookup_keys and add the normalized key columns to clients (run once)
+
+    The backfill marker lives in search_index_state, created by
+    search_index.create_search_index_tables.
+    """
+    for ddl in (CLIENT_LOOKUP_KEYS_TABLE, CLIENTS_NORMALIZED_COLUMNS):
+        pool.retry_operation_sync(lambda session, ddl=ddl: session.execute_scheme(ddl))
+
+def normalize_phone(phone_number: Optional[str]) -> Optional[str]:
+    """
+    Digits-only phone key in the form Green API expects
+
+    Russian numbers written with a leading 8 are stored with 7: "8 (999) 123-45-67" -> "79991234567".
+    """
+    if not phone_number:
+        return None
+    digits_only = re.sub(r'\D', '', phone_number)
+    if digits_only.startswith('8') and len(digits_only) == 11:
+        return '7' + digits_only[1:]
+    return digits_only or None
+
+def normalize_passport(passport_number: Optional[str]) -> Optional[str]:
+    """Upper-cased passport key without whitespace: "45 06 123456" -> "4506123456" """
+    if not passport_number:
+        return None
+    return re.sub(r'\s', '', passport_number).upper() or None
+
+def client_keys(contact_number: Optional[str], passport_number: Optional[str]) -> Dict[str, Optional[str]]:
+    """Normalized keys for a client's phone and passport"""
+    return {
+        'phone': normalize_phone(contact_number),
+        'passport': normalize_passport(passport_number)
+    }
+
+class ClientKeyIndex:
+    """Maintains client_lookup_keys rows inside the caller's transaction"""
+
+    def __init__(self, session, tx, user_id: str):
+        self.session = session
+        self.tx = tx
+        self.user_id = user_id
+
+    def add(self, client_id: str, keys: Dict[str, Optional[str]]):
+        self.upsert_rows(self.key_rows(client_id, keys))
+
+    def remove(self, client_id: str, keys: Dict[str, Optional[str]]):
+        self.delete_rows(self.key_rows(client_id, keys))
+
+    def replace(self, client_id: str, old_keys: Dict[str, Optional[str]], new_keys: Dict[str, Optional[str]]):
+        changed = [key_type for key_type in new_keys if old_keys.get(key_type) != new_keys[key_type]]
+        self.delete_rows(self.key_rows(client_id, {key_type: old_keys.get(key_type) for key_type in changed}))
+        self.upsert_rows(self.key_rows(client_id, {key_type: new_keys[key_type] for key_type in changed}))
+
+    def key_rows(self, client_id: str, keys: Dict[str, Optional[str]]) -> List[Dict[str, str]]:
+        return [
+            {'user_id': self.user_id, 'key_type': key_type, 'key_value': key_value, 'client_id': client_id}
+            for key_type, key_value in keys.items() if key_value
+        ]
+
+    def upsert_rows(self, rows: List[Dict[str, str]]):
+        if not rows:
+            return
+        query = f"""
+        DECLARE $rows AS {KEY_ROWS_TYPE};
+        UPSERT INTO client_lookup_keys SELECT * FROM AS_TABLE($rows);
+        """
+        self.tx.execute(self.session.prepare(query), {'$rows': rows})
+
+    def delete_rows(self, rows: List[Dict[str, str]]):
+        if not rows:
+            return
+        query = f"""
+        DECLARE $rows AS {KEY_ROWS_TYPE};
+        DELETE FROM client_lookup_keys ON SELECT * FROM AS_TABLE($rows);
+        """
+        self.tx.execute(self.session.prepare(query), {'$rows': rows})
+
+def ensure_keys_built(session, user_id: str):
+    """Backfill normalized columns and lookup keys once for clients created before they existed"""
+    state_query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $entity_type AS Utf8;
+    SELECT built_at FROM search_index_state WHERE user_id = $user_id AND entity_type = $entity_type;
+    """
+    result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
+        session.prepare(state_query),
+        {'$user_id': user_id, '$entity_type': KEYS_STATE_ENTITY},
+        commit_tx=True
+    )
+    if result_sets[0].rows:
+        return
+
+    # Each page of clients is backfilled in its own transaction; the state row is
+    # written only after the last page, so an interrupted backfill runs again
+    rows_query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $after AS Utf8;
+    DECLARE $limit AS Uint64;
+    SELECT id, contact_number, passport_number FROM clients
+    WHERE user_id = $user_id AND id > $after
+    ORDER BY id
+    LIMIT $limit;
+    """
+    columns_query = """
+    DECLARE $rows AS List<Struct<id: Utf8, phone_normalized: Utf8?, passport_normalized: Utf8?>>;
+    UPDATE clients ON SELECT * FROM AS_TABLE($rows);
+    """
+    clients = 0
+    after = ''
+    while True:
+        tx = session.transaction(ydb.SerializableReadWrite())
+        client_rows = tx.execute(
+            session.prepare(rows_query),
+            {'$user_id': user_id, '$after': after, '$limit': BACKFILL_PAGE_SIZE}
+        )[0].rows
+
+        index = ClientKeyIndex(session, tx, user_id)
+        key_rows = []
+        column_rows = []
+        for row in client_rows:
+            keys = client_keys(row.contact_number, row.passport_number)
+            key_rows.extend(index.key_rows(row.id, keys))
+            column_rows.append({'id': row.id, 'phone_normalized': keys['phone'], 'passport_normalized': keys['passport']})
+
+        if column_rows:
+            tx.execute(session.prepare(columns_query), {'$rows': column_rows})
+        for start in range(0, len(key_rows), BACKFILL_CHUNK_SIZE):
+            index.upsert_rows(key_rows[start:start + BACKFILL_CHUNK_SIZE])
+        tx.commit()
+
+        clients += len(client_rows)
+        if len(client_rows) < BACKFILL_PAGE_SIZE:
+            break
+        after = client_rows[-1].id
+
+    mark_query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $entity_type AS Utf8;
+    DECLARE $built_at AS Timestamp;
+    UPSERT INTO search_index_state (user_id, entity_type, built_at) VALUES ($user_id, $entity_type, $built_at);
+    """
+    session.transaction(ydb.SerializableReadWrite()).execute(
+        session.prepare(mark_query),
+        {'$user_id': user_id, '$entity_type': KEYS_STATE_ENTITY, '$built_at': datetime.utcnow()},
+        commit_tx=True
+    )
+    logger.info(f"Backfilled lookup keys for {clients} clients")
+
+def lookup_clients(session, user_id: str, key_type: str, key_value: Optional[str], prefix: bool = False, limit: Optional[int] = 100) -> List[str]:
+    """
+    Client IDs with an exact (point read) or prefix (range read) key match
+
+    limit=None reads every match in pages of LOOKUP_PAGE_SIZE.
+    """
+    if not key_value:
+        return []
+
+    if prefix:
+        key_clause = "key_value >= $from AND key_value < $to"
+        declares = "DECLARE $from AS Utf8; DECLARE $to AS Utf8;"
+        params = {'$from': key_value, '$to': key_value + '\U0010ffff'}
+    else:
+        key_clause = "key_value = $key_value"
+        declares = "DECLARE $key_value AS Utf8;"
+        params = {'$key_value': key_value}
+
+    query = f"""
+    DECLARE $user_id AS Utf8;
+    DECLARE $key_type AS Utf8;
+    DECLARE $limit AS Uint64;
+    {declares}
+    SELECT key_value, client_id FROM client_lookup_keys
+    WHERE user_id = $user_id AND key_type = $key_type AND {key_clause}
+    ORDER BY key_value, client_id
+    LIMIT $limit;
+    """
+    next_page = f"""
+    DECLARE $user_id AS Utf8;
+    DECLARE $key_type AS Utf8;
+    DECLARE $limit AS Uint64;
+    DECLARE $after_key_value AS Utf8;
+    DECLARE $after_client_id AS Utf8;
+    {declares}
+    SELECT key_value, client_id FROM client_lookup_keys
+    WHERE user_id = $user_id AND key_type = $key_type AND {key_clause}
+    AND (key_value > $after_key_value OR (key_value = $after_key_value AND client_id > $after_client_id))
+    ORDER BY key_value, client_id
+    LIMIT $limit;
+    """
+
+    page_size = limit if limit is not None else LOOKUP_PAGE_SIZE
+    params.update({'$user_id': user_id, '$key_type': key_type, '$limit': page_size})
+    client_ids = []
+    while True:
+        rows = session.transaction(ydb.OnlineReadOnly()).execute(
+            session.prepare(query),
+            params,
+            commit_tx=True
+        )[0].rows
+        client_ids.extend(row.client_id for row in rows)
+        if limit is not None or len(rows) < page_size:
+            return client_ids
+        query = next_page
+        params['$after_key_value'] = rows[-1].key_value
+        params['$after_client_id'] = rows[-1].client_id
@@ -5,9 +5,12 @@ import re
 import hmac
 import jwt
 import logging
+import uuid
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 from decimal import Decimal
+from search_index import SearchIndex
+from client_keys import ClientKeyIndex, normalize_phone, normalize_passport
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -222,7 +225,7 @@ def handler(event, context):
                 check_query = """
                 DECLARE $client_id AS Utf8;
                 DECLARE $user_id AS Utf8;
-                SELECT id FROM clients WHERE id = $client_id AND user_id = $user_id;
+                SELECT id, full_name, contact_number, passport_number FROM clients WHERE id = $client_id AND user_id = $user_id;
                 """
                 prepared_check = session.prepare(check_query)
                 result_sets = session.transaction().execute(
@@ -232,6 +235,7 @@ def handler(event, context):
                 )
                 if not result_sets[0].rows:
                     return {'statusCode': 404, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Client not found'})}
+                existing = result_sets[0].rows[0]
 
                 # Build UPDATE query for the provided field(s)
                 if not sanitized_data:
@@ -241,7 +245,9 @@ def handler(event, context):
                 current_time = datetime.utcnow()
                 
                 if 'full_name' in sanitized_data:
-                    # Use a single transaction to update both client and related installments
+                    # Update the client and record the rename in the outbox atomically.
+                    # Denormalized installments.client_name is rewritten later by the
+                    # propagate-name-changes worker in bounded batches.
                     tx = session.transaction(ydb.SerializableReadWrite())
                     
                     # Update client name
@@ -262,65 +268,100 @@ def handler(event, context):
                         }
                     )
                     
-                    # Update client_name in all related installments
-                    update_installments_query = """
-                    DECLARE $client_id AS Utf8;
-                    DECLARE $client_name AS Utf8;
-                    DECLARE $updated_at AS Timestamp;
-                    UPDATE installments 
-                    SET client_name = $client_name, updated_at = $updated_at 
-                    WHERE client_id = $client_id;
+                    # Queue propagation of the new name to related installments
+                    outbox_query = """
+                    DECLARE $id AS Utf8;
+                    DECLARE $user_id AS Utf8;
+                    DECLARE $entity_id AS Utf8;
+                    DECLARE $new_name AS Utf8;
+                    DECLARE $created_at AS Timestamp;
+                    INSERT INTO name_change_outbox (id, user_id, entity_type, entity_id, new_name, status, created_at)
+                    VALUES ($id, $user_id, 'client', $entity_id, $new_name, 'pending', $created_at);
                     """
                     tx.execute(
-                        session.prepare(update_installments_query),
+                        session.prepare(outbox_query),
                         {
-                            '$client_id': sanitized_id,
-                            '$client_name': sanitized_data['full_name'],
-                            '$updated_at': current_time
+                            '$id': str(uuid.uuid4()),
+                            '$user_id': user_id,
+                            '$entity_id': sanitized_id,
+                            '$new_name': sanitized_data['full_name'],
+                            '$created_at': current_time
                         }
                     )
                     
+                    SearchIndex(session, tx, user_id, 'client').replace(
+                        sanitized_id,
+                        {'full_name': existing.full_name},
+                        {'full_name': sanitized_data['full_name']}
+                    )
+                    
                     tx.commit()
                 
                 if 'contact_number' in sanitized_data:
                     update_query = """
                     DECLARE $client_id AS Utf8;
                     DECLARE $contact_number AS Utf8;
+                    DECLARE $phone_normalized AS Utf8?;
                     DECLARE $updated_at AS Timestamp;
                     UPDATE clients 
-                    SET contact_number = $contact_number, updated_at = $updated_at 
+                    SET contact_number = $contact_number, phone_normalized = $phone_normalized, updated_at = $updated_at 
                     WHERE id = $client_id;
                     """
-                    prepared_update = session.prepare(update_query)
-                    session.transaction().execute(
-                        prepared_update,
+                    phone_normalized = normalize_phone(sanitized_data['contact_number'])
+                    tx = session.transaction(ydb.SerializableReadWrite())
+                    tx.execute(
+                        session.prepare(update_query),
                         {
                             '$client_id': sanitized_id,
                             '$contact_number': sanitized_data['contact_number'],
+                            '$phone_normalized': phone_normalized,
                             '$updated_at': current_time
-                        },
-                        commit_tx=True
+                        }
+                    )
+                    SearchIndex(session, tx, user_id, 'client').replace(
+                        sanitized_id,
+                        {'contact_number': existing.contact_number},
+                        {'contact_number': sanitized_data['contact_number']}
                     )
+                    ClientKeyIndex(session, tx, user_id).replace(
+                        sanitized_id,
+                        {'phone': normalize_phone(existing.contact_number)},
+                        {'phone': phone_normalized}
+                    )
+                    tx.commit()
                 
                 if 'passport_number' in sanitized_data:
                     update_query = """
                     DECLARE $client_id AS Utf8;
                     DECLARE $passport_number AS Utf8;
+                    DECLARE $passport_normalized AS Utf8?;
                     DECLARE $updated_at AS Timestamp;
                     UPDATE clients 
-                    SET passport_number = $passport_number, updated_at = $updated_at 
+                    SET passport_number = $passport_number, passport_normalized = $passport_normalized, updated_at = $updated_at 
                     WHERE id = $client_id;
                     """
-                    prepared_update = session.prepare(update_query)
-                    session.transaction().execute(
-                        prepared_update,
+                    passport_normalized = normalize_passport(sanitized_data['passport_number'])
+                    tx = session.transaction(ydb.SerializableReadWrite())
+                    tx.execute(
+                        session.prepare(update_query),
                         {
                             '$client_id': sanitized_id,
                             '$passport_number': sanitized_data['passport_number'],
+                            '$passport_normalized': passport_normalized,
                             '$updated_at': current_time
-                        },
-                        commit_tx=True
+                        }
+                    )
+                    SearchIndex(session, tx, user_id, 'client').replace(
+                        sanitized_id,
+                        {'passport_number': existing.passport_number},
+                        {'passport_number': sanitized_data['passport_number']}
                     )
+                    ClientKeyIndex(session, tx, user_id).replace(
+                        sanitized_id,
+                        {'passport': normalize_passport(existing.passport_number)},
+                        {'passport': passport_normalized}
+                    )
+                    tx.commit()
                 
                 if 'address' in sanitized_data:
                     update_query = """
@@ -423,7 +464,10 @@ def handler(event, context):
                     )
                 
                 logger.info(f"Client updated successfully: {sanitized_id}")
-                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Client updated successfully'})}
+                response_body = {'message': 'Client updated successfully'}
+                if 'full_name' in sanitized_data:
+                    response_body['name_propagation'] = 'pending'
+                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(response_body)}
 
             result = pool.retry_operation_sync(update_client_in_db)
             driver.stop()
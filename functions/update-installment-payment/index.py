@@ -6,6 +6,7 @@ import logging
 from typing import Union, Optional, Tuple
 from decimal import Decimal
 from datetime import datetime, date
+from idempotency import idempotent, authenticated_user_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -82,6 +83,14 @@ class JWTAuth:
             logger.error(f"Unexpected authentication error: {e}")
             return None, "Authentication error"
 
+RESPONSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+}
+
+@idempotent('update-installment-payment', lambda event: JWTAuth.authenticate_request(event)[0], headers=RESPONSE_HEADERS)
 def handler(event, context):
     try:
         logger.info(f"Handler started. Event keys: {list(event.keys())}")
@@ -89,7 +98,10 @@ def handler(event, context):
         logger.info(f"Received update payment request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
         
         # Authentication
-        user_id, auth_error = JWTAuth.authenticate_request(event)
+        # idempotent() has already authenticated requests carrying an Idempotency-Key
+        user_id, auth_error = authenticated_user_id(event), None
+        if not user_id:
+            user_id, auth_error = JWTAuth.authenticate_request(event)
         if not user_id:
             logger.warning(f"Authentication failed: {auth_error}")
             return {'statusCode': 401, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': f'Unauthorized: {auth_error}'})}
@@ -475,12 +487,7 @@ WHERE id = $installment_id;
         logger.info(f"Updated installment payment: {payment_id}")
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-            },
+            'headers': RESPONSE_HEADERS,
             'body': json.dumps({
                 'message': 'Installment payment updated successfully',
                 'installment': installment_data
@@ -491,11 +498,6 @@ WHERE id = $installment_id;
         logger.error(f"Unexpected error: {str(e)}")
         return {
             'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-            },
+            'headers': RESPONSE_HEADERS,
             'body': json.dumps({'error': 'Internal server error'})
         } 
\ No newline at end of file
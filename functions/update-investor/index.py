@@ -5,9 +5,11 @@ import re
 
 import jwt
 import logging
+import uuid
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 from decimal import Decimal
+from search_index import SearchIndex
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -204,7 +206,7 @@ def handler(event, context):
                 # First, check if the investor exists (using same pattern as get-investor)
                 check_query = """
                 DECLARE $investor_id AS Utf8;
-                SELECT id FROM investors WHERE id = $investor_id;
+                SELECT id, full_name FROM investors WHERE id = $investor_id;
                 """
                 prepared_check = session.prepare(check_query)
                 result_sets = session.transaction().execute(
@@ -214,6 +216,7 @@ def handler(event, context):
                 )
                 if not result_sets[0].rows:
                     return {'statusCode': 404, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'error': 'Investor not found'})}
+                existing = result_sets[0].rows[0]
 
                 # Build a simple UPDATE query for the provided field(s)
                 if not sanitized_data:
@@ -224,7 +227,9 @@ def handler(event, context):
                 
                 # Handle full_name update
                 if 'full_name' in sanitized_data:
-                    # Use a single transaction to update both investor and related installments
+                    # Update the investor and record the rename in the outbox atomically.
+                    # Denormalized installments.investor_name is rewritten later by the
+                    # propagate-name-changes worker in bounded batches.
                     tx = session.transaction(ydb.SerializableReadWrite())
                     
                     # Update investor name
@@ -245,24 +250,33 @@ def handler(event, context):
                         }
                     )
                     
-                    # Update investor_name in all related installments
-                    update_installments_query = """
-                    DECLARE $investor_id AS Utf8;
-                    DECLARE $investor_name AS Utf8;
-                    DECLARE $updated_at AS Timestamp;
-                    UPDATE installments 
-                    SET investor_name = $investor_name, updated_at = $updated_at 
-                    WHERE investor_id = $investor_id;
+                    # Queue propagation of the new name to related installments
+                    outbox_query = """
+                    DECLARE $id AS Utf8;
+                    DECLARE $user_id AS Utf8;
+                    DECLARE $entity_id AS Utf8;
+                    DECLARE $new_name AS Utf8;
+                    DECLARE $created_at AS Timestamp;
+                    INSERT INTO name_change_outbox (id, user_id, entity_type, entity_id, new_name, status, created_at)
+                    VALUES ($id, $user_id, 'investor', $entity_id, $new_name, 'pending', $created_at);
                     """
                     tx.execute(
-                        session.prepare(update_installments_query),
+                        session.prepare(outbox_query),
                         {
-                            '$investor_id': sanitized_id,
-                            '$investor_name': sanitized_data['full_name'],
-                            '$updated_at': current_time
+                            '$id': str(uuid.uuid4()),
+                            '$user_id': user_id,
+                            '$entity_id': sanitized_id,
+                            '$new_name': sanitized_data['full_name'],
+                            '$created_at': current_time
                         }
                     )
                     
+                    SearchIndex(session, tx, user_id, 'investor').replace(
+                        sanitized_id,
+                        {'full_name': existing.full_name},
+                        {'full_name': sanitized_data['full_name']}
+                    )
+                    
                     tx.commit()
                 
                 # Handle investment_amount update
@@ -332,7 +346,10 @@ def handler(event, context):
                     )
 
                 logger.info(f"Investor updated successfully: {sanitized_id}")
-                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps({'message': 'Investor updated successfully'})}
+                response_body = {'message': 'Investor updated successfully'}
+                if 'full_name' in sanitized_data:
+                    response_body['name_propagation'] = 'pending'
+                return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': json.dumps(response_body)}
 
             return pool.retry_operation_sync(update_investor_in_db)
             
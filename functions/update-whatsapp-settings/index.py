@@ -7,9 +7,11 @@ from typing import Dict, Any, List, Tuple
 # Add shared modules to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'shared'))
 
-from database_utils import WhatsAppSettingsRepository
+from database_utils import DatabaseManager, WhatsAppSettingsRepository
 from jwt_auth import JWTAuth
 from whatsapp_service import WhatsAppService, MessageTemplateProcessor
+from reminder_schedule import validate_schedule
+from instance_health import InstanceHealthCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +30,7 @@ def handler(event, context):
         "reminder_template_7_days": "string",
         "reminder_template_due_today": "string",
         "reminder_template_manual": "string",
+        "reminder_schedule": [{"days_before_due": int, "template": "string" | null}],  // Optional; negative = overdue
         "is_enabled": boolean,
         "test_connection": boolean  // Optional: test connection after update
     }
@@ -251,6 +254,14 @@ def validate_and_sanitize_settings(data: Dict[str, Any]) -> Tuple[Dict[str, Any]
             if not template_valid:
                 errors.extend([f'{template_field}: {error}' for error in template_errors])
     
+    # Validate the reminder schedule if provided
+    if data.get('reminder_schedule') is not None:
+        schedule, schedule_errors = validate_schedule(data['reminder_schedule'])
+        if schedule_errors:
+            errors.extend(schedule_errors)
+        else:
+            sanitized['reminder_schedule'] = schedule
+    
     # Business logic validation
     if sanitized.get('is_enabled'):
         if not sanitized.get('green_api_instance_id') or not sanitized.get('green_api_token'):
@@ -271,12 +282,19 @@ def test_whatsapp_connection(instance_id: str, token: str) -> Dict[str, Any]:
     """
     try:
         whatsapp_service = WhatsAppService(instance_id, token)
-        success, error_message = whatsapp_service.test_connection()
+        
+        # Always probe (credentials may have just changed) and share the result with the drainer
+        health, _ = DatabaseManager().with_pool(
+            lambda pool: InstanceHealthCache(pool).check(instance_id, token, whatsapp_service.test_connection, force=True)
+        )
+        success = health['status'] == 'ok'
+        error_message = health['error']
         
         result = {
             'success': success,
             'message': 'Connection successful' if success else error_message,
-            'tested_at': datetime.utcnow().isoformat()
+            'status': health['status'],
+            'tested_at': health['checked_at'].isoformat()
         }
         
         if success:
@@ -0,0 +1,93 @@
+import json
+from typing import Dict, Any, List, Optional, Tuple
+from message_templates import TemplateError, compile_template
+
+# Offsets are days before the due date; negative values are days overdue
+MIN_OFFSET_DAYS = -30
+MAX_OFFSET_DAYS = 60
+MAX_SCHEDULE_ENTRIES = 10
+
+# Schedule used until a user saves their own, built from the legacy template columns
+DEFAULT_OFFSETS = {
+    7: 'reminder_template_7_days',
+    0: 'reminder_template_due_today'
+}
+
+def default_template_key(days_before_due: int) -> str:
+    """DEFAULT_TEMPLATES key used when an offset has no template of its own"""
+    if days_before_due == 0:
+        return 'reminder_due_today'
+    if days_before_due > 0:
+        return 'reminder_7_days'
+    return 'reminder_overdue'
+
+def template_type_for_offset(days_before_due: int) -> str:
+    """Stable template type per offset; the legacy offsets keep their original names"""
+    if days_before_due == 0:
+        return 'due_today'
+    if days_before_due > 0:
+        return f'{days_before_due}_days'
+    return f'{-days_before_due}_days_overdue'
+
+def parse_schedule(value) -> Optional[List[Dict[str, Any]]]:
+    """Schedule entries from the reminder_schedule Json column (None if unset)"""
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        value = json.loads(value)
+    return value or None
+
+def validate_schedule(value) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Validate a reminder schedule submitted through the settings API
+
+    Expects a list of {"days_before_due": int, "template": str | null}; a null
+    template falls back to the default template for the offset.
+
+    Returns:
+        Tuple of (sanitized_entries, validation_errors)
+    """
+    if not isinstance(value, list) or not value:
+        return [], ['reminder_schedule must be a non-empty list']
+    if len(value) > MAX_SCHEDULE_ENTRIES:
+        return [], [f'reminder_schedule must have at most {MAX_SCHEDULE_ENTRIES} entries']
+
+    entries = []
+    errors = []
+    seen = set()
+    for index, entry in enumerate(value):
+        days = entry.get('days_before_due') if isinstance(entry, dict) else None
+        if not isinstance(days, int) or isinstance(days, bool) or not (MIN_OFFSET_DAYS <= days <= MAX_OFFSET_DAYS):
+            errors.append(f'reminder_schedule[{index}]: days_before_due must be an integer between {MIN_OFFSET_DAYS} and {MAX_OFFSET_DAYS}')
+            continue
+        if days in seen:
+            errors.append(f'reminder_schedule[{index}]: duplicate offset {days}')
+            continue
+        seen.add(days)
+
+        template = entry.get('template')
+        if template is not None:
+            if not isinstance(template, str) or not template.strip() or len(template) > 1000:
+                errors.append(f'reminder_schedule[{index}]: template must be 1-1000 characters')
+                continue
+            template = template.strip()
+            try:
+                compile_template(template)
+            except TemplateError as e:
+                errors.extend(f'reminder_schedule[{index}]: {error}' for error in e.errors)
+                continue
+        entries.append({'days_before_due': days, 'template': template})
+
+    entries.sort(key=lambda entry: -entry['days_before_due'])
+    return entries, errors
+
+def schedule_entries(settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """A user's schedule as saved, or the legacy two-offset schedule if none was saved"""
+    entries = parse_schedule(settings.get('reminder_schedule'))
+    if entries is None:
+        return [{'days_before_due': days, 'template': settings.get(column)} for days, column in DEFAULT_OFFSETS.items()]
+    return entries
+
+def user_schedule(settings: Dict[str, Any]) -> Dict[int, Optional[str]]:
+    """{days_before_due: template text or None for the default} for a user's settings"""
+    return {entry['days_before_due']: entry.get('template') for entry in schedule_entries(settings)}
@@ -91,7 +91,7 @@ def void_installment_allocation(installment_id, allocation_id, user_id):
 
                     # Get wallet balance for update
                     wallet_query = """
-                    SELECT version FROM wallet_balances
+                    SELECT balance_minor_units, version FROM wallet_balances
                     WHERE wallet_id = $wallet_id AND user_id = $user_id
                     """
                     wallet_result = tx.execute(wallet_query, {
@@ -102,6 +102,7 @@ def void_installment_allocation(installment_id, allocation_id, user_id):
                     if not wallet_rows:
                         raise ValueError("Wallet balance not found for the allocation wallet")
                     wallet_version = wallet_rows[0].version
+                    balance_after = wallet_rows[0].balance_minor_units + allocation.amount_minor_units
 
                     now_iso = datetime.utcnow().isoformat()
 
@@ -112,15 +113,29 @@ def void_installment_allocation(installment_id, allocation_id, user_id):
                     """
                     tx.execute(update_alloc_query, {'$allocation_id': allocation_id, '$user_id': user_id})
                     
+                    # Take the voided amount off the installment's allocated total
+                    # (a NULL total stays NULL and is recomputed by the next allocation)
+                    update_installment_query = """
+                    UPDATE installments
+                    SET allocated_minor_units = allocated_minor_units - $amount
+                    WHERE id = $installment_id AND user_id = $user_id
+                    """
+                    tx.execute(update_installment_query, {
+                        '$amount': allocation.amount_minor_units,
+                        '$installment_id': installment_id,
+                        '$user_id': user_id
+                    })
+                    
                     # Create credit transaction (reversal)
                     reversal_txn_id = str(uuid.uuid4())
                     reversal_query = """
                     INSERT INTO ledger_transactions (
                         id, wallet_id, user_id, direction, amount_minor_units, currency,
-                        reference_type, reference_id, description, created_by, created_at
+                        reference_type, reference_id, description, created_by, created_at,
+                        balance_after_minor_units
                     ) VALUES (
                         $id, $wallet_id, $user_id, 'credit', $amount, 'RUB',
-                        'reversal', $ref_id, $desc, $user_id, $now
+                        'reversal', $ref_id, $desc, $user_id, $now, $balance_after
                     )
                     """
                     tx.execute(reversal_query, {
@@ -130,7 +145,8 @@ def void_installment_allocation(installment_id, allocation_id, user_id):
                         '$amount': allocation.amount_minor_units,
                         '$ref_id': allocation_id,
                         '$desc': f"Reversal for allocation {allocation_id}",
-                        '$now': now_iso
+                        '$now': now_iso,
+                        '$balance_after': balance_after
                     })
                     
                     # Update wallet balance
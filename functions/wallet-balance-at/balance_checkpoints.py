@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+# One checkpoint per wallet per UTC day
+CHECKPOINT_INTERVAL = timedelta(days=1)
+
+# A checkpoint holds the balance of every ledger entry created before as_of
+WALLET_BALANCE_CHECKPOINTS_TABLE = """
+CREATE TABLE wallet_balance_checkpoints (
+    user_id Utf8 NOT NULL,
+    wallet_id Utf8 NOT NULL,
+    as_of Timestamp NOT NULL,
+    balance_minor_units Int64,
+    entry_count Uint64,
+    created_at Timestamp,
+    PRIMARY KEY (user_id, wallet_id, as_of)
+);
+"""
+
+def to_datetime(value):
+    """Convert YDB timestamp (microseconds) to datetime"""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value / 1000000)
+    return value
+
+def checkpoint_boundary(moment: datetime) -> datetime:
+    """Latest checkpoint boundary at or before moment (UTC midnight)"""
+    return datetime(moment.year, moment.month, moment.day)
+
+def nearest_checkpoint(session, tx, user_id: str, wallet_id: str, at: datetime) -> Optional[Dict[str, Any]]:
+    """Latest checkpoint with as_of <= at, or None if the wallet has none yet"""
+    query = """
+    DECLARE $user_id AS Utf8;
+    DECLARE $wallet_id AS Utf8;
+    DECLARE $at AS Timestamp;
+    SELECT as_of, balance_minor_units, entry_count
+    FROM wallet_balance_checkpoints
+    WHERE user_id = $user_id AND wallet_id = $wallet_id AND as_of <= $at
+    ORDER BY as_of DESC
+    LIMIT 1;
+    """
+    rows = tx.execute(
+        session.prepare(query),
+        {'$user_id': user_id, '$wallet_id': wallet_id, '$at': at}
+    )[0].rows
+    if not rows:
+        return None
+    return {
+        'as_of': to_datetime(rows[0].as_of),
+        'balance_minor_units': rows[0].balance_minor_units,
+        'entry_count': rows[0].entry_count
+    }
+
+def ledger_delta(session, tx, user_id: str, wallet_id: str, start: Optional[datetime], end: datetime) -> Tuple[int, int]:
+    """
+    Signed sum of a wallet's ledger entries created in [start, end)
+
+    The range is a primary key range, so only those entries are read; start
+    None means from the first entry.
+
+    Returns:
+        Tuple of (delta_minor_units, entry_count)
+    """
+    declares = "DECLARE $user_id AS Utf8; DECLARE $wallet_id AS Utf8; DECLARE $end AS Timestamp;"
+    params = {'$user_id': user_id, '$wallet_id': wallet_id, '$end': end}
+    start_clause = ""
+    if start is not None:
+        declares += " DECLARE $start AS Timestamp;"
+        params['$start'] = start
+        start_clause = "AND created_at >= $start"
+    query = f"""
+    {declares}
+    SELECT
+        SUM(CASE WHEN direction = 'credit' THEN amount_minor_units ELSE -amount_minor_units END) AS delta,
+        COUNT(*) AS entries
+    FROM ledger_transactions
+    WHERE user_id = $user_id AND wallet_id = $wallet_id {start_clause} AND created_at < $end;
+    """
+    rows = tx.execute(session.prepare(query), params)[0].rows
+    if not rows:
+        return 0, 0
+    return rows[0].delta or 0, rows[0].entries or 0
+
+def balance_at(session, tx, user_id: str, wallet_id: str, at: datetime) -> Dict[str, Any]:
+    """
+    Balance of a wallet from the entries created before at
+
+    Starts from the nearest earlier checkpoint and applies only the entries
+    after it, so the cost does not grow with the age of the wallet.
+    """
+    checkpoint = nearest_checkpoint(session, tx, user_id, wallet_id, at)
+    start = checkpoint['as_of'] if checkpoint else None
+    delta, entries = ledger_delta(session, tx, user_id, wallet_id, start, at)
+    base = checkpoint['balance_minor_units'] if checkpoint else 0
+    base_entries = (checkpoint['entry_count'] or 0) if checkpoint else 0
+    return {
+        'balance_minor_units': base + delta,
+        'entry_count': base_entries + entries,
+        'checkpoint_as_of': start,
+        'entries_applied': entries
+    }
@@ -0,0 +1,236 @@
+import os
+import json
+import ydb
+import jwt
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from balance_checkpoints import balance_at
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class JWTAuth:
+    """Handles JWT token authentication and validation"""
+    
+    @staticmethod
+    def verify_jwt_token(token: str, token_type: str = 'access') -> dict:
+        """Verify and decode JWT token"""
+        secret_key = os.environ.get('JWT_SECRET_KEY', 'your-super-secret-jwt-key-change-in-production')
+        
+        try:
+            payload = jwt.decode(token, secret_key, algorithms=['HS256'])
+            
+            # Check token type
+            if payload.get('type') != token_type:
+                raise ValueError(f"Invalid token type. Expected {token_type}")
+            
+            return payload
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Token has expired")
+        except jwt.InvalidTokenError:
+            raise ValueError("Invalid token")
+    
+    @staticmethod
+    def extract_token_from_event(event: dict) -> Optional[str]:
+        """Extract JWT token from Authorization header"""
+        headers = event.get('headers', {})
+        
+        # Handle case-insensitive headers
+        auth_header = None
+        for key, value in headers.items():
+            if key.lower() == 'authorization':
+                auth_header = value
+                break
+        
+        if not auth_header:
+            return None
+        
+        # Extract token from Bearer header
+        if not auth_header.startswith('Bearer '):
+            return None
+        
+        return auth_header[7:]  # Remove 'Bearer ' prefix
+    
+    @staticmethod
+    def authenticate_request(event: dict) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Authenticate request and return user_id and error message
+        Returns: (user_id, error_message)
+        """
+        try:
+            # Extract JWT token
+            token = JWTAuth.extract_token_from_event(event)
+            
+            if not token:
+                return None, "Authorization header missing or invalid format"
+            
+            # Verify token
+            payload = JWTAuth.verify_jwt_token(token, 'access')
+            user_id = payload.get('user_id')
+            
+            if not user_id:
+                return None, "Invalid token: user_id not found"
+            
+            logger.info(f"Request authenticated for user: {payload.get('email', 'unknown')}")
+            return user_id, None
+            
+        except ValueError as e:
+            return None, f"Authentication failed: {str(e)}"
+        except Exception as e:
+            logger.error(f"Unexpected authentication error: {e}")
+            return None, "Authentication error"
+
+def parse_at(value: str) -> datetime:
+    """Naive UTC datetime from an ISO date or date-time; raises ValueError if malformed"""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def handler(event, context):
+    """
+    Yandex Cloud Function handler for a wallet's balance at a point in time
+    
+    Expected path parameter: id (wallet_id)
+    Expected query parameter: at (ISO date or date-time; a date means the start of that day, UTC)
+    
+    The balance covers every ledger entry created before `at`. It is computed
+    from the nearest earlier daily checkpoint plus the entries after it.
+    """
+    try:
+        # Log request
+        logger.info(f"Received wallet balance request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
+        
+        # 1. Authentication
+        user_id, auth_error = JWTAuth.authenticate_request(event)
+        if not user_id:
+            logger.warning(f"Authentication failed: {auth_error}")
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': f'Unauthorized: {auth_error}'})
+            }
+        
+        # 2. Extract wallet ID from path
+        path_parameters = event.get('pathParameters') or {}
+        wallet_id = path_parameters.get('id')
+        
+        if not wallet_id:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Wallet ID is required'})
+            }
+        
+        # 3. Parse query parameters
+        query_params = event.get('queryStringParameters') or {}
+        at_param = query_params.get('at')
+        try:
+            at = parse_at(at_param) if at_param else datetime.utcnow()
+        except ValueError:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Invalid at format. Use ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)'})
+            }
+        
+        # 4. Database operations
+        try:
+            # Use metadata authentication
+            driver_config = ydb.DriverConfig(
+                endpoint=os.environ.get('YDB_ENDPOINT'),
+                database=os.environ.get('YDB_DATABASE'),
+                credentials=ydb.iam.MetadataUrlCredentials()
+            )
+            
+            driver = ydb.Driver(driver_config)
+            driver.wait(fail_fast=True, timeout=5)
+            
+            # Create session pool
+            pool = ydb.SessionPool(driver)
+            
+            def get_wallet_balance(session):
+                tx = session.transaction(ydb.SerializableReadWrite())
+                
+                # Verify wallet exists and belongs to user
+                wallet_query = """
+                DECLARE $wallet_id AS Utf8;
+                DECLARE $user_id AS Utf8;
+                
+                SELECT id, name, currency
+                FROM wallets 
+                WHERE id = $wallet_id AND user_id = $user_id;
+                """
+                
+                wallet_result = tx.execute(
+                    session.prepare(wallet_query),
+                    {'$wallet_id': wallet_id, '$user_id': user_id}
+                )
+                
+                if not wallet_result[0].rows:
+                    tx.rollback()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Wallet not found'})
+                    }
+                
+                wallet_row = wallet_result[0].rows[0]
+                balance = balance_at(session, tx, user_id, wallet_id, at)
+                tx.commit()
+                
+                response_data = {
+                    'wallet': {
+                        'id': wallet_row['id'],
+                        'name': wallet_row['name'],
+                        'currency': wallet_row['currency'],
+                    },
+                    'at': at.isoformat(),
+                    'balance_minor_units': balance['balance_minor_units'],
+                    'balance_rubles': balance['balance_minor_units'] / 100.0,
+                    'entry_count': balance['entry_count'],
+                    'checkpoint_as_of': balance['checkpoint_as_of'].isoformat() if balance['checkpoint_as_of'] else None,
+                    'entries_applied': balance['entries_applied'],
+                }
+                
+                logger.info(f"Computed balance of wallet {wallet_id} at {at.isoformat()} from {balance['entries_applied']} entries after the checkpoint")
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps(response_data)
+                }
+            
+            # Execute with session pool
+            result = pool.retry_operation_sync(get_wallet_balance)
+            
+            # Clean up
+            driver.stop()
+            
+            return result
+            
+        except ydb.Error as e:
+            logger.error(f"YDB error: {str(e)}")
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Database operation failed'})
+            }
+        
+        except Exception as e:
+            logger.error(f"Database connection error: {str(e)}")
+            return {
+                'statusCode': 500,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Database connection failed'})
+            }
+            
+    except Exception as e:
+        # Generic error handler
+        logger.error(f"Unexpected error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Internal server error'})
+        }
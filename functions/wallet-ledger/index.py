@@ -3,6 +3,7 @@ import json
 import ydb
 import jwt
 import logging
+import base64
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
 
@@ -81,6 +82,86 @@ class JWTAuth:
             logger.error(f"Unexpected authentication error: {e}")
             return None, "Authentication error"
 
+# Page size limits
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 100
+
+# Balance of the wallet right after each ledger row, written in the same transaction as the row
+LEDGER_BALANCE_AFTER_COLUMN = """
+ALTER TABLE ledger_transactions ADD COLUMN balance_after_minor_units Int64;
+"""
+
+def add_balance_after_column(pool: ydb.SessionPool):
+    """Add balance_after_minor_units to ledger_transactions (run once)"""
+    pool.retry_operation_sync(lambda session: session.execute_scheme(LEDGER_BALANCE_AFTER_COLUMN))
+
+def encode_cursor(row) -> str:
+    """Opaque cursor holding the (created_at, id) key of the last returned row"""
+    created_at = row['created_at']
+    if isinstance(created_at, datetime):
+        created_at = int((created_at - datetime(1970, 1, 1)).total_seconds() * 1000000)
+    raw = json.dumps({'created_at': created_at, 'id': row['id']})
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """(created_at, id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return datetime.utcfromtimestamp(int(payload['created_at']) / 1000000), str(payload['id'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def backfill_balance_after(pool: ydb.SessionPool, user_id: str, wallet_id: str) -> int:
+    """
+    Fill balance_after_minor_units for a wallet's existing rows (run once after adding the column)
+
+    Walks the ledger oldest first in (created_at, id) pages, carrying the
+    running balance. Returns the number of rows written.
+    """
+    page_size = 500
+    balance = 0
+    after = None
+    written = 0
+    while True:
+        def read_page(session):
+            declares = ["DECLARE $user_id AS Utf8;", "DECLARE $wallet_id AS Utf8;", "DECLARE $limit AS Uint64;"]
+            params = {'$user_id': user_id, '$wallet_id': wallet_id, '$limit': page_size}
+            after_clause = ""
+            if after is not None:
+                declares += ["DECLARE $after_created_at AS Timestamp;", "DECLARE $after_id AS Utf8;"]
+                params.update({'$after_created_at': after[0], '$after_id': after[1]})
+                after_clause = "AND (created_at > $after_created_at OR (created_at = $after_created_at AND id > $after_id))"
+            query = f"""
+            {' '.join(declares)}
+            SELECT id, created_at, direction, amount_minor_units
+            FROM ledger_transactions
+            WHERE user_id = $user_id AND wallet_id = $wallet_id {after_clause}
+            ORDER BY created_at, id
+            LIMIT $limit;
+            """
+            return session.transaction(ydb.OnlineReadOnly()).execute(session.prepare(query), params, commit_tx=True)[0].rows
+
+        rows = pool.retry_operation_sync(read_page)
+        if not rows:
+            return written
+
+        updates = []
+        for row in rows:
+            balance += row.amount_minor_units if row.direction == 'credit' else -row.amount_minor_units
+            updates.append({'user_id': user_id, 'wallet_id': wallet_id, 'created_at': row.created_at, 'id': row.id, 'balance_after_minor_units': balance})
+
+        def write_page(session):
+            query = """
+            DECLARE $rows AS List<Struct<user_id: Utf8, wallet_id: Utf8, created_at: Timestamp, id: Utf8, balance_after_minor_units: Int64>>;
+            UPDATE ledger_transactions ON SELECT * FROM AS_TABLE($rows);
+            """
+            session.transaction(ydb.SerializableReadWrite()).execute(session.prepare(query), {'$rows': updates}, commit_tx=True)
+
+        pool.retry_operation_sync(write_page)
+        written += len(updates)
+        last = rows[-1]
+        after = (last.created_at, last.id)
+
 def convert_timestamp(ts):
     """Convert timestamp to ISO format"""
     if isinstance(ts, datetime):
@@ -120,11 +201,28 @@ def handler(event, context):
         
         # 3. Parse query parameters
         query_params = event.get('queryStringParameters') or {}
-        limit = min(int(query_params.get('limit', 50)), 100)  # Max 100 transactions per request
+        try:
+            limit = int(query_params.get('limit', DEFAULT_LIMIT))
+        except (ValueError, TypeError):
+            limit = DEFAULT_LIMIT
+        limit = max(1, min(limit, MAX_LIMIT))
         reference_type = query_params.get('type')  # Optional filter by transaction type
         start_date = query_params.get('start_date')  # ISO format date
         end_date = query_params.get('end_date')  # ISO format date
         
+        # Keyset cursor from the previous page (older entries follow)
+        cursor = query_params.get('cursor')
+        cursor_key = None
+        if cursor:
+            try:
+                cursor_key = decode_cursor(cursor)
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': str(e)})
+                }
+        
         # 4. Database operations
         try:
             # Use metadata authentication
@@ -168,6 +266,11 @@ def handler(event, context):
                 wallet_row = wallet_result[0].rows[0]
                 
                 # Build transaction query with filters
+                declares = [
+                    "DECLARE $wallet_id AS Utf8;",
+                    "DECLARE $user_id AS Utf8;",
+                    "DECLARE $limit AS Uint64;",
+                ]
                 base_query = """
                 SELECT 
                     id,
@@ -182,7 +285,8 @@ def handler(event, context):
                     correlation_id,
                     description,
                     created_by,
-                    created_at
+                    created_at,
+                    balance_after_minor_units
                 FROM ledger_transactions
                 WHERE wallet_id = $wallet_id AND user_id = $user_id
                 """
@@ -190,17 +294,19 @@ def handler(event, context):
                 params = {
                     '$wallet_id': wallet_id,
                     '$user_id': user_id,
-                    '$limit': limit,
+                    '$limit': limit + 1,  # One extra row tells whether another page exists
                 }
                 
                 # Add filters
                 if reference_type:
+                    declares.append("DECLARE $reference_type AS Utf8;")
                     base_query += " AND reference_type = $reference_type"
                     params['$reference_type'] = reference_type
                 
                 if start_date:
                     try:
                         start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
+                        declares.append("DECLARE $start_date AS Timestamp;")
                         base_query += " AND created_at >= $start_date"
                         params['$start_date'] = start_dt
                     except ValueError:
@@ -213,6 +319,7 @@ def handler(event, context):
                 if end_date:
                     try:
                         end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
+                        declares.append("DECLARE $end_date AS Timestamp;")
                         base_query += " AND created_at <= $end_date"
                         params['$end_date'] = end_dt
                     except ValueError:
@@ -222,18 +329,29 @@ def handler(event, context):
                             'body': json.dumps({'error': 'Invalid end_date format. Use ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)'})
                         }
                 
-                # Order by created_at DESC for most recent first, limit results
-                base_query += " ORDER BY created_at DESC LIMIT $limit;"
+                # Continue strictly after the cursor row (primary key order, so no sort or offset scan)
+                if cursor_key:
+                    declares.append("DECLARE $after_created_at AS Timestamp;")
+                    declares.append("DECLARE $after_id AS Utf8;")
+                    base_query += " AND (created_at < $after_created_at OR (created_at = $after_created_at AND id < $after_id))"
+                    params['$after_created_at'], params['$after_id'] = cursor_key
+                
+                # Most recent first; id breaks ties between rows written at the same instant
+                base_query += " ORDER BY created_at DESC, id DESC LIMIT $limit;"
                 
-                prepared_query = session.prepare(base_query)
-                result_sets = session.transaction().execute(
+                prepared_query = session.prepare('\n'.join(declares) + base_query)
+                result_sets = session.transaction(ydb.OnlineReadOnly()).execute(
                     prepared_query,
                     params,
                     commit_tx=True
                 )
                 
+                rows = result_sets[0].rows
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                
                 transactions = []
-                for row in result_sets[0].rows:
+                for row in rows:
                     transaction_data = {
                         'id': row['id'],
                         'wallet_id': row['wallet_id'],
@@ -251,16 +369,12 @@ def handler(event, context):
                         'description': row['description'],
                         'created_by': row['created_by'],
                         'created_at': convert_timestamp(row['created_at']),
+                        # Stored when the row was written; None only for rows not yet backfilled
+                        'running_balance_minor_units': row['balance_after_minor_units'],
+                        'running_balance_rubles': row['balance_after_minor_units'] / 100.0 if row['balance_after_minor_units'] is not None else None,
                     }
                     transactions.append(transaction_data)
                 
-                # Calculate running balance (from most recent to oldest)
-                running_balance = 0
-                for i in range(len(transactions) - 1, -1, -1):  # Reverse order for calculation
-                    running_balance += transactions[i]['signed_amount_minor_units']
-                    transactions[i]['running_balance_minor_units'] = running_balance
-                    transactions[i]['running_balance_rubles'] = running_balance / 100.0
-                
                 response_data = {
                     'wallet': {
                         'id': wallet_row['id'],
@@ -272,7 +386,8 @@ def handler(event, context):
                     'pagination': {
                         'limit': limit,
                         'count': len(transactions),
-                        'has_more': len(transactions) == limit,  # Assume more if we hit the limit
+                        'has_more': has_more,
+                        'next_cursor': encode_cursor(rows[-1]) if has_more else None,
                     },
                     'filters': {
                         'reference_type': reference_type,
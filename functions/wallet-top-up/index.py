@@ -6,6 +6,7 @@ import jwt
 import logging
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple
+from idempotency import idempotent, authenticated_user_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -159,6 +160,7 @@ class SecurityValidator:
         
         return sanitized, errors
 
+@idempotent('wallet-top-up', lambda event: JWTAuth.authenticate_request(event)[0])
 def handler(event, context):
     """
     Yandex Cloud Function handler to add funds to a wallet (top-up)
@@ -168,7 +170,10 @@ def handler(event, context):
         logger.info(f"Received wallet top-up request from IP: {event.get('headers', {}).get('x-forwarded-for', 'unknown')}")
         
         # 1. Authentication
-        user_id, auth_error = JWTAuth.authenticate_request(event)
+        # idempotent() has already authenticated requests carrying an Idempotency-Key
+        user_id, auth_error = authenticated_user_id(event), None
+        if not user_id:
+            user_id, auth_error = JWTAuth.authenticate_request(event)
         if not user_id:
             logger.warning(f"Authentication failed: {auth_error}")
             return {
@@ -267,6 +272,10 @@ def handler(event, context):
                         'body': json.dumps({'error': 'Cannot top up archived wallet'})
                     }
                 
+                # Balance read, ledger row and balance update commit together so
+                # the row's balance_after_minor_units matches the stored balance
+                tx = session.transaction(ydb.SerializableReadWrite())
+                
                 # Get current balance for optimistic locking
                 balance_query = """
                 DECLARE $wallet_id AS Utf8;
@@ -278,13 +287,13 @@ def handler(event, context):
                 """
                 
                 prepared_balance = session.prepare(balance_query)
-                balance_result = session.transaction().execute(
+                balance_result = tx.execute(
                     prepared_balance,
-                    {'$wallet_id': wallet_id, '$user_id': user_id},
-                    commit_tx=True
+                    {'$wallet_id': wallet_id, '$user_id': user_id}
                 )
                 
                 if not balance_result[0].rows:
+                    tx.rollback()
                     return {
                         'statusCode': 500,
                         'headers': {'Content-Type': 'application/json'},
@@ -314,16 +323,17 @@ def handler(event, context):
                 DECLARE $description AS Utf8;
                 DECLARE $created_by AS Utf8;
                 DECLARE $created_at AS Timestamp;
+                DECLARE $balance_after_minor_units AS Int64;
                 
                 INSERT INTO ledger_transactions (
                   id, wallet_id, user_id, direction, amount_minor_units, currency,
                   reference_type, reference_id, group_id, correlation_id,
-                  description, created_by, created_at
+                  description, created_by, created_at, balance_after_minor_units
                 ) 
                 VALUES (
                   $id, $wallet_id, $user_id, $direction, $amount_minor_units, $currency,
                   $reference_type, $reference_id, $group_id, $correlation_id,
-                  $description, $created_by, $created_at
+                  $description, $created_by, $created_at, $balance_after_minor_units
                 );
                 """
                 
@@ -341,10 +351,11 @@ def handler(event, context):
                     '$description': sanitized_data['description'],
                     '$created_by': user_id,
                     '$created_at': current_time,
+                    '$balance_after_minor_units': new_balance,
                 }
                 
                 prepared_transaction = session.prepare(transaction_query)
-                session.transaction().execute(prepared_transaction, transaction_data, commit_tx=True)
+                tx.execute(prepared_transaction, transaction_data)
                 
                 # Update wallet balance with optimistic locking
                 update_balance_query = """
@@ -374,7 +385,8 @@ def handler(event, context):
                 }
                 
                 prepared_update = session.prepare(update_balance_query)
-                session.transaction().execute(prepared_update, balance_data, commit_tx=True)
+                tx.execute(prepared_update, balance_data)
+                tx.commit()
                 
                 logger.info(f"Wallet {wallet_id} topped up with {sanitized_data['amount_minor_units']} minor units")
                 return {
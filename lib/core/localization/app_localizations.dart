@@ -604,6 +604,21 @@ class AppLocalizations {
   String get failedToSendReminders => locale.languageCode == 'ru'
       ? 'Не удалось отправить напоминания'
       : 'Failed to send reminders';
+  String get remindersQueued => locale.languageCode == 'ru'
+      ? 'Напоминания поставлены в очередь'
+      : 'Reminders queued';
+  String get remindersSentSoFar => locale.languageCode == 'ru'
+      ? 'отправлено'
+      : 'sent so far';
+  String get remindersPending => locale.languageCode == 'ru'
+      ? 'ожидают отправки'
+      : 'pending';
+  String get remindersStillSending => locale.languageCode == 'ru'
+      ? 'Остальные напоминания будут отправлены автоматически.'
+      : 'The remaining reminders will be sent automatically.';
+  String get checkStatus => locale.languageCode == 'ru'
+      ? 'Проверить статус'
+      : 'Check status';
       
   // WhatsApp integration
   String get whatsAppIntegration => locale.languageCode == 'ru'
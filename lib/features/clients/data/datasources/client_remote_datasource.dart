@@ -15,6 +15,11 @@ abstract class ClientRemoteDataSource {
 class ClientRemoteDataSourceImpl implements ClientRemoteDataSource {
   final CacheService _cache = CacheService();
 
+  // Resume requests for a batched delete that answers 202
+  static const int _maxDeleteAttempts = 10;
+  static const Duration _deleteRetryDelay = Duration(seconds: 1);
+  static const Duration _maxDeleteRetryDelay = Duration(seconds: 8);
+
   @override
   Future<List<ClientModel>> getAllClients(String userId) async {
     // Check cache first
@@ -92,7 +97,23 @@ class ClientRemoteDataSourceImpl implements ClientRemoteDataSource {
 
   @override
   Future<void> deleteClient(String id) async {
-    final response = await ApiClient.delete('/clients/$id');
+    // Large deletions run in batches; 202 means the server made progress
+    // and the same request resumes the job. Retries back off and stop after
+    // _maxDeleteAttempts; the job is kept, so a later delete resumes it.
+    var response = await ApiClient.delete('/clients/$id');
+    var attempts = 1;
+    var delay = _deleteRetryDelay;
+    while (response.statusCode == 202) {
+      if (attempts >= _maxDeleteAttempts) {
+        throw const ApiException('Client deletion is still in progress. Please try again later.');
+      }
+      await Future.delayed(delay);
+      if (delay < _maxDeleteRetryDelay) {
+        delay *= 2;
+      }
+      response = await ApiClient.delete('/clients/$id');
+      attempts++;
+    }
     ApiClient.handleResponse(response);
     
     // Invalidate cache after deleting
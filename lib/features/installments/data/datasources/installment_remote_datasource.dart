@@ -28,6 +28,9 @@ abstract class InstallmentRemoteDataSource {
 class InstallmentRemoteDataSourceImpl implements InstallmentRemoteDataSource {
   final CacheService _cache = CacheService();
 
+  // search-installments returns at most this many results per page (its MAX_LIMIT)
+  static const int _searchPageSize = 1000;
+
   @override
   Future<List<InstallmentModel>> getAllInstallments(String userId) async {
     // Check cache first
@@ -141,12 +144,24 @@ class InstallmentRemoteDataSourceImpl implements InstallmentRemoteDataSource {
   @override
   Future<List<InstallmentModel>> searchInstallments(String userId, String query) async {
     final encodedQuery = Uri.encodeComponent(query);
-    final response = await ApiClient.get('/installments/search?user_id=$userId&query=$encodedQuery',
-        timeout: const Duration(seconds: 20));
-    ApiClient.handleResponse(response);
-    
-    final List<dynamic> jsonList = json.decode(response.body);
-    return jsonList.map((json) => InstallmentModel.fromMap(json)).toList();
+    final installments = <InstallmentModel>[];
+    String? cursor;
+
+    // Results come in pages; follow X-Next-Cursor until the last one
+    do {
+      final cursorParam = cursor != null ? '&cursor=${Uri.encodeComponent(cursor)}' : '';
+      final response = await ApiClient.get(
+          '/installments/search?user_id=$userId&query=$encodedQuery&limit=$_searchPageSize$cursorParam',
+          timeout: const Duration(seconds: 20));
+      ApiClient.handleResponse(response);
+
+      // Search returns the same pre-calculated fields as the list endpoint
+      final List<dynamic> jsonList = json.decode(response.body);
+      installments.addAll(jsonList.map((json) => InstallmentModel.fromMapOptimized(json)));
+      cursor = response.headers['x-next-cursor'];
+    } while (cursor != null && cursor.isNotEmpty);
+
+    return installments;
   }
 
   @override
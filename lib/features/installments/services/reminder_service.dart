@@ -100,49 +100,13 @@ class ReminderService {
         Navigator.of(context).pop();
       }
 
-      // Show appropriate success or error message
-      if (result['successful_sends'] != null && result['successful_sends'] > 0) {
-        if (result['failed_sends'] != null && result['failed_sends'] > 0) {
-          // Partial success
-          _showPartialSuccessDialog(
-            context,
-            result['successful_sends'],
-            result['failed_sends'],
-            result['results'],
-          );
-        } else {
-          // Complete success
-          final l10n = AppLocalizations.of(context);
-          ErrorHandler.showSuccessSnackBar(
-            context,
-            isBulk
-                ? '${result['successful_sends']} ${l10n?.reminderSentMultiple ?? 'Reminders sent'}!'
-                : '${l10n?.reminderSent ?? 'Reminder sent'}!',
-          );
-        }
-      } else {
-        // Complete failure
-        final errors = (result['results'] as List?)
-                ?.map((r) => r['error'] ?? 'Unknown error')
-                .toSet()
-                .toList() ??
-            ['Unknown error'];
-
-        final l10n = AppLocalizations.of(context);
-        _showErrorDialog(
-          context,
-          isBulk
-              ? l10n?.failedToSendReminders ?? 'Failed to send reminders'
-              : l10n?.failedToSendReminder ?? 'Failed to send reminder',
-          errors.join('\n'),
-          onRetry: ErrorHandler.isRetryable(errors.first) ? () => _sendReminders(
-            context: context,
-            installmentIds: installmentIds,
-            templateType: templateType,
-            isBulk: isBulk,
-          ) : null,
-        );
-      }
+      _showJobResult(
+        context,
+        result,
+        installmentIds: installmentIds,
+        templateType: templateType,
+        isBulk: isBulk,
+      );
     } catch (e) {
       // Close loading dialog if open
       if (Navigator.of(context).canPop()) {
@@ -163,6 +127,149 @@ class ReminderService {
     }
   }
 
+  /// Show the outcome of a reminder job, or its progress while it is still sending
+  static void _showJobResult(
+    BuildContext context,
+    Map<String, dynamic> result, {
+    required List<String> installmentIds,
+    required String templateType,
+    required bool isBulk,
+  }) {
+    // A job with pending reminders is never retried: a new job would send them twice
+    if (result['status'] == 'running' || (result['pending_count'] ?? 0) > 0) {
+      _showQueuedDialog(
+        context,
+        result,
+        installmentIds: installmentIds,
+        templateType: templateType,
+        isBulk: isBulk,
+      );
+      return;
+    }
+
+    if (result['successful_sends'] != null && result['successful_sends'] > 0) {
+      if (result['failed_sends'] != null && result['failed_sends'] > 0) {
+        // Partial success
+        _showPartialSuccessDialog(
+          context,
+          result['successful_sends'],
+          result['failed_sends'],
+          result['results'],
+        );
+      } else {
+        // Complete success
+        final l10n = AppLocalizations.of(context);
+        ErrorHandler.showSuccessSnackBar(
+          context,
+          isBulk
+              ? '${result['successful_sends']} ${l10n?.reminderSentMultiple ?? 'Reminders sent'}!'
+              : '${l10n?.reminderSent ?? 'Reminder sent'}!',
+        );
+      }
+    } else {
+      // Complete failure
+      final errors = (result['results'] as List?)
+              ?.map((r) => r['error'] ?? 'Unknown error')
+              .toSet()
+              .toList() ??
+          ['Unknown error'];
+
+      final l10n = AppLocalizations.of(context);
+      _showErrorDialog(
+        context,
+        isBulk
+            ? l10n?.failedToSendReminders ?? 'Failed to send reminders'
+            : l10n?.failedToSendReminder ?? 'Failed to send reminder',
+        errors.join('\n'),
+        onRetry: ErrorHandler.isRetryable(errors.first) ? () => _sendReminders(
+          context: context,
+          installmentIds: installmentIds,
+          templateType: templateType,
+          isBulk: isBulk,
+        ) : null,
+      );
+    }
+  }
+
+  /// Show progress of a job that is still sending; offers polling again, never a resend
+  static void _showQueuedDialog(
+    BuildContext context,
+    Map<String, dynamic> result, {
+    required List<String> installmentIds,
+    required String templateType,
+    required bool isBulk,
+  }) {
+    final l10n = AppLocalizations.of(context);
+    final sent = result['successful_sends'] ?? 0;
+    final pending = result['pending_count'];
+    final jobId = result['job_id'] as String?;
+
+    showDialog(
+      context: context,
+      builder: (dialogContext) => AlertDialog(
+        title: Text(l10n?.remindersQueued ?? 'Reminders queued'),
+        content: Text(
+          '$sent ${l10n?.remindersSentSoFar ?? 'sent so far'}'
+          '${pending != null ? ', $pending ${l10n?.remindersPending ?? 'pending'}' : ''}.\n'
+          '${l10n?.remindersStillSending ?? 'The remaining reminders will be sent automatically.'}',
+        ),
+        actions: [
+          TextButton(
+            onPressed: () => Navigator.of(dialogContext).pop(),
+            child: Text(l10n?.ok ?? 'OK'),
+          ),
+          if (jobId != null)
+            ElevatedButton(
+              onPressed: () {
+                Navigator.of(dialogContext).pop();
+                _followJob(
+                  context,
+                  jobId,
+                  installmentIds: installmentIds,
+                  templateType: templateType,
+                  isBulk: isBulk,
+                );
+              },
+              child: Text(l10n?.checkStatus ?? 'Check status'),
+            ),
+        ],
+      ),
+    );
+  }
+
+  /// Keep polling a queued job and show its updated outcome
+  static Future<void> _followJob(
+    BuildContext context,
+    String jobId, {
+    required List<String> installmentIds,
+    required String templateType,
+    required bool isBulk,
+  }) async {
+    showDialog(
+      context: context,
+      barrierDismissible: false,
+      builder: (context) => const AlertDialog(
+        content: Column(
+          mainAxisSize: MainAxisSize.min,
+          children: [CircularProgressIndicator()],
+        ),
+      ),
+    );
+
+    final result = await WhatsAppApiService.followReminderJob(jobId, waitFor: const Duration(seconds: 30));
+
+    if (Navigator.of(context).canPop()) {
+      Navigator.of(context).pop();
+    }
+    _showJobResult(
+      context,
+      result,
+      installmentIds: installmentIds,
+      templateType: templateType,
+      isBulk: isBulk,
+    );
+  }
+
   /// Show a success snackbar
   static void _showSuccessSnackBar(BuildContext context, String message) {
     ScaffoldMessenger.of(context).showSnackBar(
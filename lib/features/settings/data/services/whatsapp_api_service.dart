@@ -81,9 +81,17 @@ class WhatsAppApiService {
   }
 
   /// Send manual WhatsApp reminder
+  ///
+  /// The server queues the reminders as a job; this polls the job until every
+  /// reminder is sent or failed, or until [waitFor] elapses. A job that is
+  /// still sending is returned with status 'running' and its job_id, so the
+  /// caller can keep following it with [getReminderJob] instead of queueing
+  /// the reminders again. Only a failure to queue the job throws.
   static Future<Map<String, dynamic>> sendManualReminder({
     required List<String> installmentIds,
     String templateType = 'manual',
+    Duration waitFor = const Duration(seconds: 90),
+    Duration pollInterval = const Duration(seconds: 2),
   }) async {
     try {
       final body = {
@@ -94,9 +102,41 @@ class WhatsAppApiService {
       final response = await ApiClient.post('$_baseEndpoint/send-manual-reminder', body);
       ApiClient.handleResponse(response);
       
-      return json.decode(response.body) as Map<String, dynamic>;
+      final job = json.decode(response.body) as Map<String, dynamic>;
+      return await followReminderJob(job['job_id'] as String, waitFor: waitFor, pollInterval: pollInterval);
     } catch (e) {
       throw Exception('Failed to send manual reminder: $e');
     }
   }
+
+  /// Poll a queued reminder job until it completes or [waitFor] elapses
+  ///
+  /// Never throws once the job exists: a failed poll returns the last known
+  /// progress with status 'running', since the reminders are still queued.
+  static Future<Map<String, dynamic>> followReminderJob(
+    String jobId, {
+    Duration waitFor = const Duration(seconds: 90),
+    Duration pollInterval = const Duration(seconds: 2),
+  }) async {
+    final deadline = DateTime.now().add(waitFor);
+    Map<String, dynamic> progress = {'job_id': jobId, 'status': 'running', 'successful_sends': 0, 'failed_sends': 0};
+    try {
+      progress = await getReminderJob(jobId);
+      while (progress['status'] != 'completed' && DateTime.now().isBefore(deadline)) {
+        await Future.delayed(pollInterval);
+        progress = await getReminderJob(jobId);
+      }
+    } catch (_) {
+      progress = {...progress, 'status': 'running'};
+    }
+    return progress;
+  }
+
+  /// Get the progress of a manual reminder job
+  static Future<Map<String, dynamic>> getReminderJob(String jobId) async {
+    final response = await ApiClient.get('$_baseEndpoint/reminder-jobs/$jobId');
+    ApiClient.handleResponse(response);
+    
+    return json.decode(response.body) as Map<String, dynamic>;
+  }
 }
\ No newline at end of file